@@ -82,6 +82,7 @@ def create_app() -> FastAPI:
 
     @asynccontextmanager
     async def lifespan(_: FastAPI):
+        await unified_gateway.startup()
         yield
         await unified_gateway.shutdown()
 
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import os
 from typing import AsyncIterator, Any, Union
 
 
@@ -10,6 +11,14 @@ class Cache:
         self.data = data
         self.mime_type = mime_type
 
+    @property
+    def size(self) -> Union[int, None]:
+        if self.path:
+            return os.path.getsize(self.path)
+        elif self.data is not None:
+            return len(self.data)
+        return None
+
 
 class CacheStorage(ABC):
     @abstractmethod
@@ -0,0 +1,112 @@
+import re
+import struct
+from typing import Optional
+
+MP3_BITRATES = {
+    # (MPEG1, layer): kbps by bitrate index
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+# Bytes per sample of .au encodings (1: μ-law, 27: A-law)
+AU_SAMPLE_WIDTHS = {1: 1, 2: 1, 3: 2, 4: 3, 5: 4, 6: 4, 7: 8, 27: 1}
+
+
+def get_wave_duration(data: bytes) -> Optional[float]:
+    # Walk RIFF chunks instead of decoding. Open-ended data size (streaming) is clamped to the actual length
+    byte_rate = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack("<4sI", data[position:position + 8])
+        position += 8
+        if chunk_id == b"fmt ":
+            byte_rate = struct.unpack("<I", data[position + 8:position + 12])[0]
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            return min(chunk_size, len(data) - position) / byte_rate
+        position += chunk_size + chunk_size % 2
+    return None
+
+
+def get_au_duration(data: bytes) -> Optional[float]:
+    if len(data) < 24:
+        return None
+    offset, data_size, encoding, sample_rate, channels = struct.unpack(">IIIII", data[4:24])
+    sample_width = AU_SAMPLE_WIDTHS.get(encoding)
+    if not sample_width or not sample_rate or not channels:
+        return None
+    return min(data_size, len(data) - offset) / (sample_width * sample_rate * channels)
+
+
+def get_mp3_duration(data: bytes) -> Optional[float]:
+    # Jump from frame header to frame header without decoding
+    position = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        position = 10 + size + (10 if data[5] & 0x10 else 0)
+
+    duration = 0.0
+    first_frame = True
+    while position + 4 <= len(data):
+        b1, b2, b3 = data[position + 1], data[position + 2], data[position + 3]
+        version = (b1 >> 3) & 0x03
+        layer = 4 - ((b1 >> 1) & 0x03)
+        bitrate_index = b2 >> 4
+        sample_rate_index = (b2 >> 2) & 0x03
+        if (
+            data[position] != 0xFF or (b1 & 0xE0) != 0xE0 or version == 1 or layer == 4
+            or bitrate_index in (0, 15) or sample_rate_index == 3
+        ):
+            # Not a frame header (e.g. ID3v1 tag or garbage). Resync to the next candidate
+            next_position = data.find(b"\xff", position + 1)
+            if next_position < 0:
+                break
+            position = next_position
+            continue
+
+        is_mpeg1 = version == 3
+        bitrate = MP3_BITRATES[(is_mpeg1, layer)][bitrate_index] * 1000
+        sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+        padding = (b2 >> 1) & 0x01
+        if layer == 1:
+            samples = 384
+            frame_length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            samples = 1152 if layer == 2 or is_mpeg1 else 576
+            frame_length = samples // 8 * bitrate // sample_rate + padding
+
+        # Xing/Info frame at the head carries no audio
+        if not (first_frame and (b"Xing" in data[position:position + frame_length] or b"Info" in data[position:position + frame_length])):
+            duration += samples / sample_rate
+        first_frame = False
+        position += frame_length
+
+    return duration or None
+
+
+def get_audio_duration(data: bytes, audio_format: str = None, mulaw_rate: int = 8000) -> Optional[float]:
+    # Returns seconds of audio or None when the format is not supported
+    if not data:
+        return None
+    try:
+        if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+            return get_wave_duration(data)
+        if data[:4] == b".snd":
+            return get_au_duration(data)
+
+        audio_format = (audio_format or "").lower()
+        if "mulaw" in audio_format or "ulaw" in audio_format or "alaw" in audio_format:
+            # Headerless 8bit mono. Sample rate can be specified in the format name like `raw-8khz-8bit-mono-mulaw`
+            if khz := re.search(r"(\d+)khz", audio_format):
+                return len(data) / (int(khz.group(1)) * 1000)
+            return len(data) / mulaw_rate
+        if "mp3" in audio_format or data[:3] == b"ID3":
+            return get_mp3_duration(data)
+    except (struct.error, IndexError, ZeroDivisionError):
+        pass
+    return None
@@ -2,6 +2,14 @@ import asyncio
 from . import FormatConverter, FormatConverterError
 
 
+def strip_id3v2(data: bytes) -> bytes:
+    # Remove ID3v2 tag at the head to concatenate MP3 frames
+    if data[:3] != b"ID3" or len(data) < 10:
+        return data
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return data[10 + size + (10 if data[5] & 0x10 else 0):]
+
+
 class MP3Converter(FormatConverter):
     def __init__(self, ffmpeg_path: str = "ffmpeg", bitrate: str = "64k", output_chunksize: int = 1024):
         self.ffmpeg_path = ffmpeg_path
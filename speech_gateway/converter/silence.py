@@ -0,0 +1,84 @@
+import io
+from typing import Tuple
+import wave
+import numpy as np
+from . import FormatConverter, FormatConverterError
+
+
+class SilenceTrimmer(FormatConverter):
+    def __init__(self, threshold_db: float = -45.0, padding_ms: int = 50, frame_ms: int = 10, gap_ms: int = 200):
+        # gap_ms of silence is put between the sentences of split text in place of the pauses trimmed
+        self.threshold_db = threshold_db
+        self.padding_ms = padding_ms
+        self.frame_ms = frame_ms
+        self.gap_ms = gap_ms
+
+    def trim(self, input_bytes: bytes) -> Tuple[bytes, float]:
+        # Only PCM wave is supported. Return other formats as they are
+        if input_bytes[:4] != b"RIFF" or input_bytes[8:12] != b"WAVE":
+            return input_bytes, 0.0
+
+        try:
+            with wave.open(io.BytesIO(input_bytes), "rb") as wf:
+                nchannels = wf.getnchannels()
+                sampwidth = wf.getsampwidth()
+                framerate = wf.getframerate()
+                raw_frames = wf.readframes(wf.getnframes())
+        except wave.Error:
+            # Not integer PCM (e.g. float32 wave). Not trimmed rather than failing the request
+            return input_bytes, 0.0
+        except Exception as ex:
+            raise FormatConverterError(f"Error during reading wave for silence trimming: {str(ex)}")
+
+        if sampwidth == 2:
+            samples = np.frombuffer(raw_frames, dtype="<i2")
+            full_scale = 32768.0
+        elif sampwidth == 4:
+            samples = np.frombuffer(raw_frames, dtype="<i4")
+            full_scale = 2147483648.0
+        else:
+            return input_bytes, 0.0
+
+        nframes = len(samples) // nchannels
+        if nframes == 0:
+            return input_bytes, 0.0
+        samples = samples[:nframes * nchannels].reshape(nframes, nchannels)
+
+        # RMS energy for each window (frame_ms) in dBFS, computed at once
+        window = max(1, int(framerate * self.frame_ms / 1000))
+        nwindows = -(-nframes // window)
+        mono = np.abs(samples.astype(np.float32)).max(axis=1) / full_scale
+        padded = np.zeros(nwindows * window, dtype=np.float32)
+        padded[:nframes] = mono
+        rms = np.sqrt(np.mean(np.square(padded.reshape(nwindows, window)), axis=1))
+        voiced = np.flatnonzero(20 * np.log10(np.maximum(rms, 1e-10)) > self.threshold_db)
+
+        if len(voiced) == 0:
+            # Keep all-silent audio as it is to avoid returning empty wave
+            return input_bytes, 0.0
+
+        padding = int(framerate * self.padding_ms / 1000)
+        start = max(0, voiced[0] * window - padding)
+        end = min(nframes, (voiced[-1] + 1) * window + padding)
+        if start == 0 and end == nframes:
+            return input_bytes, 0.0
+
+        output_io = io.BytesIO()
+        with wave.open(output_io, "wb") as wf_out:
+            wf_out.setnchannels(nchannels)
+            wf_out.setsampwidth(sampwidth)
+            wf_out.setframerate(framerate)
+            wf_out.writeframes(samples[start:end].tobytes())
+
+        trimmed_ms = (nframes - (end - start)) * 1000 / framerate
+        return output_io.getvalue(), trimmed_ms
+
+    async def convert(self, input_bytes: bytes) -> bytes:
+        try:
+            audio_data, _ = self.trim(input_bytes)
+            return audio_data
+
+        except FormatConverterError:
+            raise
+        except Exception as ex:
+            raise FormatConverterError(f"Error during silence trimming: {str(ex)}")
@@ -0,0 +1,69 @@
+import io
+import struct
+from typing import List, Tuple
+import wave
+from . import FormatConverterError
+
+# Size fields of a wave header whose length is unknown yet (streaming)
+OPEN_ENDED_SIZE = 0xFFFFFFFF
+
+
+def create_wave_header(sample_rate: int, channels: int = 1, sample_width: int = 2, data_size: int = None) -> bytes:
+    # 44 bytes header of linear PCM. Omit data_size to stream PCM that follows
+    if data_size is None:
+        riff_size = data_size = OPEN_ENDED_SIZE
+    else:
+        riff_size = 36 + data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate,
+        sample_rate * channels * sample_width, channels * sample_width, sample_width * 8,
+        b"data", data_size
+    )
+
+
+def fix_wave_header(data: bytes) -> bytes:
+    # Set the actual sizes to the open-ended header of the streamed wave. Other data is returned as is
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return data
+
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack("<4sI", data[position:position + 8])
+        if chunk_id == b"data":
+            data_size = len(data) - position - 8
+            return b"".join([
+                data[:4], struct.pack("<I", len(data) - 8), data[8:position + 4],
+                struct.pack("<I", data_size), data[position + 8:]
+            ])
+        position += 8 + chunk_size + chunk_size % 2
+    return data
+
+
+def read_wave(data: bytes) -> Tuple[Tuple[int, int, int], bytes]:
+    # Returns (channels, sample width, sample rate) and PCM
+    with wave.open(io.BytesIO(data), "rb") as wf:
+        return (wf.getnchannels(), wf.getsampwidth(), wf.getframerate()), wf.readframes(wf.getnframes())
+
+
+def create_silence(params: Tuple[int, int, int], duration_ms: int) -> bytes:
+    # PCM of the silence in the format returned by read_wave. 8-bit PCM is unsigned
+    channels, sample_width, sample_rate = params
+    return (b"\x80" if sample_width == 1 else b"\x00") * (int(sample_rate * duration_ms / 1000) * channels * sample_width)
+
+
+def concat_waves(waves: List[bytes], gap_ms: int = 0) -> bytes:
+    # Join PCM of the waves into one wave with the header of the total size. gap_ms of silence is put between them
+    params = None
+    frames = []
+    for data in waves:
+        wave_params, pcm = read_wave(data)
+        if params and wave_params != params:
+            raise FormatConverterError(f"Waves with different formats can't be concatenated: {params} and {wave_params}")
+        params = wave_params
+        frames.append(pcm)
+
+    pcm = create_silence(params, gap_ms).join(frames)
+    channels, sample_width, sample_rate = params
+    return create_wave_header(sample_rate, channels, sample_width, len(pcm)) + pcm
@@ -1,20 +1,41 @@
 from abc import ABC, abstractmethod
+import asyncio
+import base64
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import wraps
 import hashlib
+import json
 import logging
+import math
+import os
 from time import time
-from typing import Any, Dict, Union, Optional
+from urllib.parse import urlsplit
+from typing import Any, AsyncIterator, Callable, Dict, List, Literal, Tuple, Union, Optional, TYPE_CHECKING
 from uuid import uuid4
 import aiofiles
 import httpx
-from fastapi import Request, APIRouter
-from fastapi.responses import Response, FileResponse
+from fastapi import Request, APIRouter, HTTPException
+from fastapi.responses import Response, FileResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from ..cache import Cache, CacheStorage, FileCacheStorage
-from ..converter import FormatConverter, MP3Converter
-from ..performance_recorder import PerformanceRecorder, SQLitePerformanceRecorder
+from ..converter import FormatConverter, FormatConverterError, MP3Converter
+from ..converter.mp3 import strip_id3v2
+from ..converter.duration import get_audio_duration
+from ..converter.wave_header import create_wave_header, create_silence, fix_wave_header, concat_waves, read_wave
+from ..performance_recorder import PerformanceRecorder, PerformanceTimer, SQLitePerformanceRecorder
+from ..traffic import CircuitBreaker, ConcurrencyLimiter, ConnectionWarmer, QueueTimeoutError, Upstream, UpstreamPool, connection_trace
+
+if TYPE_CHECKING:
+    from ..converter.silence import SilenceTrimmer
+    from ..splitter import TextSplitter
 
 logger = logging.getLogger(__name__)
 
+# Upstream selected for the request being processed by a load-balanced gateway
+current_upstream: ContextVar[Optional[Upstream]] = ContextVar("current_upstream", default=None)
+
 
 class UnifiedTTSRequest(BaseModel):
     text: str = Field(..., description="The text to be synthesized into speech.", example="hello")
@@ -64,6 +85,28 @@ class UnifiedTTSRequest(BaseModel):
                     "The structure and supported keys depend on each speech service.",
         example={"pitch": 1.0, "volume": 1.0},
     )
+    stream: bool = Field(
+        False,
+        description="Stream audio chunks to the client as soon as they arrive from the speech service. "
+                    "Falls back to the whole audio at once when the speech service doesn't support streaming.",
+        example=False,
+        exclude=True,   # Not a part of the cache key
+    )
+    stream_format: str = Field(
+        None,
+        description="Format of the progressive stream of sentences: `audio` (default; wave with open-ended header or MP3 frames), "
+                    "`ndjson` (a JSON line with base64 audio and metadata per sentence) or `multipart` (multipart/mixed).",
+        example="ndjson",
+        exclude=True,
+    )
+    priority: Literal["interactive", "batch"] = Field(
+        "interactive",
+        description="`interactive` requests are sent to the speech service ahead of `batch` ones (e.g. cache warm-up) "
+                    "when waiting for the concurrency limit. Batch requests are throttled while interactive ones are waiting. "
+                    "Can also be set by `X-Priority` header.",
+        example="interactive",
+        exclude=True,
+    )
 
 
 class UnifiedTTSResponse(BaseModel):
@@ -71,6 +114,22 @@ class UnifiedTTSResponse(BaseModel):
     media_type: Optional[str] = None
 
 
+class UnifiedTTSBatchRequest(BaseModel):
+    requests: List[UnifiedTTSRequest] = Field(..., description="The requests to be synthesized at once.")
+
+
+def track_in_flight(func):
+    # Count requests being processed by the gateway. Exposed as a gauge by UnifiedGateway
+    @wraps(func)
+    async def wrapper(self: "SpeechGateway", *args, **kwargs):
+        self.in_flight += 1
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            self.in_flight -= 1
+    return wrapper
+
+
 class SpeechGateway(ABC):
     HOP_BY_HOP_HEADERS = {
         "connection",
@@ -82,23 +141,47 @@ class SpeechGateway(ABC):
         "transfer-encoding",
         "upgrade",
     }
+    # Path to check the health of upstreams when load balancing among base_urls
+    HEALTH_CHECK_PATH: str = None
 
     def __init__(
         self,
         *,
         base_url: str = None,
+        base_urls: List[str] = None,
+        health_check_interval: float = 5.0,
         original_tts_path: str = None,
         original_tts_method: str = None,
         cache_dir: str = None,
         cache_storage: CacheStorage = None,
         format_converters: Dict[str, FormatConverter] = None,
+        silence_trimmer: "SilenceTrimmer" = None,
+        text_splitter: "TextSplitter" = None,
+        segment_concurrency: int = 4,
+        max_concurrency: int = None,
+        max_queue_time: float = None,
+        circuit_breaker: CircuitBreaker = None,
         max_connections: int = 100,
         max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 5.0,
+        http2: bool = False,
+        prewarm_connections: int = 0,
+        keepalive_interval: float = None,
         timeout: float = 10.0,
         follow_redirects: bool = False,
         performance_recorder: PerformanceRecorder = None,
         debug: bool = False
     ):
+        # Requests are routed to the upstream with the least outstanding requests when multiple base_urls are set
+        if base_urls:
+            self.upstream_pool = UpstreamPool(
+                base_urls,
+                health_check_path=self.HEALTH_CHECK_PATH,
+                health_check_interval=health_check_interval
+            )
+            base_url = base_urls[0]
+        else:
+            self.upstream_pool = None
         self.base_url = base_url
         self.original_tts_path = original_tts_path
         self.original_tts_method = original_tts_method
@@ -109,17 +192,206 @@ class SpeechGateway(ABC):
         else:
             self.cache_storage = None
         self.format_converters = format_converters or {"mp3": MP3Converter()}
+        self.silence_trimmer = silence_trimmer
+        # Long text is split into segments and synthesized concurrently up to segment_concurrency for each text.
+        # Segments of different texts are scheduled by the limiter in the order of their priorities
+        self.text_splitter = text_splitter
+        self.segment_concurrency = segment_concurrency
+        # Items of `tts_batch` up to segment_concurrency as well
+        self.batch_semaphore = asyncio.Semaphore(segment_concurrency)
+        # Requests to the speech service (to each upstream when load balancing) over max_concurrency wait in the queue
+        # up to max_queue_time seconds. Local engines get slower when synthesizing many at once
+        self.limiter = None
+        if max_concurrency:
+            if self.upstream_pool:
+                for upstream in self.upstream_pool.upstreams:
+                    upstream.limiter = ConcurrencyLimiter(max_concurrency, max_queue_time=max_queue_time)
+            else:
+                self.limiter = ConcurrencyLimiter(max_concurrency, max_queue_time=max_queue_time)
+        # Requests fail fast while the circuit is open not to wait for the timeout of the speech service that is down.
+        # Each upstream has a breaker of the same settings when load balancing
+        self.circuit_breaker = None
+        if circuit_breaker:
+            if self.upstream_pool:
+                for upstream in self.upstream_pool.upstreams:
+                    upstream.circuit_breaker = circuit_breaker.clone()
+            else:
+                self.circuit_breaker = circuit_breaker
         self.performance_recorder = performance_recorder or SQLitePerformanceRecorder()
+        # Set by UnifiedGateway.add_gateway. Used as a label of performance records and metrics
+        self.service_name: str = None
+        self.in_flight = 0
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        # HTTP/2 requires `h2` (pip install httpx[http2]). Requests are multiplexed over a connection
         self.http_client = httpx.AsyncClient(
             follow_redirects=follow_redirects,
             timeout=httpx.Timeout(timeout),
-            limits=httpx.Limits(
-                max_connections=max_connections,
-                max_keepalive_connections=max_keepalive_connections
-            )
+            limits=limits,
+            http2=http2,
+            # Connection pool of its own for each upstream not to be starved by a slow one
+            mounts={
+                f"all://{urlsplit(u.base_url).netloc}": httpx.AsyncHTTPTransport(limits=limits, http2=http2)
+                for u in self.upstream_pool.upstreams
+            } if self.upstream_pool else None
         )
+        # prewarm_connections connections are opened by `startup` and kept alive by the heartbeat every
+        # keepalive_interval seconds (shorter than keepalive_expiry) not to pay the handshakes after idle
+        if prewarm_connections or keepalive_interval:
+            self.connection_warmer = ConnectionWarmer(
+                self.get_warmup_urls(),
+                connections=max(prewarm_connections, 1),
+                interval=keepalive_interval
+            )
+        else:
+            self.connection_warmer = None
         self.debug = debug
 
+    @property
+    def base_url(self) -> str:
+        # The upstream selected for the current request when load balancing
+        upstream = current_upstream.get()
+        if upstream and self.upstream_pool and upstream in self.upstream_pool.upstreams:
+            return upstream.base_url
+        return self._base_url
+
+    @base_url.setter
+    def base_url(self, value: str):
+        self._base_url = value
+
+    def get_warmup_urls(self) -> List[str]:
+        # Health check path of local engines, or the root of the origin of cloud services
+        base_urls = [u.base_url for u in self.upstream_pool.upstreams] if self.upstream_pool else [self.base_url]
+        if self.HEALTH_CHECK_PATH:
+            return [base_url + self.HEALTH_CHECK_PATH for base_url in base_urls if base_url]
+        return [f"{urlsplit(base_url).scheme}://{urlsplit(base_url).netloc}/" for base_url in base_urls if base_url]
+
+    async def startup(self):
+        # Call on app startup to open the connections in advance
+        if self.upstream_pool:
+            self.upstream_pool.start(self.http_client)
+        if self.connection_warmer:
+            await self.connection_warmer.warm(self.http_client)
+            self.connection_warmer.start(self.http_client)
+
+    def acquire_upstream(self) -> Optional[Upstream]:
+        if self.connection_warmer:
+            self.connection_warmer.start(self.http_client)
+        if not self.upstream_pool:
+            return None
+        self.upstream_pool.start(self.http_client)
+        return self.upstream_pool.acquire()
+
+    def release_upstream(self, upstream: Optional[Upstream]):
+        if upstream:
+            self.upstream_pool.release(upstream)
+
+    @contextmanager
+    def bind_upstream(self, upstream: Optional[Upstream]):
+        # `base_url` refers to the upstream in this context
+        token = current_upstream.set(upstream)
+        try:
+            yield
+        finally:
+            current_upstream.reset(token)
+
+    def get_limiter(self, upstream: Optional[Upstream]) -> Optional[ConcurrencyLimiter]:
+        return upstream.limiter if upstream else self.limiter
+
+    def get_limiters(self) -> List[ConcurrencyLimiter]:
+        if self.upstream_pool:
+            return [u.limiter for u in self.upstream_pool.upstreams if u.limiter]
+        return [self.limiter] if self.limiter else []
+
+    async def wait_for_slot(self, upstream: Optional[Upstream], timer: PerformanceTimer = None, priority: str = "interactive"):
+        # Time in the queue is recorded separately from the synthesis
+        if not (limiter := self.get_limiter(upstream)):
+            return
+        try:
+            queue_wait = await limiter.acquire(priority)
+        except QueueTimeoutError as qex:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Speech service is busy. {qex}",
+                headers={"Retry-After": "1"}
+            )
+        if timer:
+            timer.phases["queue_wait_elapsed"] = timer.phases.get("queue_wait_elapsed", 0.0) + queue_wait
+
+    def release_slot(self, upstream: Optional[Upstream], priority: str = "interactive"):
+        if limiter := self.get_limiter(upstream):
+            limiter.release(priority)
+
+    def get_circuit_breaker(self, upstream: Optional[Upstream]) -> Optional[CircuitBreaker]:
+        return upstream.circuit_breaker if upstream else self.circuit_breaker
+
+    def get_circuit_breakers(self) -> Dict[str, CircuitBreaker]:
+        # Breakers by base_url
+        if self.upstream_pool:
+            return {u.base_url: u.circuit_breaker for u in self.upstream_pool.upstreams if u.circuit_breaker}
+        return {self.base_url: self.circuit_breaker} if self.circuit_breaker else {}
+
+    def is_available(self) -> bool:
+        # False while the circuits of all upstreams are open
+        breakers = self.get_circuit_breakers()
+        if self.upstream_pool and len(breakers) < len(self.upstream_pool.upstreams):
+            return True
+        return not breakers or any(b.available for b in breakers.values())
+
+    def enter_circuit(self, upstream: Optional[Upstream]) -> bool:
+        # Returns whether the request is a trial of the half-open circuit. Pass it to `exit_circuit` with the result
+        if not (breaker := self.get_circuit_breaker(upstream)):
+            return False
+        if not breaker.allow():
+            raise HTTPException(
+                status_code=503,
+                detail="Speech service is unavailable. Circuit is open",
+                headers={"Retry-After": str(max(math.ceil(breaker.retry_after), 1))}
+            )
+        return breaker.state == "half_open"
+
+    def exit_circuit(self, upstream: Optional[Upstream], trial: bool, error: BaseException = None):
+        if breaker := self.get_circuit_breaker(upstream):
+            breaker.record(self.is_upstream_success(error), trial)
+
+    def is_upstream_success(self, error: BaseException = None) -> Optional[bool]:
+        # Server errors and timeouts count as failures. None for errors that don't tell the health of the speech service
+        if error is None:
+            return True
+        if isinstance(error, httpx.HTTPStatusError):
+            return False if error.response.status_code >= 500 else None
+        if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+            return False
+        return None
+
+    @asynccontextmanager
+    async def use_upstream(self, timer: PerformanceTimer = None, priority: str = "interactive") -> AsyncIterator[Optional[Upstream]]:
+        upstream = self.acquire_upstream()
+        try:
+            trial = self.enter_circuit(upstream)
+            try:
+                await self.wait_for_slot(upstream, timer, priority)
+                try:
+                    with self.bind_upstream(upstream):
+                        yield upstream
+                finally:
+                    self.release_slot(upstream, priority)
+            except BaseException as ex:
+                self.exit_circuit(upstream, trial, ex)
+                raise
+            self.exit_circuit(upstream, trial)
+        finally:
+            self.release_upstream(upstream)
+
+    def get_priority(self, headers: dict) -> str:
+        priority = headers.get("x-priority", "interactive").lower()
+        if priority not in ("interactive", "batch"):
+            raise HTTPException(status_code=400, detail=f"Unknown priority: {priority}")
+        return priority
+
     def filter_headers(self, headers: httpx.Headers) -> dict:
         filtered = {}
         for k, v in headers.items():
@@ -143,16 +415,55 @@ class SpeechGateway(ABC):
     async def parse_audio_data(self, body: bytes, headers: dict) -> bytes:
         return body
 
+    async def from_tts_stream_request(self, tts_request: UnifiedTTSRequest) -> Optional[Dict[str, Any]]:
+        # Override to stream audio from the speech service. None means synthesizing at once by `from_tts_request`
+        return None
+
+    async def iter_stream_audio(self, httpx_response: httpx.Response, tts_request: UnifiedTTSRequest) -> AsyncIterator[bytes]:
+        # Override to transform the streamed body (e.g. prepend a wave header to raw PCM)
+        async for chunk in httpx_response.aiter_bytes():
+            yield chunk
+
+    def finalize_stream_audio(self, audio_data: bytes, tts_request: UnifiedTTSRequest) -> bytes:
+        # Audio to be cached after streaming is complete
+        return fix_wave_header(audio_data)
+
     def get_converter(self, audio_format: str) -> FormatConverter:
         if self.format_converters:
             return self.format_converters.get(audio_format)
 
+    def get_audio_duration(self, audio_data: bytes, audio_format: str) -> Optional[float]:
+        # Headerless μ-law is measured at the sample rate of its converter
+        converter = self.get_converter(audio_format)
+        return get_audio_duration(audio_data, audio_format, mulaw_rate=getattr(converter, "rate", 8000))
+
+    async def process_audio(self, audio_data: bytes, tts_request: UnifiedTTSRequest) -> Tuple[bytes, Optional[float]]:
+        # Trim and convert the audio from the speech service. Applied to every path that writes the cache
+        # so that the cached audio doesn't depend on which path missed first
+        silence_trimmed_ms = None
+        if self.silence_trimmer:
+            audio_data, silence_trimmed_ms = self.silence_trimmer.trim(audio_data)
+        if converter := self.get_converter(tts_request.audio_format):
+            audio_data = await converter.convert(audio_data)
+        return audio_data, silence_trimmed_ms
+
+    async def send_upstream(self, timer: PerformanceTimer, **request_params) -> httpx.Response:
+        # Send request and read body separately to measure time to first byte and download time
+        httpx_request = self.http_client.build_request(**request_params)
+        httpx_request.extensions["trace"] = connection_trace(timer.phases)
+        with timer.span("upstream_ttfb"):
+            httpx_response = await self.http_client.send(httpx_request, stream=True)
+        try:
+            with timer.span("download_elapsed"):
+                await httpx_response.aread()
+        finally:
+            await httpx_response.aclose()
+        return httpx_response
+
+    @track_in_flight
     async def passthrough_handler(self, request: Request, path: str):
         start_time = time()
-
-        url = self.base_url if "?" in self.base_url else f"{self.base_url}/{path}"
-        if request.query_params:
-            url += f"?{request.query_params}"
+        timer = PerformanceTimer()
 
         headers = dict(request.headers)
         headers.pop("host", None)
@@ -167,34 +478,70 @@ class SpeechGateway(ABC):
                 params=dict(request.query_params)
             )
             cache_key = self.get_cache_key(tts_request)
-            if cache_resp := await self.get_cache_response(cache_key):
+            with timer.span("cache_lookup_elapsed"):
+                cache_resp = await self.get_cache_response(cache_key)
+            if cache_resp:
                 self.performance_recorder.record(
                     process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
-                    audio_format=tts_request.audio_format, cached=1, elapsed=time() - start_time
+                    audio_format=tts_request.audio_format, cached=1, elapsed=time() - start_time,
+                    service_name=self.service_name, audio_bytes=self.get_response_size(cache_resp),
+                    **timer.phases
                 )
                 return cache_resp
 
-        r = await self.http_client.request(
-            request.method,
-            url,
-            headers=headers,
-            content=body
-        )
+        try:
+            async with self.use_upstream(timer, self.get_priority(headers)) as upstream:
+                url = self.base_url if "?" in self.base_url else f"{self.base_url}/{path}"
+                if request.query_params:
+                    url += f"?{request.query_params}"
+                r = await self.send_upstream(
+                    timer,
+                    method=request.method,
+                    url=url,
+                    headers=headers,
+                    content=body
+                )
+                # Server errors are returned to the client as they are but count as failures of the circuit
+                if r.status_code >= 500:
+                    raise httpx.HTTPStatusError(f"Server error {r.status_code}", request=r.request, response=r)
+        except httpx.HTTPStatusError as hsex:
+            r = hsex.response
+        except HTTPException:
+            raise
+        except Exception as ex:
+            self.performance_recorder.record_error(
+                process_id=cache_key if is_tts else str(uuid4()), source=self.__class__.__name__,
+                audio_format=tts_request.audio_format if is_tts else "N/A", service_name=self.service_name, error=ex
+            )
+            raise
+
+        if r.status_code >= 500:
+            self.performance_recorder.record_error(
+                process_id=cache_key if is_tts else str(uuid4()), source=self.__class__.__name__,
+                audio_format=tts_request.audio_format if is_tts else "N/A", service_name=self.service_name
+            )
 
         resp_headers = self.filter_headers(r.headers)
 
         if is_tts:
             if self.cache_storage:
-                audio_data = await self.parse_audio_data(r.content, headers=resp_headers)
-                await self.cache_storage.save_cache(data=audio_data, cache_key=cache_key)
+                with timer.span("cache_write_elapsed"):
+                    audio_data = await self.parse_audio_data(r.content, headers=resp_headers)
+                    await self.cache_storage.save_cache(data=audio_data, cache_key=cache_key)
             self.performance_recorder.record(
                 process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
-                audio_format=tts_request.audio_format, cached=0, elapsed=time() - start_time
+                audio_format=tts_request.audio_format, cached=0, elapsed=time() - start_time,
+                service_name=self.service_name, audio_bytes=len(r.content),
+                audio_duration=self.get_audio_duration(r.content, tts_request.audio_format),
+                upstream_status=r.status_code, response_bytes=len(r.content),
+                upstream=upstream.base_url if upstream else None, **timer.phases
             )
         else:
             self.performance_recorder.record(
                 process_id=str(uuid4()), source=self.__class__.__name__, text=f"Proxy:[{request.method.upper()}] {url}",
-                audio_format="N/A", cached=0, elapsed=time() - start_time
+                audio_format="N/A", cached=0, elapsed=time() - start_time,
+                service_name=self.service_name, upstream_status=r.status_code,
+                response_bytes=len(r.content), upstream=upstream.base_url if upstream else None, **timer.phases
             )
 
         if self.debug:
@@ -202,6 +549,13 @@ class SpeechGateway(ABC):
 
         return Response(content=r.content, status_code=r.status_code, headers=resp_headers)
 
+    def get_response_size(self, response: Response) -> Optional[int]:
+        if isinstance(response, FileResponse):
+            return os.path.getsize(response.path)
+        elif (body := getattr(response, "body", None)) is not None:
+            return len(body)
+        return None
+
     async def get_cache_response(self, cache_key: str) -> Response:
         if self.cache_storage:
             if cache := await self.cache_storage.get_cache(cache_key):
@@ -216,41 +570,140 @@ class SpeechGateway(ABC):
 
         return None
 
-    async def _tts(self, tts_request: UnifiedTTSRequest) -> Union[UnifiedTTSResponse, Cache]:
+    def split_text(self, tts_request: UnifiedTTSRequest) -> Optional[List[str]]:
+        # Segments are synthesized as wave to be concatenated. Formats without converters from wave are not split
+        if not self.text_splitter:
+            return None
+        if tts_request.audio_format != "wav" and not self.get_converter(tts_request.audio_format):
+            return None
+        segments = self.text_splitter.split(tts_request.text)
+        return segments if len(segments) > 1 else None
+
+    def get_segment_gap_ms(self) -> int:
+        # Pause between segments. Only needed when their leading and trailing silence is trimmed
+        return getattr(self.silence_trimmer, "gap_ms", 0)
+
+    async def read_cache(self, cache: Cache) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_cache(cache)])
+
+    async def _tts_segments(self, tts_request: UnifiedTTSRequest, segments: List[str]) -> Union[UnifiedTTSResponse, Cache]:
         start_time = time()
+        timer = PerformanceTimer()
         cache_key = self.get_cache_key(tts_request)
 
         if self.cache_storage:
-            if cache := await self.cache_storage.get_cache(cache_key):
+            with timer.span("cache_lookup_elapsed"):
+                cache = await self.cache_storage.get_cache(cache_key)
+            if cache:
                 self.performance_recorder.record(
                     process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
-                    audio_format=tts_request.audio_format, cached=1, elapsed=time() - start_time
+                    audio_format=tts_request.audio_format, cached=1, elapsed=time() - start_time,
+                    service_name=self.service_name, audio_bytes=cache.size, **timer.phases
                 )
                 return cache
 
-        httpx_response = await self.http_client.request(
-            **await self.from_tts_request(tts_request)
+        segment_slots = asyncio.Semaphore(self.segment_concurrency)
+
+        async def synthesize_segment(segment: str) -> bytes:
+            # Each segment is cached by itself to be reused by other texts
+            async with segment_slots:
+                resp = await self._tts_text(tts_request.model_copy(update={"text": segment, "audio_format": "wav"}), timer)
+            return await self.read_cache(resp) if isinstance(resp, Cache) else resp.audio_data
+
+        segment_audios = await asyncio.gather(*(synthesize_segment(segment) for segment in segments))
+
+        with timer.span("conversion_elapsed"):
+            audio_data = concat_waves(segment_audios, self.get_segment_gap_ms())
+            if tts_request.audio_format != "wav" and (converter := self.get_converter(tts_request.audio_format)):
+                audio_data = await converter.convert(audio_data)
+
+        if self.cache_storage:
+            with timer.span("cache_write_elapsed"):
+                await self.cache_storage.save_cache(data=audio_data, cache_key=cache_key)
+
+        self.performance_recorder.record(
+            process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
+            audio_format=tts_request.audio_format, cached=0, elapsed=time() - start_time,
+            service_name=self.service_name, audio_bytes=len(audio_data),
+            audio_duration=self.get_audio_duration(audio_data, tts_request.audio_format), **timer.phases
         )
-        httpx_response.raise_for_status()
+
+        return UnifiedTTSResponse(audio_data=audio_data, media_type=f"audio/{tts_request.audio_format}")
+
+    @track_in_flight
+    async def _tts(self, tts_request: UnifiedTTSRequest) -> Union[UnifiedTTSResponse, Cache]:
+        if segments := self.split_text(tts_request):
+            return await self._tts_segments(tts_request, segments)
+        return await self._tts_text(tts_request)
+
+    async def _tts_text(self, tts_request: UnifiedTTSRequest, text_timer: PerformanceTimer = None) -> Union[UnifiedTTSResponse, Cache]:
+        # With text_timer, synthesizes a segment of the text. Segments are counted and recorded as the text
+        # and their phases are added to text_timer
+        start_time = time()
+        timer = PerformanceTimer()
+        cache_key = self.get_cache_key(tts_request)
+
+        if self.cache_storage:
+            with timer.span("cache_lookup_elapsed"):
+                cache = await self.cache_storage.get_cache(cache_key)
+            if cache and text_timer:
+                text_timer.merge(timer)
+                return cache
+            if cache:
+                self.performance_recorder.record(
+                    process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
+                    audio_format=tts_request.audio_format, cached=1, elapsed=time() - start_time,
+                    service_name=self.service_name, audio_bytes=cache.size, **timer.phases
+                )
+                return cache
+
+        try:
+            async with self.use_upstream(timer, tts_request.priority) as upstream:
+                with timer.span("prepare_elapsed"):
+                    request_params = await self.from_tts_request(tts_request)
+                httpx_response = await self.send_upstream(timer, **request_params)
+                httpx_response.raise_for_status()
+        except HTTPException:
+            raise
+        except Exception as ex:
+            self.performance_recorder.record_error(
+                process_id=cache_key, source=self.__class__.__name__, audio_format=tts_request.audio_format,
+                service_name=self.service_name, error=ex
+            )
+            raise
         audio_data = await self.parse_audio_data(
             body=httpx_response.content,
             headers=dict(httpx_response.headers)
         )
 
-        if converter := self.get_converter(tts_request.audio_format):
-            audio_data = await converter.convert(audio_data)
+        with timer.span("conversion_elapsed"):
+            audio_data, silence_trimmed_ms = await self.process_audio(audio_data, tts_request)
 
         if self.cache_storage:
-            await self.cache_storage.save_cache(data=audio_data, cache_key=cache_key)
+            with timer.span("cache_write_elapsed"):
+                await self.cache_storage.save_cache(data=audio_data, cache_key=cache_key)
+
+        if text_timer:
+            if silence_trimmed_ms is not None:
+                timer.add("silence_trimmed_ms", silence_trimmed_ms)
+            text_timer.merge(timer)
+            return UnifiedTTSResponse(audio_data=audio_data, media_type=f"audio/{tts_request.audio_format}")
 
         self.performance_recorder.record(
             process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
-            audio_format=tts_request.audio_format, cached=0, elapsed=time() - start_time
+            audio_format=tts_request.audio_format, cached=0, elapsed=time() - start_time,
+            silence_trimmed_ms=silence_trimmed_ms, service_name=self.service_name,
+            audio_bytes=len(audio_data), audio_duration=self.get_audio_duration(audio_data, tts_request.audio_format),
+            upstream_status=httpx_response.status_code, response_bytes=len(httpx_response.content),
+            upstream=upstream.base_url if upstream else None, **timer.phases
         )
 
         return UnifiedTTSResponse(audio_data=audio_data, media_type=f"audio/{tts_request.audio_format}")
 
     async def unified_tts_handler(self, tts_request: UnifiedTTSRequest):
+        if tts_request.stream:
+            return await self.unified_tts_stream_handler(tts_request)
+
         resp = await self._tts(tts_request)
 
         if isinstance(resp, Cache):
@@ -265,6 +718,271 @@ class SpeechGateway(ABC):
 
         return Response(content=resp.audio_data, media_type=resp.media_type)
 
+    async def iter_cache(self, cache: Cache, chunk_size: int = 65536) -> AsyncIterator[bytes]:
+        if cache.path:
+            async with aiofiles.open(cache.path, "rb") as f:
+                while chunk := await f.read(chunk_size):
+                    yield chunk
+        elif cache.url:
+            _resp = await self.http_client.get(cache.url)
+            yield _resp.content
+        else:
+            yield cache.data
+
+    async def tts_stream(self, tts_request: UnifiedTTSRequest) -> AsyncIterator[bytes]:
+        # Yield audio chunks as soon as they arrive and cache the whole audio when complete
+        start_time = time()
+        timer = PerformanceTimer()
+        cache_key = self.get_cache_key(tts_request)
+
+        if self.cache_storage:
+            with timer.span("cache_lookup_elapsed"):
+                cache = await self.cache_storage.get_cache(cache_key)
+            if cache:
+                self.performance_recorder.record(
+                    process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
+                    audio_format=tts_request.audio_format, cached=1, elapsed=time() - start_time,
+                    service_name=self.service_name, audio_bytes=cache.size, **timer.phases
+                )
+                async for chunk in self.iter_cache(cache):
+                    yield chunk
+                return
+
+        # Released when the stream is complete. Not bound across yields as the context may differ on resumption
+        upstream = self.acquire_upstream()
+        try:
+            trial = self.enter_circuit(upstream)
+        except HTTPException:
+            self.release_upstream(upstream)
+            raise
+        try:
+            with self.bind_upstream(upstream), timer.span("prepare_elapsed"):
+                request_params = await self.from_tts_stream_request(tts_request)
+        except BaseException as ex:
+            self.exit_circuit(upstream, trial, ex)
+            self.release_upstream(upstream)
+            raise
+        if request_params is None:
+            # `_tts` enters the circuit by itself
+            if breaker := self.get_circuit_breaker(upstream):
+                breaker.record(None, trial)
+            self.release_upstream(upstream)
+            resp = await self._tts(tts_request)
+            if isinstance(resp, Cache):
+                async for chunk in self.iter_cache(resp):
+                    yield chunk
+            else:
+                yield resp.audio_data
+            return
+
+        try:
+            await self.wait_for_slot(upstream, timer, tts_request.priority)
+        except BaseException as ex:
+            self.exit_circuit(upstream, trial, ex)
+            self.release_upstream(upstream)
+            raise
+
+        # Counted while streaming from the speech service. Other cases are counted by `_tts`
+        self.in_flight += 1
+        try:
+            httpx_request = self.http_client.build_request(**request_params)
+            httpx_request.extensions["trace"] = connection_trace(timer.phases)
+            with timer.span("upstream_ttfb"):
+                httpx_response = await self.http_client.send(httpx_request, stream=True)
+            if httpx_response.is_error:
+                await httpx_response.aread()
+                await httpx_response.aclose()
+                httpx_response.raise_for_status()
+        except BaseException as ex:
+            self.in_flight -= 1
+            self.exit_circuit(upstream, trial, ex)
+            self.release_slot(upstream, tts_request.priority)
+            self.release_upstream(upstream)
+            if isinstance(ex, Exception):
+                self.performance_recorder.record_error(
+                    process_id=cache_key, source=self.__class__.__name__, audio_format=tts_request.audio_format,
+                    service_name=self.service_name, error=ex
+                )
+            raise
+
+        chunks = []
+        stream_error = None
+        try:
+            # download_elapsed doesn't include the time the client takes to consume chunks
+            stream_iterator = self.iter_stream_audio(httpx_response, tts_request)
+            while True:
+                with timer.span("download_elapsed"):
+                    try:
+                        chunk = await stream_iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                chunks.append(chunk)
+                yield chunk
+        except BaseException as ex:
+            stream_error = ex
+            raise
+        finally:
+            self.in_flight -= 1
+            self.exit_circuit(upstream, trial, stream_error)
+            self.release_slot(upstream, tts_request.priority)
+            self.release_upstream(upstream)
+            await httpx_response.aclose()
+
+        # The client has received the audio as streamed. The cached one is processed in the same way as `_tts`
+        with timer.span("conversion_elapsed"):
+            audio_data, silence_trimmed_ms = await self.process_audio(self.finalize_stream_audio(b"".join(chunks), tts_request), tts_request)
+        if self.cache_storage:
+            with timer.span("cache_write_elapsed"):
+                await self.cache_storage.save_cache(data=audio_data, cache_key=cache_key)
+
+        self.performance_recorder.record(
+            process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
+            audio_format=tts_request.audio_format, cached=0, elapsed=time() - start_time,
+            silence_trimmed_ms=silence_trimmed_ms, service_name=self.service_name, audio_bytes=len(audio_data),
+            audio_duration=self.get_audio_duration(audio_data, tts_request.audio_format),
+            upstream_status=httpx_response.status_code, response_bytes=httpx_response.num_bytes_downloaded,
+            upstream=upstream.base_url if upstream else None, **timer.phases
+        )
+
+    def join_segment_audio(self, segment_audios: List[bytes], audio_format: str) -> bytes:
+        if audio_format == "wav":
+            return concat_waves(segment_audios, self.get_segment_gap_ms())
+        elif audio_format == "mp3":
+            return segment_audios[0] + b"".join(strip_id3v2(a) for a in segment_audios[1:])
+        return b"".join(segment_audios)
+
+    async def tts_segment_stream(self, tts_request: UnifiedTTSRequest, lookahead: int = 2) -> AsyncIterator[Tuple[int, str, bytes]]:
+        # Yield (index, text, audio) of each sentence in order as soon as it's ready.
+        # Up to `lookahead` following sentences are synthesized in advance
+        start_time = time()
+        timer = PerformanceTimer()
+        cache_key = self.get_cache_key(tts_request)
+
+        if self.cache_storage:
+            with timer.span("cache_lookup_elapsed"):
+                cache = await self.cache_storage.get_cache(cache_key)
+            if cache:
+                self.performance_recorder.record(
+                    process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
+                    audio_format=tts_request.audio_format, cached=1, elapsed=time() - start_time,
+                    service_name=self.service_name, audio_bytes=cache.size, **timer.phases
+                )
+                yield 0, tts_request.text, await self.read_cache(cache)
+                return
+
+        segments = self.text_splitter.split(tts_request.text) if self.text_splitter else [tts_request.text]
+
+        segment_slots = asyncio.Semaphore(self.segment_concurrency)
+
+        async def synthesize_segment(segment: str) -> bytes:
+            async with segment_slots:
+                resp = await self._tts_text(tts_request.model_copy(update={"text": segment}), timer)
+            return await self.read_cache(resp) if isinstance(resp, Cache) else resp.audio_data
+
+        tasks = deque()
+        segment_audios = []
+        # Counted while synthesizing the segments
+        self.in_flight += 1
+        try:
+            for index, segment in enumerate(segments):
+                while len(segment_audios) + len(tasks) < min(index + 1 + lookahead, len(segments)):
+                    tasks.append(asyncio.create_task(synthesize_segment(segments[len(segment_audios) + len(tasks)])))
+                audio_data = await tasks.popleft()
+                segment_audios.append(audio_data)
+                yield index, segment, audio_data
+        finally:
+            self.in_flight -= 1
+            # Cancel synthesis in advance when the client has gone
+            for task in tasks:
+                task.cancel()
+
+        if segments:
+            audio_data = self.join_segment_audio(segment_audios, tts_request.audio_format)
+            # Joined encodes of other formats differ from the audio converted at once by `_tts`. Not cached by the key of the full text
+            if self.cache_storage and len(segments) > 1 and tts_request.audio_format == "wav":
+                with timer.span("cache_write_elapsed"):
+                    await self.cache_storage.save_cache(data=audio_data, cache_key=cache_key)
+            self.performance_recorder.record(
+                process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
+                audio_format=tts_request.audio_format, cached=0, elapsed=time() - start_time,
+                service_name=self.service_name, audio_bytes=len(audio_data),
+                audio_duration=self.get_audio_duration(audio_data, tts_request.audio_format), **timer.phases
+            )
+
+    async def encode_segment_stream(self, tts_request: UnifiedTTSRequest, stream_format: str, boundary: str = None) -> AsyncIterator[bytes]:
+        wave_params = None
+        async for index, text, audio_data in self.tts_segment_stream(tts_request):
+            if stream_format == "ndjson":
+                yield json.dumps({
+                    "index": index,
+                    "text": text,
+                    "audio_format": tts_request.audio_format,
+                    "audio_duration": self.get_audio_duration(audio_data, tts_request.audio_format),
+                    "audio": base64.b64encode(audio_data).decode("ascii")
+                }, ensure_ascii=False).encode("utf-8") + b"\n"
+
+            elif stream_format == "multipart":
+                yield (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: audio/{tts_request.audio_format}\r\n"
+                    f"Content-Length: {len(audio_data)}\r\n"
+                    f"X-Segment-Index: {index}\r\n"
+                    f"X-Segment-Text: {json.dumps(text)}\r\n\r\n"
+                ).encode("ascii") + audio_data + b"\r\n"
+
+            elif tts_request.audio_format == "wav":
+                # Header with open-ended size first, then PCM of each sentence
+                params, pcm = read_wave(audio_data)
+                if wave_params is None:
+                    wave_params = params
+                    channels, sample_width, sample_rate = params
+                    yield create_wave_header(sample_rate, channels, sample_width) + pcm
+                elif params != wave_params:
+                    raise FormatConverterError(f"Waves with different formats can't be streamed: {wave_params} and {params}")
+                else:
+                    yield create_silence(wave_params, self.get_segment_gap_ms()) + pcm
+
+            elif tts_request.audio_format == "mp3":
+                yield audio_data if index == 0 else strip_id3v2(audio_data)
+
+            else:
+                yield audio_data
+
+        if stream_format == "multipart":
+            yield f"--{boundary}--\r\n".encode("ascii")
+
+    async def unified_tts_stream_handler(self, tts_request: UnifiedTTSRequest):
+        stream_format = tts_request.stream_format or "audio"
+        if stream_format not in ("audio", "ndjson", "multipart"):
+            raise HTTPException(status_code=400, detail=f"Unknown stream_format: {stream_format}")
+
+        if stream_format == "ndjson":
+            stream = self.encode_segment_stream(tts_request, stream_format)
+            media_type = "application/x-ndjson"
+        elif stream_format == "multipart":
+            boundary = uuid4().hex
+            stream = self.encode_segment_stream(tts_request, stream_format, boundary)
+            media_type = f"multipart/mixed; boundary={boundary}"
+        elif self.text_splitter:
+            stream = self.encode_segment_stream(tts_request, stream_format)
+            media_type = f"audio/{tts_request.audio_format}"
+        else:
+            stream = self.tts_stream(tts_request)
+            media_type = f"audio/{tts_request.audio_format}"
+
+        # Get the first chunk before starting the response to return errors with the status code
+        try:
+            first_chunk = await stream.__anext__()
+        except StopAsyncIteration:
+            raise HTTPException(status_code=400, detail="No text to synthesize")
+
+        async def iter_stream():
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+
+        return StreamingResponse(iter_stream(), media_type=media_type)
+
     async def tts(self, tts_request: UnifiedTTSRequest) -> UnifiedTTSResponse:
         resp = await self._tts(tts_request)
 
@@ -286,6 +1004,30 @@ class SpeechGateway(ABC):
 
         return UnifiedTTSResponse(audio_data=audio_data, media_type=media_type)
 
+    async def tts_batch(
+        self,
+        tts_requests: List[UnifiedTTSRequest],
+        on_result: Callable[[int, Union[UnifiedTTSResponse, Exception]], None] = None
+    ) -> List[Union[UnifiedTTSResponse, Exception]]:
+        # Results in the order of the requests. Failures are returned as exceptions not to fail the others.
+        # on_result is called with the index and the result as soon as each one completes.
+        # Override to synthesize multiple texts in a request to the speech service
+        async def synthesize(index: int, tts_request: UnifiedTTSRequest) -> Union[UnifiedTTSResponse, Exception]:
+            try:
+                if self.cache_storage and await self.cache_storage.has_cache(self.get_cache_key(tts_request)):
+                    # Cache hits don't wait for the others being synthesized
+                    result = await self.tts(tts_request)
+                else:
+                    async with self.batch_semaphore:
+                        result = await self.tts(tts_request)
+            except Exception as ex:
+                result = ex
+            if on_result:
+                on_result(index, result)
+            return result
+
+        return await asyncio.gather(*(synthesize(i, r) for i, r in enumerate(tts_requests)))
+
     def get_router(self) -> APIRouter:
         router = APIRouter()
         router.add_api_route(
@@ -297,4 +1039,8 @@ class SpeechGateway(ABC):
         return router
 
     async def shutdown(self):
+        if self.upstream_pool:
+            await self.upstream_pool.stop()
+        if self.connection_warmer:
+            await self.connection_warmer.stop()
         await self.http_client.aclose()
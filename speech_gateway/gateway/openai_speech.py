@@ -1,13 +1,24 @@
 import json
-from typing import Dict, Any
+from typing import AsyncIterator, Dict, Any, TYPE_CHECKING
+import httpx
 from . import SpeechGateway, UnifiedTTSRequest
 from ..performance_recorder import PerformanceRecorder
 from ..cache import CacheStorage
 from ..converter import FormatConverter
+from ..traffic import CircuitBreaker
+from ..converter.wave_header import create_wave_header
 from ..performance_recorder import PerformanceRecorder
 
+if TYPE_CHECKING:
+    from ..converter.silence import SilenceTrimmer
+    from ..splitter import TextSplitter
+
 
 class OpenAIGateway(SpeechGateway):
+    STREAM_FORMATS = {"mp3", "opus", "aac", "flac", "wav", "pcm"}
+    # `pcm` response format: 24kHz, 16bit, mono, little-endian
+    PCM_SAMPLE_RATE = 24000
+
     def __init__(
         self,
         *,
@@ -18,8 +29,18 @@ class OpenAIGateway(SpeechGateway):
         cache_dir: str = "openai_cache",
         cache_storage: CacheStorage = None,
         format_converters: Dict[str, FormatConverter] = None,
+        silence_trimmer: "SilenceTrimmer" = None,
+        text_splitter: "TextSplitter" = None,
+        segment_concurrency: int = 4,
+        max_concurrency: int = None,
+        max_queue_time: float = None,
+        circuit_breaker: CircuitBreaker = None,
         max_connections: int = 100,
         max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 5.0,
+        http2: bool = False,
+        prewarm_connections: int = 0,
+        keepalive_interval: float = None,
         timeout: float = 10.0,
         follow_redirects: bool = False,
         performance_recorder: PerformanceRecorder = None,
@@ -32,8 +53,18 @@ class OpenAIGateway(SpeechGateway):
             cache_dir=cache_dir,
             cache_storage=cache_storage,
             format_converters=format_converters,
+            silence_trimmer=silence_trimmer,
+            text_splitter=text_splitter,
+            segment_concurrency=segment_concurrency,
+            max_concurrency=max_concurrency,
+            max_queue_time=max_queue_time,
+            circuit_breaker=circuit_breaker,
             max_connections=max_connections,
             max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+            http2=http2,
+            prewarm_connections=prewarm_connections,
+            keepalive_interval=keepalive_interval,
             timeout=timeout,
             follow_redirects=follow_redirects,
             performance_recorder=performance_recorder,
@@ -68,6 +99,22 @@ class OpenAIGateway(SpeechGateway):
         
         return request_json
 
+    async def from_tts_stream_request(self, tts_request: UnifiedTTSRequest) -> Dict[str, Any]:
+        if tts_request.audio_format not in self.STREAM_FORMATS:
+            return None
+
+        request_json = await self.from_tts_request(tts_request)
+        if tts_request.audio_format == "wav":
+            # Wave from OpenAI has the header at the end of synthesis. Stream raw PCM and add the header by ourselves
+            request_json["json"]["response_format"] = "pcm"
+        return request_json
+
+    async def iter_stream_audio(self, httpx_response: httpx.Response, tts_request: UnifiedTTSRequest) -> AsyncIterator[bytes]:
+        if tts_request.audio_format == "wav":
+            yield create_wave_header(self.PCM_SAMPLE_RATE)
+        async for chunk in httpx_response.aiter_bytes():
+            yield chunk
+
     async def to_tts_request(self, body: bytes, headers: dict, params: dict) -> UnifiedTTSRequest:
         request_json: dict = json.loads(body.decode("utf-8"))
 
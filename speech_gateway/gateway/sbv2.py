@@ -1,22 +1,41 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, TYPE_CHECKING
 from . import SpeechGateway, UnifiedTTSRequest
 from ..performance_recorder import PerformanceRecorder
 from ..cache import CacheStorage
 from ..converter import FormatConverter
+from ..traffic import CircuitBreaker
 from ..performance_recorder import PerformanceRecorder
 
+if TYPE_CHECKING:
+    from ..converter.silence import SilenceTrimmer
+    from ..splitter import TextSplitter
+
 
 class StyleBertVits2Gateway(SpeechGateway):
+    HEALTH_CHECK_PATH = "/models/info"
+
     def __init__(
         self,
         *,
-        base_url: str,
+        base_url: str = None,
+        base_urls: List[str] = None,
+        health_check_interval: float = 5.0,
         style_mapper: dict = None,
         cache_dir: str = "sbv2_cache",
         cache_storage: CacheStorage = None,
         format_converters: Dict[str, FormatConverter] = None,
+        silence_trimmer: "SilenceTrimmer" = None,
+        text_splitter: "TextSplitter" = None,
+        segment_concurrency: int = 4,
+        max_concurrency: int = None,
+        max_queue_time: float = None,
+        circuit_breaker: CircuitBreaker = None,
         max_connections: int = 100,
         max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 5.0,
+        http2: bool = False,
+        prewarm_connections: int = 0,
+        keepalive_interval: float = None,
         timeout: float = 10.0,
         follow_redirects: bool = False,
         performance_recorder: PerformanceRecorder = None,
@@ -24,13 +43,25 @@ class StyleBertVits2Gateway(SpeechGateway):
     ):
         super().__init__(
             base_url=base_url,
+            base_urls=base_urls,
+            health_check_interval=health_check_interval,
             original_tts_method="GET",
             original_tts_path="/voice",
             cache_dir=cache_dir,
             cache_storage=cache_storage,
             format_converters=format_converters,
+            silence_trimmer=silence_trimmer,
+            text_splitter=text_splitter,
+            segment_concurrency=segment_concurrency,
+            max_concurrency=max_concurrency,
+            max_queue_time=max_queue_time,
+            circuit_breaker=circuit_breaker,
             max_connections=max_connections,
             max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+            http2=http2,
+            prewarm_connections=prewarm_connections,
+            keepalive_interval=keepalive_interval,
             timeout=timeout,
             follow_redirects=follow_redirects,
             performance_recorder=performance_recorder,
@@ -1,29 +1,78 @@
-from typing import Dict, List
+import asyncio
+import base64
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+from uuid import uuid4
+import zipfile
 import httpx
-from fastapi import APIRouter, Depends, status, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, Header, status, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from . import SpeechGateway, UnifiedTTSRequest, UnifiedTTSResponse
-from ..performance_recorder import PerformanceRecorder
+from . import SpeechGateway, UnifiedTTSRequest, UnifiedTTSResponse, UnifiedTTSBatchRequest
+from ..performance_recorder import PerformanceRecorder, QueuedPerformanceRecorder
+from ..performance_recorder.prometheus import PrometheusPerformanceRecorder
+from ..splitter import SentenceSplitter, IncrementalSentenceSplitter
+from ..traffic import EventLoopLagMonitor, HedgingPolicy, LoadSheddingPolicy
+
+logger = logging.getLogger(__name__)
+
+
+class ZipChunkWriter:
+    # Write-only file for zipfile to stream each entry as soon as it's written
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
 
 
 class DummyPerformanceRecorder(PerformanceRecorder):
-    def record(
-        self,
-        *,
-        process_id: str,
-        source: str = None,
-        text: str = None,
-        audio_format: str = None,
-        cached: int = 0,
-        elapsed: float = None,
-    ):
+    def record(self, *, process_id: str, **fields):
         pass
 
     def close(self):
         pass
 
 
+class FallbackChain:
+    VOICE_MISMATCH_MODES = ("default_speaker", "keep", "skip")
+
+    def __init__(self, service_names: List[str], *, voice_map: Dict[str, Dict[str, str]] = None, voice_mismatch: str = "default_speaker"):
+        # voice_map: {fallback service name: {speaker of the primary: speaker of the fallback}}
+        # voice_mismatch: what to do for speakers not in voice_map.
+        #   default_speaker: use the default speaker of the fallback / keep: use the same speaker (e.g. VOICEVOX and AivisSpeech replicas)
+        #   skip: don't fall back to the service
+        if voice_mismatch not in self.VOICE_MISMATCH_MODES:
+            raise ValueError(f"Unknown voice_mismatch: {voice_mismatch}. Use one of {self.VOICE_MISMATCH_MODES}")
+        self.service_names = service_names
+        self.voice_map = voice_map or {}
+        self.voice_mismatch = voice_mismatch
+
+    def map_speaker(self, service_name: str, speaker: str, default_speaker: str) -> Tuple[bool, Optional[str]]:
+        # Returns whether the service can be used and the speaker for it
+        if speaker in (speakers := self.voice_map.get(service_name, {})):
+            return True, speakers[speaker]
+        if self.voice_mismatch == "default_speaker":
+            return True, default_speaker
+        elif self.voice_mismatch == "keep":
+            return True, speaker
+        return False, None
+
+
 class UnifiedGateway(SpeechGateway):
     def __init__(
         self,
@@ -31,6 +80,11 @@ class UnifiedGateway(SpeechGateway):
         api_key: str = None,
         default_gateway: SpeechGateway = None,
         default_language: str = "ja-JP",
+        metrics_recorder: PrometheusPerformanceRecorder = None,
+        summary_recorder: QueuedPerformanceRecorder = None,
+        load_shedding: LoadSheddingPolicy = None,
+        hedging: HedgingPolicy = None,
+        websocket_max_in_flight: int = 16,
         debug = False
     ):
         super().__init__(performance_recorder=DummyPerformanceRecorder(), debug=debug)
@@ -40,9 +94,100 @@ class UnifiedGateway(SpeechGateway):
         self.default_speakers: Dict[SpeechGateway, str] = {}
         self.default_gateway: SpeechGateway = default_gateway
         self.default_language = default_language
+        self.metrics_recorder = metrics_recorder
+        self.summary_recorder = summary_recorder
+        self.load_shedding = load_shedding
+        # Fallback chains by service name or language. Hedged requests are sent only when hedging is set
+        self.fallback_chains: Dict[str, FallbackChain] = {}
+        self.hedging = hedging
+        self.hedged_count = 0
+        self.fallback_count = 0
+        # Requests being processed for each connection of /tts/ws/requests. Messages are not read while it's full
+        self.websocket_max_in_flight = websocket_max_in_flight
+        if load_shedding:
+            self.lag_monitor = load_shedding.lag_monitor
+        elif metrics_recorder:
+            self.lag_monitor = EventLoopLagMonitor()
+        else:
+            self.lag_monitor = None
+
+        if self.metrics_recorder:
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_in_flight_requests", "Number of requests being processed.",
+                lambda: {(gw.__class__.__name__, name): gw.in_flight for name, gw in self.service_map.items()},
+                ("gateway", "service")
+            )
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_upstream_outstanding_requests", "Number of requests sent to each upstream and not completed yet.",
+                lambda: {
+                    (name, u.base_url): u.outstanding
+                    for name, gw in self.service_map.items() if gw.upstream_pool for u in gw.upstream_pool.upstreams
+                },
+                ("service", "upstream")
+            )
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_upstream_healthy", "Whether each upstream passes the health checks (1) or is ejected (0).",
+                lambda: {
+                    (name, u.base_url): int(u.healthy)
+                    for name, gw in self.service_map.items() if gw.upstream_pool for u in gw.upstream_pool.upstreams
+                },
+                ("service", "upstream")
+            )
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_queued_requests", "Number of requests waiting for a slot of the concurrency limit.",
+                lambda: {(gw.__class__.__name__, name): sum(l.queued for l in gw.get_limiters()) for name, gw in self.service_map.items()},
+                ("gateway", "service")
+            )
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_queue_rejected_requests_total", "Total number of requests rejected after waiting for max_queue_time.",
+                lambda: {(gw.__class__.__name__, name): sum(l.rejected_count for l in gw.get_limiters()) for name, gw in self.service_map.items()},
+                ("gateway", "service"), metric_type="counter"
+            )
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_circuit_breaker_state", "State of the circuit breaker of each upstream: 0 closed, 1 half-open, 2 open.",
+                lambda: {
+                    (name, base_url): {"closed": 0, "half_open": 1, "open": 2}[b.state]
+                    for name, gw in self.service_map.items() for base_url, b in gw.get_circuit_breakers().items()
+                },
+                ("service", "upstream")
+            )
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_circuit_breaker_rejected_requests_total", "Total number of requests failed fast while the circuit is open.",
+                lambda: {
+                    (name, base_url): b.rejected_count
+                    for name, gw in self.service_map.items() for base_url, b in gw.get_circuit_breakers().items()
+                },
+                ("service", "upstream"), metric_type="counter"
+            )
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_circuit_breaker_opened_total", "Total number of times the circuit has opened.",
+                lambda: {
+                    (name, base_url): b.open_count
+                    for name, gw in self.service_map.items() for base_url, b in gw.get_circuit_breakers().items()
+                },
+                ("service", "upstream"), metric_type="counter"
+            )
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_event_loop_lag_seconds", "Recent delay of the event loop.",
+                lambda: {(): self.lag_monitor.lag}
+            )
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_hedged_requests_total", "Total number of hedged requests sent to the next gateway in the fallback chain.",
+                lambda: {(): self.hedged_count}, metric_type="counter"
+            )
+            self.metrics_recorder.register_gauge(
+                "speech_gateway_fallback_responses_total", "Total number of responses served by a fallback gateway.",
+                lambda: {(): self.fallback_count}, metric_type="counter"
+            )
+            if self.load_shedding:
+                self.metrics_recorder.register_gauge(
+                    "speech_gateway_shed_requests_total", "Total number of requests shed by the load shedding policy.",
+                    lambda: {(): self.load_shedding.shed_count}, metric_type="counter"
+                )
 
     def add_gateway(self, service_name: str, gateway: SpeechGateway, *, languages: List[str] = None, default_speaker: str = None, default: bool = False):
         self.service_map[service_name] = gateway
+        gateway.service_name = service_name
         if languages:
             for lang in languages:
                 self.language_map[lang] = gateway
@@ -60,6 +205,139 @@ class UnifiedGateway(SpeechGateway):
             return self.default_gateway
         return None
 
+    def set_fallbacks(
+        self,
+        key: str,
+        service_names: List[str],
+        *,
+        voice_map: Dict[str, Dict[str, str]] = None,
+        voice_mismatch: str = "default_speaker"
+    ):
+        # key is a service name or a language
+        self.fallback_chains[key] = FallbackChain(service_names, voice_map=voice_map, voice_mismatch=voice_mismatch)
+
+    def get_fallback_chain(self, tts_request: UnifiedTTSRequest, gateway: SpeechGateway) -> Optional[FallbackChain]:
+        for key in (tts_request.service_name, tts_request.language, gateway.service_name):
+            if key and (chain := self.fallback_chains.get(key)):
+                return chain
+        return None
+
+    def get_candidates(self, tts_request: UnifiedTTSRequest) -> List[Tuple[SpeechGateway, UnifiedTTSRequest]]:
+        # The gateway for the request followed by the fallbacks with the speakers mapped
+        gateway = self.get_gateway(tts_request)
+        if not gateway:
+            return []
+        primary_request = tts_request.model_copy(update={"speaker": tts_request.speaker or self.default_speakers.get(gateway)})
+        candidates = [(gateway, primary_request)]
+
+        if chain := self.get_fallback_chain(tts_request, gateway):
+            for service_name in chain.service_names:
+                fallback_gateway = self.service_map.get(service_name)
+                if not fallback_gateway or any(fallback_gateway is c[0] for c in candidates):
+                    continue
+                usable, speaker = chain.map_speaker(service_name, primary_request.speaker, self.default_speakers.get(fallback_gateway))
+                if usable:
+                    candidates.append((
+                        fallback_gateway,
+                        tts_request.model_copy(update={"service_name": service_name, "speaker": speaker})
+                    ))
+
+        return candidates
+
+    def get_available_candidate(self, tts_request: UnifiedTTSRequest) -> Tuple[SpeechGateway, UnifiedTTSRequest]:
+        # The first candidate whose circuit is not open, or the primary one when all of them are open
+        candidates = self.get_candidates(tts_request)
+        return next((c for c in candidates if c[0].is_available()), candidates[0])
+
+    async def tts_with_fallback(self, tts_request: UnifiedTTSRequest) -> UnifiedTTSResponse:
+        # Send a hedged request to the next gateway when the current one is slower than usual, and fail over at once
+        # when it fails. The first success wins and the others are cancelled
+        candidates = self.get_candidates(tts_request)
+        if not candidates:
+            raise Exception("No gateways found.")
+
+        gateway, primary_request = candidates[0]
+        if len(candidates) == 1 or (
+            gateway.cache_storage and await gateway.cache_storage.has_cache(gateway.get_cache_key(primary_request))
+        ):
+            return await gateway.tts(primary_request)
+
+        # Gateways whose circuits are open are tried last not to wait for them to fail
+        candidates.sort(key=lambda c: not c[0].is_available())
+
+        loop = asyncio.get_running_loop()
+
+        async def synthesize(candidate_gateway: SpeechGateway, candidate_request: UnifiedTTSRequest) -> UnifiedTTSResponse:
+            start_time = loop.time()
+            resp = await candidate_gateway.tts(candidate_request)
+            if self.hedging:
+                self.hedging.observe(candidate_gateway.service_name, loop.time() - start_time)
+            return resp
+
+        pending: Dict[asyncio.Task, int] = {}
+        started = 0
+
+        def start_next():
+            nonlocal started
+            pending[asyncio.create_task(synthesize(*candidates[started]))] = started
+            started += 1
+
+        start_next()
+        last_error = None
+        try:
+            while pending:
+                hedge_delay = None
+                if self.hedging and started < len(candidates):
+                    hedge_delay = self.hedging.get_delay(candidates[started - 1][0].service_name)
+
+                done, _ = await asyncio.wait(pending.keys(), timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged_count += 1
+                    if self.debug:
+                        logger.info(f"Hedge: {candidates[started - 1][0].service_name} is slower than {hedge_delay:.3f}s. Send to {candidates[started][0].service_name}")
+                    start_next()
+                    continue
+
+                for task in done:
+                    index = pending.pop(task)
+                    if task.exception() is None:
+                        if candidates[index][0] is not gateway:
+                            self.fallback_count += 1
+                        return task.result()
+                    last_error = task.exception()
+                    logger.warning(f"Error at {candidates[index][0].service_name}: {last_error}")
+
+                if started < len(candidates):
+                    start_next()
+
+            raise last_error
+
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def get_in_flight(self) -> int:
+        return sum(gw.in_flight for gw in set(self.service_map.values()))
+
+    async def shed_load(self, gateway: SpeechGateway, tts_request: UnifiedTTSRequest):
+        # Raise 503 when overloaded. In cache_only mode, requests that hit the cache are still served
+        in_flight = self.get_in_flight()
+        if not self.load_shedding.is_overloaded(in_flight):
+            return
+
+        if self.load_shedding.mode == "cache_only" and gateway.cache_storage \
+                and await gateway.cache_storage.has_cache(gateway.get_cache_key(tts_request)):
+            return
+
+        self.load_shedding.shed(in_flight)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy. Retry later.",
+            headers={"Retry-After": str(self.load_shedding.retry_after)}
+        )
+
     async def tts(self, tts_request: UnifiedTTSRequest) -> UnifiedTTSResponse:
         gateway = self.get_gateway(tts_request)
         if not gateway:
@@ -68,8 +346,108 @@ class UnifiedGateway(SpeechGateway):
         if not tts_request.speaker:
             tts_request.speaker = self.default_speakers.get(gateway)
 
+        if self.get_fallback_chain(tts_request, gateway):
+            return await self.tts_with_fallback(tts_request)
+
         return await gateway.tts(tts_request)
 
+    async def tts_stream(self, tts_request: UnifiedTTSRequest) -> AsyncIterator[bytes]:
+        gateway = self.get_gateway(tts_request)
+        if not gateway:
+            raise Exception("No gateways found.")
+
+        if not tts_request.speaker:
+            tts_request.speaker = self.default_speakers.get(gateway)
+
+        async for chunk in gateway.tts_stream(tts_request):
+            yield chunk
+
+    async def tts_batch(
+        self,
+        tts_requests: List[UnifiedTTSRequest],
+        on_result: Callable[[int, Union[UnifiedTTSResponse, Exception]], None] = None
+    ) -> List[Union[UnifiedTTSResponse, Exception]]:
+        # Requests are grouped by gateway so that each gateway can synthesize them at once.
+        # on_result is called with the index and the result as soon as each one completes
+        results: List[Union[UnifiedTTSResponse, Exception]] = [None] * len(tts_requests)
+        reported = set()
+
+        def report(index: int, result: Union[UnifiedTTSResponse, Exception]):
+            results[index] = result
+            if on_result and index not in reported:
+                reported.add(index)
+                on_result(index, result)
+
+        batches: Dict[SpeechGateway, List[int]] = {}
+        for index, tts_request in enumerate(tts_requests):
+            gateway = self.get_gateway(tts_request)
+            if not gateway:
+                report(index, Exception("No gateway found."))
+                continue
+            if not tts_request.speaker:
+                tts_request.speaker = self.default_speakers.get(gateway)
+            batches.setdefault(gateway, []).append(index)
+
+        async def synthesize(gateway: SpeechGateway, indices: List[int]):
+            try:
+                responses = await gateway.tts_batch(
+                    [tts_requests[i] for i in indices],
+                    on_result=lambda i, result: report(indices[i], result)
+                )
+            except Exception as ex:
+                responses = [ex] * len(indices)
+            for index, response in zip(indices, responses):
+                report(index, response)
+
+        await asyncio.gather(*(synthesize(gateway, indices) for gateway, indices in batches.items()))
+        return results
+
+    async def iter_tts_batch(self, tts_requests: List[UnifiedTTSRequest]) -> AsyncIterator[Tuple[int, Union[UnifiedTTSResponse, Exception]]]:
+        # Yield (index, result) in the order of completion. Cache hits come first
+        queue: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(self.tts_batch(tts_requests, on_result=lambda i, result: queue.put_nowait((i, result))))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (item := await queue.get()) is not None:
+                yield item
+            task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    async def iter_batch_multipart(self, tts_requests: List[UnifiedTTSRequest], boundary: str) -> AsyncIterator[bytes]:
+        # A part for each item with its index in X-Index header. Failed items are JSON parts with the error
+        async for index, response in self.iter_tts_batch(tts_requests):
+            if isinstance(response, Exception):
+                logger.error(f"Error at synthesizing batch item {index}: {response}")
+                content_type, body = "application/json", json.dumps({"index": index, "error": str(response)}).encode()
+            else:
+                content_type, body = response.media_type or f"audio/{tts_requests[index].audio_format}", response.audio_data
+            yield (
+                f"--{boundary}\r\nContent-Type: {content_type}\r\nX-Index: {index}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            ).encode() + body + b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    async def iter_batch_zip(self, tts_requests: List[UnifiedTTSRequest]) -> AsyncIterator[bytes]:
+        # Entries are named `{index}.{audio_format}`, or `{index}.error.json` for failed items
+        writer = ZipChunkWriter()
+        with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_STORED) as zf:
+            async for index, response in self.iter_tts_batch(tts_requests):
+                if isinstance(response, Exception):
+                    logger.error(f"Error at synthesizing batch item {index}: {response}")
+                    zf.writestr(f"{index}.error.json", json.dumps({"index": index, "error": str(response)}))
+                else:
+                    zf.writestr(f"{index}.{tts_requests[index].audio_format}", response.audio_data)
+                yield writer.pop()
+        yield writer.pop()
+
+    def apply_priority(self, tts_request: UnifiedTTSRequest, priority: str):
+        if priority.lower() not in ("interactive", "batch"):
+            raise HTTPException(status_code=400, detail=f"Unknown priority: {priority}")
+        tts_request.priority = priority.lower()
+
     def api_key_auth(self, credentials: HTTPAuthorizationCredentials):
         if not credentials or credentials.scheme.lower() != "bearer" or credentials.credentials != self.api_key:
             raise HTTPException(
@@ -78,6 +456,241 @@ class UnifiedGateway(SpeechGateway):
             )
         return credentials.credentials
 
+    def websocket_auth(self, websocket: WebSocket) -> bool:
+        # Authorization header, or `api_key` query parameter for browsers that can't set headers
+        authorization = websocket.headers.get("authorization", "")
+        if authorization.lower().startswith("bearer ") and authorization[7:] == self.api_key:
+            return True
+        return websocket.query_params.get("api_key") == self.api_key
+
+    async def tts_websocket_handler(self, websocket: WebSocket):
+        # Client messages (JSON):
+        #   {"type": "start", <UnifiedTTSRequest fields except text>}: Optional. Voice settings of the session
+        #   {"type": "text", "text": "<delta>"}: Sentences are synthesized as soon as their boundaries are detected
+        #   {"type": "flush"}: Synthesize the rest of the text as a sentence
+        #   {"type": "cancel"}: Discard the text and audio not sent yet
+        #   {"type": "end"}: Flush and close after all audio is sent
+        # Server messages: {"type": "audio", "index", "text", "audio_format"} followed by a binary message of the audio,
+        #   {"type": "cancelled"}, {"type": "error", "detail"} and {"type": "done"}
+        if self.api_key and not self.websocket_auth(websocket):
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        await websocket.accept()
+
+        tts_request = UnifiedTTSRequest(text="")
+        gateway = self.get_gateway(tts_request)
+        splitter = None
+        # Sentences synthesized at the same time for this connection. Requests of other clients are scheduled by the limiters
+        sentence_slots: asyncio.Semaphore = None
+        sentence_queue: asyncio.Queue = asyncio.Queue()
+        # Incremented by cancel to skip the sentences queued before
+        generation = 0
+        index = 0
+
+        async def synthesize(sentence_request: UnifiedTTSRequest, slots: asyncio.Semaphore) -> bytes:
+            # Routed in the same way as /tts, including fallbacks and hedged requests
+            async with slots:
+                return (await self.tts(sentence_request)).audio_data
+
+        def enqueue(sentences: List[str]):
+            nonlocal index
+            for sentence in sentences:
+                sentence_request = tts_request.model_copy(update={"text": sentence})
+                task = asyncio.create_task(synthesize(sentence_request, sentence_slots))
+                sentence_queue.put_nowait((generation, index, sentence_request, task))
+                index += 1
+
+        async def send_audio():
+            # Send audio in the order of sentences while the following ones are being synthesized
+            while (item := await sentence_queue.get()) is not None:
+                item_generation, item_index, sentence_request, task = item
+                # Wait without raising the cancellation of the sentence, so that the sender itself can still be cancelled
+                try:
+                    await asyncio.wait([task])
+                except asyncio.CancelledError:
+                    task.cancel()
+                    raise
+                if task.cancelled():
+                    continue
+                if ex := task.exception():
+                    logger.error(f"Error at synthesizing sentence {item_index}: {ex}")
+                    await websocket.send_json({"type": "error", "index": item_index, "detail": str(ex)})
+                    continue
+                audio_data = task.result()
+                if item_generation != generation:
+                    continue
+                await websocket.send_json({
+                    "type": "audio", "index": item_index, "text": sentence_request.text, "audio_format": sentence_request.audio_format
+                })
+                await websocket.send_bytes(audio_data)
+            await websocket.send_json({"type": "done"})
+
+        sender = asyncio.create_task(send_audio())
+        try:
+            while True:
+                message = await websocket.receive_json()
+                message_type = message.get("type")
+
+                if message_type == "start":
+                    settings = {k: v for k, v in message.items() if k not in ("type", "text", "stream", "stream_format")}
+                    try:
+                        tts_request = UnifiedTTSRequest(text="", **settings)
+                    except ValueError as vex:
+                        await websocket.send_json({"type": "error", "detail": str(vex)})
+                        continue
+                    gateway = self.get_gateway(tts_request)
+                    if not gateway:
+                        await websocket.send_json({"type": "error", "detail": "No gateway found."})
+                        continue
+                    if not tts_request.speaker:
+                        tts_request.speaker = self.default_speakers.get(gateway)
+                    splitter = None
+
+                elif message_type in ("text", "flush", "end"):
+                    if not gateway:
+                        await websocket.send_json({"type": "error", "detail": "No gateway found."})
+                        continue
+                    if splitter is None:
+                        if not tts_request.speaker:
+                            tts_request.speaker = self.default_speakers.get(gateway)
+                        splitter = IncrementalSentenceSplitter(
+                            gateway.text_splitter if isinstance(gateway.text_splitter, SentenceSplitter) else None
+                        )
+                        sentence_slots = asyncio.Semaphore(gateway.segment_concurrency)
+                    if message_type == "text":
+                        enqueue(splitter.feed(message.get("text") or ""))
+                    else:
+                        enqueue(splitter.flush())
+                    if message_type == "end":
+                        sentence_queue.put_nowait(None)
+                        await sender
+                        break
+
+                elif message_type == "cancel":
+                    generation += 1
+                    if splitter:
+                        splitter.clear()
+                    while not sentence_queue.empty():
+                        item = sentence_queue.get_nowait()
+                        if item:
+                            item[3].cancel()
+                    await websocket.send_json({"type": "cancelled"})
+
+                else:
+                    await websocket.send_json({"type": "error", "detail": f"Unknown message type: {message_type}"})
+
+            await websocket.close()
+
+        except WebSocketDisconnect:
+            pass
+
+        finally:
+            sender.cancel()
+            while not sentence_queue.empty():
+                if item := sentence_queue.get_nowait():
+                    item[3].cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+
+    async def tts_websocket_requests_handler(self, websocket: WebSocket):
+        # Persistent connection to synthesize many requests without the overhead of HTTP requests and authentication.
+        # Client messages (JSON):
+        #   {"type": "request", "id": "<client-assigned ID>", <UnifiedTTSRequest fields>}: Synthesized concurrently
+        #   {"type": "cancel", "id": "<ID>"}: Cancel the request
+        #   {"type": "end"}: Close after all responses are sent
+        # Server messages: {"type": "audio", "id", "audio_format"} followed by a binary message of the audio,
+        #   {"type": "error", "id", "status", "detail"}, {"type": "cancelled", "id"} and {"type": "done"}.
+        #   Responses are sent in the order of completion, not of the requests
+        if self.api_key and not self.websocket_auth(websocket):
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        await websocket.accept()
+
+        if self.lag_monitor:
+            self.lag_monitor.start()
+
+        send_lock = asyncio.Lock()
+        slots = asyncio.Semaphore(self.websocket_max_in_flight)
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def send(message: dict, audio_data: bytes = None):
+            # The audio follows its header without being interleaved with other responses
+            async with send_lock:
+                await websocket.send_json(message)
+                if audio_data is not None:
+                    await websocket.send_bytes(audio_data)
+
+        async def synthesize(request_id: str, tts_request: UnifiedTTSRequest):
+            audio_data = None
+            try:
+                gateway = self.get_gateway(tts_request)
+                if not gateway:
+                    raise HTTPException(status_code=404, detail="No gateway found.")
+                if self.load_shedding:
+                    await self.shed_load(gateway, tts_request)
+                audio_data = (await self.tts(tts_request)).audio_data
+                message = {"type": "audio", "id": request_id, "audio_format": tts_request.audio_format}
+            except HTTPException as hex:
+                message = {"type": "error", "id": request_id, "status": hex.status_code, "detail": hex.detail}
+            except Exception as ex:
+                logger.error(f"Error at synthesizing request {request_id}: {ex}")
+                message = {"type": "error", "id": request_id, "status": 500, "detail": str(ex)}
+            try:
+                await send(message, audio_data)
+            except Exception:
+                # Closed by the client
+                pass
+
+        def complete(request_id: str, task: asyncio.Task):
+            slots.release()
+            if tasks.get(request_id) is task:
+                del tasks[request_id]
+
+        try:
+            while True:
+                message = await websocket.receive_json()
+                message_type = message.get("type")
+                request_id = message.get("id")
+
+                if message_type == "request":
+                    if request_id is None:
+                        await send({"type": "error", "id": None, "status": 400, "detail": "id is required."})
+                        continue
+                    try:
+                        tts_request = UnifiedTTSRequest(**{k: v for k, v in message.items() if k not in ("type", "id", "stream", "stream_format")})
+                    except ValueError as vex:
+                        await send({"type": "error", "id": request_id, "status": 422, "detail": str(vex)})
+                        continue
+                    # Stop reading while the requests in flight are full
+                    await slots.acquire()
+                    task = asyncio.create_task(synthesize(request_id, tts_request))
+                    tasks[request_id] = task
+                    task.add_done_callback(lambda t, request_id=request_id: complete(request_id, t))
+
+                elif message_type == "cancel":
+                    if task := tasks.pop(request_id, None):
+                        task.cancel()
+                    await send({"type": "cancelled", "id": request_id})
+
+                elif message_type == "end":
+                    if tasks:
+                        await asyncio.gather(*tasks.values(), return_exceptions=True)
+                    await send({"type": "done"})
+                    break
+
+                else:
+                    await send({"type": "error", "id": request_id, "status": 400, "detail": f"Unknown message type: {message_type}"})
+
+            await websocket.close()
+
+        except WebSocketDisconnect:
+            pass
+
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks.values(), return_exceptions=True)
+
     def get_router(self) -> APIRouter:
         router = APIRouter()
         self.register_endpoint(router)
@@ -89,11 +702,15 @@ class UnifiedGateway(SpeechGateway):
         @router.post("/tts")
         async def post_tts(
             tts_request: UnifiedTTSRequest,
+            x_priority: str = Header(None),
             credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)
         ):
             if self.api_key:
                 self.api_key_auth(credentials)
 
+            if x_priority:
+                self.apply_priority(tts_request, x_priority)
+
             gateway = self.get_gateway(tts_request)
 
             if not gateway:
@@ -102,8 +719,123 @@ class UnifiedGateway(SpeechGateway):
             if not tts_request.speaker:
                 tts_request.speaker = self.default_speakers.get(gateway)
 
+            if self.lag_monitor:
+                self.lag_monitor.start()
+
+            if self.load_shedding:
+                await self.shed_load(gateway, tts_request)
+
+            if self.get_fallback_chain(tts_request, gateway):
+                if not tts_request.stream:
+                    resp = await self.tts_with_fallback(tts_request)
+                    return Response(content=resp.audio_data, media_type=resp.media_type)
+                if not gateway.is_available():
+                    # Streams are not hedged but routed to the next gateway while the circuit is open
+                    gateway, tts_request = self.get_available_candidate(tts_request)
+
             return await gateway.unified_tts_handler(tts_request)
 
+        @router.post("/tts/batch")
+        async def post_tts_batch(
+            batch_request: UnifiedTTSBatchRequest,
+            x_priority: str = Header(None),
+            accept: str = Header(None),
+            credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)
+        ):
+            if self.api_key:
+                self.api_key_auth(credentials)
+
+            # Batch priority unless specified not to delay interactive requests
+            for tts_request in batch_request.requests:
+                if x_priority:
+                    self.apply_priority(tts_request, x_priority)
+                elif "priority" not in tts_request.model_fields_set:
+                    tts_request.priority = "batch"
+
+            if self.lag_monitor:
+                self.lag_monitor.start()
+
+            if self.load_shedding and self.load_shedding.is_overloaded(in_flight := self.get_in_flight()):
+                self.load_shedding.shed(in_flight)
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy. Retry later.",
+                    headers={"Retry-After": str(self.load_shedding.retry_after)}
+                )
+
+            # Streamed as each item completes when multipart or zip is accepted
+            accept = (accept or "").lower()
+            if "multipart/mixed" in accept:
+                boundary = uuid4().hex
+                return StreamingResponse(
+                    self.iter_batch_multipart(batch_request.requests, boundary),
+                    media_type=f"multipart/mixed; boundary={boundary}"
+                )
+            elif "application/zip" in accept:
+                return StreamingResponse(self.iter_batch_zip(batch_request.requests), media_type="application/zip")
+
+            # Failed items are reported with the error and don't fail the others
+            results = []
+            for index, (tts_request, response) in enumerate(zip(batch_request.requests, await self.tts_batch(batch_request.requests))):
+                if isinstance(response, Exception):
+                    logger.error(f"Error at synthesizing batch item {index}: {response}")
+                    results.append({"index": index, "error": str(response)})
+                else:
+                    results.append({
+                        "index": index,
+                        "audio_format": tts_request.audio_format,
+                        "audio_duration": self.get_gateway(tts_request).get_audio_duration(response.audio_data, tts_request.audio_format),
+                        "audio": base64.b64encode(response.audio_data).decode("ascii")
+                    })
+
+            return JSONResponse(content={"results": results})
+
+        router.add_api_websocket_route("/tts/ws", self.tts_websocket_handler)
+        router.add_api_websocket_route("/tts/ws/requests", self.tts_websocket_requests_handler)
+
+        if self.metrics_recorder:
+            @router.get("/metrics", include_in_schema=False)
+            async def get_metrics(
+                credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)
+            ):
+                if self.api_key:
+                    self.api_key_auth(credentials)
+
+                self.lag_monitor.start()
+                return PlainTextResponse(
+                    content=self.metrics_recorder.render(),
+                    media_type="text/plain; version=0.0.4"
+                )
+
+        if self.summary_recorder:
+            # Defined as sync function to run database queries in the thread pool
+            @router.get("/performance/summary")
+            def get_performance_summary(
+                since_seconds: int = 3600,
+                bucket_seconds: int = None,
+                group_by: str = "source,audio_format,cached",
+                source: str = None,
+                audio_format: str = None,
+                cached: int = None,
+                credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)
+            ):
+                if self.api_key:
+                    self.api_key_auth(credentials)
+
+                try:
+                    summaries = self.summary_recorder.get_summary(
+                        since=datetime.now(timezone.utc) - timedelta(seconds=since_seconds),
+                        bucket_seconds=bucket_seconds,
+                        group_by=[k for k in group_by.split(",") if k],
+                        source=source,
+                        audio_format=audio_format,
+                        cached=cached
+                    )
+                except ValueError as vex:
+                    raise HTTPException(status_code=400, detail=str(vex))
+
+                return JSONResponse(content={"summaries": summaries})
+
         @router.delete("/cache")
         async def delete_cache(
             service_name: str,
@@ -124,7 +856,15 @@ class UnifiedGateway(SpeechGateway):
     def to_tts_request(self, body: bytes, headers: dict, params: dict) -> UnifiedTTSRequest:
         pass
 
+    async def startup(self):
+        # Call on app startup to open the connections of the gateways in advance
+        if self.lag_monitor:
+            self.lag_monitor.start()
+        await asyncio.gather(*(gw.startup() for gw in set(self.service_map.values())))
+
     async def shutdown(self):
+        if self.lag_monitor:
+            await self.lag_monitor.stop()
         for _, gw in self.service_map.items():
             try:
                 await gw.shutdown()
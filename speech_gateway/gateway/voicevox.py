@@ -1,42 +1,137 @@
-from typing import Dict, Any
-from . import SpeechGateway, UnifiedTTSRequest
-from ..performance_recorder import PerformanceRecorder
+import asyncio
+from collections import OrderedDict
+import copy
+import io
+from time import time
+from typing import Callable, Dict, Any, List, Tuple, Union, TYPE_CHECKING
+import unicodedata
+import zipfile
+import httpx
+from . import SpeechGateway, UnifiedTTSRequest, UnifiedTTSResponse, track_in_flight
+from ..performance_recorder import PerformanceRecorder, PerformanceTimer
+from ..traffic import CircuitBreaker, Upstream
 from ..cache import CacheStorage
 from ..converter import FormatConverter
 from ..performance_recorder import PerformanceRecorder
 
+if TYPE_CHECKING:
+    from ..converter.silence import SilenceTrimmer
+    from ..splitter import TextSplitter
+
+
+class AudioQueryCache:
+    def __init__(self, *, max_size: int = 1000, ttl: float = 3600.0):
+        # LRU cache of audio_query results. Entries older than ttl seconds are not used
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[Tuple[str, str], Tuple[float, dict]] = OrderedDict()
+
+    def get_key(self, speaker: str, text: str) -> Tuple[str, str]:
+        # Width and spaces make no difference to the query
+        return str(speaker), " ".join(unicodedata.normalize("NFKC", text).split())
+
+    def get(self, speaker: str, text: str) -> dict:
+        key = self.get_key(speaker, text)
+        if entry := self.entries.get(key):
+            created_at, audio_query = entry
+            if time() - created_at < self.ttl:
+                self.entries.move_to_end(key)
+                return audio_query
+            del self.entries[key]
+        return None
+
+    def set(self, speaker: str, text: str, audio_query: dict):
+        key = self.get_key(speaker, text)
+        self.entries[key] = (time(), audio_query)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
 
 class VoicevoxGateway(SpeechGateway):
+    HEALTH_CHECK_PATH = "/version"
+
     def __init__(
         self,
         *,
         base_url: str = "http://127.0.0.1:50021",
+        base_urls: List[str] = None,
+        health_check_interval: float = 5.0,
         style_mapper: dict = None,
         cache_dir: str = "voicevox_cache",
         cache_storage: CacheStorage = None,
         format_converters: Dict[str, FormatConverter] = None,
+        silence_trimmer: "SilenceTrimmer" = None,
+        text_splitter: "TextSplitter" = None,
+        segment_concurrency: int = 4,
+        max_concurrency: int = None,
+        max_queue_time: float = None,
+        circuit_breaker: CircuitBreaker = None,
         max_connections: int = 100,
         max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 5.0,
+        http2: bool = False,
+        prewarm_connections: int = 0,
+        keepalive_interval: float = None,
         timeout: float = 10.0,
         follow_redirects: bool = False,
         performance_recorder: PerformanceRecorder = None,
+        audio_query_cache_size: int = 1000,
+        audio_query_cache_ttl: float = 3600.0,
+        multi_synthesis_size: int = 20,
         debug: bool = False
     ):
         super().__init__(
             base_url=base_url,
+            base_urls=base_urls,
+            health_check_interval=health_check_interval,
             original_tts_method="POST",
             original_tts_path="/synthesis",
             cache_dir=cache_dir,
             cache_storage=cache_storage,
             format_converters=format_converters,
+            silence_trimmer=silence_trimmer,
+            text_splitter=text_splitter,
+            segment_concurrency=segment_concurrency,
+            max_concurrency=max_concurrency,
+            max_queue_time=max_queue_time,
+            circuit_breaker=circuit_breaker,
             max_connections=max_connections,
             max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+            http2=http2,
+            prewarm_connections=prewarm_connections,
+            keepalive_interval=keepalive_interval,
             timeout=timeout,
             follow_redirects=follow_redirects,
             performance_recorder=performance_recorder,
             debug=debug
         )
         self.style_mapper = style_mapper or {}
+        # Set audio_query_cache_size=0 to disable
+        self.audio_query_cache = AudioQueryCache(max_size=audio_query_cache_size, ttl=audio_query_cache_ttl) \
+            if audio_query_cache_size > 0 else None
+        # Max number of queries in a request to /multi_synthesis
+        self.multi_synthesis_size = multi_synthesis_size
+
+    async def get_audio_query(self, speaker: str, text: str) -> dict:
+        # Returns the cached object. Copy it before modifying
+        if self.audio_query_cache and (audio_query := self.audio_query_cache.get(speaker, text)):
+            return audio_query
+
+        response = await self.http_client.post(
+            url=f"{self.base_url}/audio_query",
+            params={"speaker": speaker, "text": text}
+        )
+        response.raise_for_status()
+        audio_query = response.json()
+
+        if self.audio_query_cache:
+            self.audio_query_cache.set(speaker, text, audio_query)
+        return audio_query
 
     async def from_tts_request(self, tts_request: UnifiedTTSRequest) -> Dict[str, Any]:
         speaker = tts_request.speaker
@@ -48,16 +143,17 @@ class VoicevoxGateway(SpeechGateway):
                     speaker = v
                     break
 
-        response = await self.http_client.post(
-            url=f"{self.base_url}/audio_query",
-            params={"speaker": speaker, "text": tts_request.text}
-        )
-        response.raise_for_status()
-        audio_query = response.json()
+        audio_query = copy.deepcopy(await self.get_audio_query(speaker, tts_request.text))
 
         if tts_request.speed:
             audio_query["speedScale"] = tts_request.speed
 
+        # Other prosody parameters (e.g. pitchScale, intonationScale, volumeScale) in extra_data
+        if tts_request.extra_data:
+            for k, v in tts_request.extra_data.items():
+                if k in audio_query and v is not None:
+                    audio_query[k] = v
+
         return {
             "method": self.original_tts_method,
             "url": self.base_url + self.original_tts_path,
@@ -65,6 +161,149 @@ class VoicevoxGateway(SpeechGateway):
             "json": audio_query
         }
 
+    async def multi_synthesis(self, speaker: str, audio_queries: List[dict], timer: PerformanceTimer) -> Tuple[List[bytes], httpx.Response]:
+        # Returns waves in the order of the queries. They are zipped as 001.wav, 002.wav, ... by the engine
+        httpx_response = await self.send_upstream(
+            timer,
+            method="POST",
+            url=f"{self.base_url}/multi_synthesis",
+            params={"speaker": speaker},
+            json=audio_queries
+        )
+        httpx_response.raise_for_status()
+        with zipfile.ZipFile(io.BytesIO(httpx_response.content)) as zf:
+            audios = [zf.read(name) for name in sorted(n for n in zf.namelist() if not n.endswith("/"))]
+        if len(audios) != len(audio_queries):
+            raise ValueError(f"multi_synthesis returned {len(audios)} waves for {len(audio_queries)} queries")
+        return audios, httpx_response
+
+    async def save_batch_audio(
+        self, cache_key: str, tts_request: UnifiedTTSRequest, audio_data: bytes,
+        timer: PerformanceTimer, start_time: float, httpx_response: httpx.Response, upstream: Upstream = None
+    ) -> UnifiedTTSResponse:
+        response_bytes = len(audio_data)
+        with timer.span("conversion_elapsed"):
+            audio_data, silence_trimmed_ms = await self.process_audio(audio_data, tts_request)
+
+        if self.cache_storage:
+            with timer.span("cache_write_elapsed"):
+                await self.cache_storage.save_cache(data=audio_data, cache_key=cache_key)
+
+        self.performance_recorder.record(
+            process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
+            audio_format=tts_request.audio_format, cached=0, elapsed=time() - start_time,
+            silence_trimmed_ms=silence_trimmed_ms, service_name=self.service_name,
+            audio_bytes=len(audio_data), audio_duration=self.get_audio_duration(audio_data, tts_request.audio_format),
+            upstream_status=httpx_response.status_code, response_bytes=response_bytes,
+            upstream=upstream.base_url if upstream else None, **timer.phases
+        )
+
+        return UnifiedTTSResponse(audio_data=audio_data, media_type=f"audio/{tts_request.audio_format}")
+
+    @track_in_flight
+    async def tts_batch(
+        self,
+        tts_requests: List[UnifiedTTSRequest],
+        on_result: Callable[[int, Union[UnifiedTTSResponse, Exception]], None] = None
+    ) -> List[Union[UnifiedTTSResponse, Exception]]:
+        # Cache misses of the same speaker are synthesized by /multi_synthesis instead of a request per text.
+        # Each audio is cached by itself so that it's reused by `tts` as well. Cache hits are passed to on_result first
+        start_time = time()
+        indices: Dict[str, List[int]] = {}
+        for index, tts_request in enumerate(tts_requests):
+            # Identical requests are synthesized once
+            indices.setdefault(self.get_cache_key(tts_request), []).append(index)
+
+        outputs: Dict[str, Union[UnifiedTTSResponse, Exception]] = {}
+        # Grouped by speaker and priority
+        groups: Dict[Tuple[str, str], List[Tuple[str, UnifiedTTSRequest, dict, PerformanceTimer]]] = {}
+
+        def complete(cache_key: str, output: Union[UnifiedTTSResponse, Exception]):
+            outputs[cache_key] = output
+            if on_result:
+                for index in indices[cache_key]:
+                    on_result(index, output)
+
+        async def prepare(cache_key: str, tts_request: UnifiedTTSRequest):
+            timer = PerformanceTimer()
+            try:
+                if self.cache_storage:
+                    with timer.span("cache_lookup_elapsed"):
+                        cache = await self.cache_storage.get_cache(cache_key)
+                    if cache:
+                        self.performance_recorder.record(
+                            process_id=cache_key, source=self.__class__.__name__, text=tts_request.text,
+                            audio_format=tts_request.audio_format, cached=1, elapsed=time() - start_time,
+                            service_name=self.service_name, audio_bytes=cache.size, **timer.phases
+                        )
+                        complete(cache_key, UnifiedTTSResponse(audio_data=await self.read_cache(cache), media_type=cache.mime_type))
+                        return
+
+                if self.split_text(tts_request):
+                    # Long text is synthesized by sentences. Errors are recorded by `tts`
+                    try:
+                        async with self.batch_semaphore:
+                            output = await self.tts(tts_request)
+                    except Exception as ex:
+                        output = ex
+                    complete(cache_key, output)
+                    return
+
+                # audio_query is bounded as well not to send all of them to the engine at once
+                async with self.batch_semaphore:
+                    async with self.use_upstream(timer, tts_request.priority):
+                        with timer.span("prepare_elapsed"):
+                            request_params = await self.from_tts_request(tts_request)
+                groups.setdefault((request_params["params"]["speaker"], tts_request.priority), []).append(
+                    (cache_key, tts_request, request_params["json"], timer)
+                )
+
+            except Exception as ex:
+                self.performance_recorder.record_error(
+                    process_id=cache_key, source=self.__class__.__name__, audio_format=tts_request.audio_format,
+                    service_name=self.service_name, error=ex
+                )
+                complete(cache_key, ex)
+
+        async def synthesize(speaker: str, priority: str, items: List[Tuple[str, UnifiedTTSRequest, dict, PerformanceTimer]]):
+            group_timer = PerformanceTimer()
+            try:
+                async with self.batch_semaphore:
+                    async with self.use_upstream(group_timer, priority) as upstream:
+                        audios, httpx_response = await self.multi_synthesis(speaker, [item[2] for item in items], group_timer)
+            except Exception as ex:
+                for cache_key, tts_request, _, _ in items:
+                    self.performance_recorder.record_error(
+                        process_id=cache_key, source=self.__class__.__name__, audio_format=tts_request.audio_format,
+                        service_name=self.service_name, error=ex
+                    )
+                    complete(cache_key, ex)
+                return
+
+            for (cache_key, tts_request, _, timer), audio_data in zip(items, audios):
+                # Upstream phases are shared by the queries in the request
+                timer.phases.update(group_timer.phases)
+                try:
+                    output = await self.save_batch_audio(
+                        cache_key, tts_request, audio_data, timer, start_time, httpx_response, upstream
+                    )
+                except Exception as ex:
+                    output = ex
+                complete(cache_key, output)
+
+        await asyncio.gather(*(prepare(cache_key, tts_requests[i[0]]) for cache_key, i in indices.items()))
+        await asyncio.gather(*(
+            synthesize(speaker, priority, items[i:i + self.multi_synthesis_size])
+            for (speaker, priority), items in groups.items()
+            for i in range(0, len(items), self.multi_synthesis_size)
+        ))
+
+        results = [None] * len(tts_requests)
+        for cache_key, output in outputs.items():
+            for index in indices[cache_key]:
+                results[index] = output
+        return results
+
     async def to_tts_request(self, body: bytes, headers: dict, params: dict) -> UnifiedTTSRequest:
         tts_request = UnifiedTTSRequest(
             text=params["speaker"] + "_" + body.decode("utf-8"),  # For cache key and performance log
@@ -1,19 +1,39 @@
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import logging
+from operator import attrgetter
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+from .buffer import RecordQueue
+from .summary import GROUP_BY_KEYS, summarize_sketches, validate_group_by, rollup_rows, merge_rollup
+
+logger = logging.getLogger(__name__)
 
 
 class PerformanceRecorder(ABC):
     @abstractmethod
-    def record(
+    def record(self, *, process_id: str, **fields):
+        # fields are the columns of PerformanceRecord, such as source, cached, elapsed and the phases of PerformanceTimer.
+        # text_length and created_at are set by the recorder
+        pass
+
+    def record_error(
         self,
         *,
         process_id: str,
         source: str = None,
-        text: str = None,
         audio_format: str = None,
-        cached: int = 0,
-        elapsed: float = None,
+        service_name: str = None,
+        error: Exception = None,
     ):
+        # Called when the upstream speech service fails. Override to count or store errors
         pass
 
     @abstractmethod
@@ -27,8 +47,543 @@ class PerformanceRecord:
     source: str = None
     text: str = None
     audio_format: str = None
-    cached: int = 0,
-    elapsed: float = None,
+    cached: int = 0
+    elapsed: float = None
+    silence_trimmed_ms: float = None
+    cache_lookup_elapsed: float = None
+    prepare_elapsed: float = None
+    upstream_ttfb: float = None
+    download_elapsed: float = None
+    conversion_elapsed: float = None
+    cache_write_elapsed: float = None
+    service_name: str = None
+    audio_bytes: int = None
+    text_length: int = None
+    audio_duration: float = None
+    upstream_status: int = None
+    response_bytes: int = None
+    upstream: str = None
+    queue_wait_elapsed: float = None
+    connect_elapsed: float = None
+    connection_reused: int = None
+    created_at: datetime = None
+
+
+class PerformanceTimer:
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, name: str):
+        # Accumulate elapsed seconds of the phase. The name is passed to PerformanceRecorder.record as is
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start_time
+
+    def add(self, name: str, value: float):
+        # Accumulate a value other than time, such as silence_trimmed_ms of the sentences of a text
+        self.phases[name] = self.phases.get(name, 0.0) + value
+
+    def merge(self, timer: "PerformanceTimer"):
+        # Add the phases of a sub-process (e.g. a sentence of the text). connection_reused is 1 only when all of them are
+        for name, value in timer.phases.items():
+            if name == "connection_reused":
+                self.phases[name] = min(self.phases.get(name, value), value)
+            else:
+                self.phases[name] = self.phases.get(name, 0.0) + value
+
+
+# Columns added after the initial schema. Applied to existing tables on init_db
+COLUMN_MIGRATIONS = [
+    ("silence_trimmed_ms", "REAL"),
+    ("cache_lookup_elapsed", "REAL"),
+    ("prepare_elapsed", "REAL"),
+    ("upstream_ttfb", "REAL"),
+    ("download_elapsed", "REAL"),
+    ("conversion_elapsed", "REAL"),
+    ("cache_write_elapsed", "REAL"),
+    ("service_name", "TEXT"),
+    ("audio_bytes", "INTEGER"),
+    ("text_length", "INTEGER"),
+    ("audio_duration", "REAL"),
+    ("upstream_status", "INTEGER"),
+    ("response_bytes", "INTEGER"),
+    ("upstream", "TEXT"),
+    ("queue_wait_elapsed", "REAL"),
+    ("connect_elapsed", "REAL"),
+    ("connection_reused", "INTEGER"),
+]
+
+TEXT_POLICIES = ("full", "truncate", "hash", "length")
+
+
+def validate_text_policy(text_policy: str):
+    if text_policy not in TEXT_POLICIES:
+        raise ValueError(f"Unknown text_policy: {text_policy}. Use one of {TEXT_POLICIES}")
+
+
+def apply_text_policy(text: str, text_policy: str = "full", text_max_length: int = 64) -> str:
+    # full: as is / truncate: first text_max_length chars / hash: SHA-256 hex digest / length: not stored
+    if text is None or text_policy == "full":
+        return text
+    elif text_policy == "truncate":
+        return text[:text_max_length]
+    elif text_policy == "hash":
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    else:
+        return None
+
+# Column names and value getter are computed once instead of on every insert
+RECORD_COLUMNS = [field.name for field in fields(PerformanceRecord)]
+get_record_values = attrgetter(*RECORD_COLUMNS)
+# Columns passed to PerformanceRecorder.record as fields
+RECORD_FIELDS = frozenset(RECORD_COLUMNS) - {"process_id", "text_length", "created_at"}
+
+
+def validate_record_fields(fields: Dict[str, Any]):
+    if unknown := fields.keys() - RECORD_FIELDS:
+        raise TypeError(f"Unknown performance record fields: {', '.join(sorted(unknown))}")
+
+
+def create_performance_record(process_id: str, fields: Dict[str, Any], text_policy: str = "full", text_max_length: int = 64) -> PerformanceRecord:
+    validate_record_fields(fields)
+    text = fields.get("text")
+    return PerformanceRecord(
+        process_id=process_id,
+        **{**fields, "text": apply_text_policy(text, text_policy, text_max_length)},
+        text_length=len(text) if text is not None else None,
+        created_at=datetime.now(timezone.utc)
+    )
+
+
+class PerformanceReader(ABC):
+    # Queries performance records without the writer (schema migration, worker threads, ...).
+    # Recorders query through their reader, and the command line uses it alone
+    PLACEHOLDER = "?"
+
+    @abstractmethod
+    def connect_db(self) -> Any:
+        pass
+
+    def to_db_datetime(self, value: datetime) -> Any:
+        return value
+
+    def from_db_datetime(self, value: Any) -> datetime:
+        return value
+
+    @abstractmethod
+    def bucket_sql(self, bucket_seconds: int) -> str:
+        # SQL expression of the epoch seconds of the time bucket of created_at
+        pass
+
+    @abstractmethod
+    def sketch_index_sql(self, value_sql: str) -> str:
+        # SQL expression of summary.sketch_index
+        pass
+
+    def get_conditions(
+        self,
+        time_column: str,
+        since: datetime = None,
+        until: datetime = None,
+        source: str = None,
+        audio_format: str = None,
+        cached: int = None,
+    ) -> Tuple[str, List[Any]]:
+        p = self.PLACEHOLDER
+        conditions = []
+        params = []
+        if since:
+            conditions.append(f"{time_column} >= {p}")
+            params.append(self.to_db_datetime(since))
+        if until:
+            conditions.append(f"{time_column} < {p}")
+            params.append(self.to_db_datetime(until))
+        if source:
+            conditions.append(f"source = {p}")
+            params.append(source)
+        if audio_format:
+            conditions.append(f"audio_format = {p}")
+            params.append(audio_format)
+        if cached is not None:
+            conditions.append(f"cached = {p}")
+            params.append(cached)
+        return ("WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def query(self, sql: str, params: List[Any]) -> List[Tuple]:
+        conn = self.connect_db()
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                return cur.fetchall()
+            finally:
+                cur.close()
+        finally:
+            conn.close()
+
+    def fetch_summary_rows(
+        self,
+        *,
+        since: datetime = None,
+        until: datetime = None,
+        bucket_seconds: int = None,
+        source: str = None,
+        audio_format: str = None,
+        cached: int = None,
+    ) -> List[Tuple]:
+        # Aggregated in the database so that the raw records are not loaded. See summary.summarize_sketches for the columns
+        where, params = self.get_conditions("created_at", since, until, source, audio_format, cached)
+        rtf_sql = "CASE WHEN (cached = 0 OR cached IS NULL) AND elapsed IS NOT NULL AND audio_duration > 0 THEN elapsed / audio_duration END"
+        sql = f"""
+            SELECT
+                source, audio_format, cached,
+                {self.bucket_sql(bucket_seconds) if bucket_seconds else "NULL"},
+                CASE WHEN elapsed IS NOT NULL THEN {self.sketch_index_sql("elapsed")} END,
+                CASE WHEN ({rtf_sql}) IS NOT NULL THEN {self.sketch_index_sql(rtf_sql)} END,
+                COUNT(*), SUM(elapsed), SUM({rtf_sql}), MIN(created_at), MAX(created_at)
+            FROM performance_records
+            {where}
+            GROUP BY 1, 2, 3, 4, 5, 6
+        """
+        return [(*row[:9], self.from_db_datetime(row[9]), self.from_db_datetime(row[10])) for row in self.query(sql, params)]
+
+    def fetch_rollup_rows(
+        self,
+        *,
+        since: datetime = None,
+        until: datetime = None,
+        source: str = None,
+        audio_format: str = None,
+        cached: int = None,
+    ) -> List[Tuple]:
+        # Per-minute rollups of the records deleted by retention. Each row is in either the rollups or the raw records
+        where, params = self.get_conditions("bucket", since, until, source, audio_format, cached)
+        sql = f"SELECT bucket, source, audio_format, cached, count, elapsed_sum, sketch FROM performance_rollups {where}"
+        return [
+            (self.from_db_datetime(row[0]), *row[1:6], {int(k): v for k, v in json.loads(row[6] or "{}").items()})
+            for row in self.query(sql, params)
+        ]
+
+    def get_summary(
+        self,
+        *,
+        since: datetime = None,
+        until: datetime = None,
+        bucket_seconds: int = None,
+        group_by: Sequence[str] = GROUP_BY_KEYS,
+        source: str = None,
+        audio_format: str = None,
+        cached: int = None,
+    ) -> List[Dict[str, Any]]:
+        # Percentiles are estimated from log-scale sketches with the relative error of about 2.5%
+        validate_group_by(group_by)
+        rows = self.fetch_summary_rows(
+            since=since, until=until, bucket_seconds=bucket_seconds, source=source, audio_format=audio_format, cached=cached
+        )
+        rollups = self.fetch_rollup_rows(since=since, until=until, source=source, audio_format=audio_format, cached=cached)
+        return summarize_sketches(
+            rows, rollups=rollups, group_by=group_by, bucket_seconds=bucket_seconds, since=since, until=until
+        )
+
+
+class QueuedPerformanceRecorder(PerformanceRecorder):
+    # Set by subclasses before calling __init__
+    reader: PerformanceReader = None
+
+    def __init__(
+        self,
+        *,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+        overflow_policy: str = "drop_oldest",
+        sample_rate: float = 0.1,
+        spill_path: str = None,
+        retry_interval: float = 5.0,
+        retention_seconds: int = None,
+        rollup: bool = True,
+        rollup_retention_seconds: int = None,
+        retention_interval: float = 60.0,
+        retention_chunk_size: int = 1000,
+        text_policy: str = "full",
+        text_max_length: int = 64,
+    ):
+        validate_text_policy(text_policy)
+        # How the synthesized text is stored. Its length is always stored as text_length
+        self.text_policy = text_policy
+        self.text_max_length = text_max_length
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.record_queue = RecordQueue(maxsize=max_queue_size, overflow_policy=overflow_policy, sample_rate=sample_rate)
+        # Records that could not be written are stored to spill_path and replayed when the database is back
+        self.spill_path = spill_path
+        self.retry_interval = retry_interval
+        self.retry_at = 0.0
+        # Raw records older than retention_seconds are rolled up into per-minute aggregates and deleted
+        self.retention_seconds = retention_seconds
+        self.rollup = rollup
+        self.rollup_retention_seconds = rollup_retention_seconds
+        self.retention_interval = retention_interval
+        self.retention_chunk_size = retention_chunk_size
+        self.stop_event = threading.Event()
+
+        self.init_db()
+
+        self.worker_thread = threading.Thread(target=self.start_worker, daemon=True)
+        self.worker_thread.start()
+
+        if self.retention_seconds or self.rollup_retention_seconds:
+            self.retention_thread = threading.Thread(target=self.start_retention_worker, daemon=True)
+            self.retention_thread.start()
+        else:
+            self.retention_thread = None
+
+    @property
+    def dropped_count(self) -> int:
+        return self.record_queue.dropped_count
+
+    @abstractmethod
+    def init_db(self):
+        pass
+
+    @abstractmethod
+    def connect_db(self) -> Any:
+        pass
+
+    @abstractmethod
+    def insert_records(self, conn: Any, records: List[PerformanceRecord]):
+        pass
+
+    def get_summary(
+        self,
+        *,
+        since: datetime = None,
+        until: datetime = None,
+        bucket_seconds: int = None,
+        group_by: Sequence[str] = GROUP_BY_KEYS,
+        source: str = None,
+        audio_format: str = None,
+        cached: int = None,
+    ) -> List[Dict[str, Any]]:
+        return self.reader.get_summary(
+            since=since, until=until, bucket_seconds=bucket_seconds, group_by=group_by,
+            source=source, audio_format=audio_format, cached=cached
+        )
+
+    # Placeholder of the DB-API driver and datetime conversion used by the common queries. Same as the reader
+    PLACEHOLDER = "?"
+
+    def to_db_datetime(self, value: datetime) -> Any:
+        return self.reader.to_db_datetime(value)
+
+    def from_db_datetime(self, value: Any) -> datetime:
+        return self.reader.from_db_datetime(value)
+
+    def rollup_records(self, conn: Any, cutoff: datetime) -> int:
+        # Roll up and delete a chunk of raw records older than cutoff. Returns the number of deleted records
+        p = self.PLACEHOLDER
+        with conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    f"SELECT id, created_at, source, audio_format, cached, elapsed FROM performance_records WHERE created_at < {p} ORDER BY id LIMIT {p}",
+                    (self.to_db_datetime(cutoff), self.retention_chunk_size)
+                )
+                rows = cur.fetchall()
+                if not rows:
+                    return 0
+
+                if self.rollup:
+                    rollups = rollup_rows((self.from_db_datetime(r[1]), r[2], r[3], r[4], r[5]) for r in rows)
+                    for (bucket, source, audio_format, cached), rollup in rollups.items():
+                        key_params = (self.to_db_datetime(bucket), source, audio_format, cached)
+                        cur.execute(
+                            f"SELECT count, elapsed_sum, elapsed_min, elapsed_max, sketch FROM performance_rollups WHERE bucket = {p} AND source = {p} AND audio_format = {p} AND cached = {p}",
+                            key_params
+                        )
+                        if existing := cur.fetchone():
+                            rollup = merge_rollup(rollup, *existing)
+                        cur.execute(
+                            f"""
+                            INSERT INTO performance_rollups (bucket, source, audio_format, cached, count, elapsed_sum, elapsed_min, elapsed_max, sketch)
+                            VALUES ({p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p})
+                            ON CONFLICT (bucket, source, audio_format, cached) DO UPDATE SET
+                                count = excluded.count,
+                                elapsed_sum = excluded.elapsed_sum,
+                                elapsed_min = excluded.elapsed_min,
+                                elapsed_max = excluded.elapsed_max,
+                                sketch = excluded.sketch
+                            """,
+                            key_params + (rollup["count"], rollup["elapsed_sum"], rollup["elapsed_min"], rollup["elapsed_max"], json.dumps(rollup["sketch"]))
+                        )
+
+                # Rows older than cutoff up to the last id are exactly the ones selected above
+                cur.execute(
+                    f"DELETE FROM performance_records WHERE id <= {p} AND created_at < {p}",
+                    (rows[-1][0], self.to_db_datetime(cutoff))
+                )
+                return len(rows)
+            finally:
+                cur.close()
+
+    def delete_rollups(self, conn: Any, cutoff: datetime):
+        with conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(f"DELETE FROM performance_rollups WHERE bucket < {self.PLACEHOLDER}", (self.to_db_datetime(cutoff),))
+            finally:
+                cur.close()
+
+    def apply_retention(self):
+        conn = self.connect_db()
+        try:
+            now = datetime.now(timezone.utc)
+            if self.retention_seconds:
+                cutoff = now - timedelta(seconds=self.retention_seconds)
+                # Delete in chunks not to block the writer for a long time
+                while not self.stop_event.is_set():
+                    if self.rollup_records(conn, cutoff) < self.retention_chunk_size:
+                        break
+            if self.rollup_retention_seconds:
+                self.delete_rollups(conn, now - timedelta(seconds=self.rollup_retention_seconds))
+        finally:
+            self.close_connection(conn)
+
+    def start_retention_worker(self):
+        while not self.stop_event.wait(self.retention_interval):
+            try:
+                self.apply_retention()
+            except Exception as ex:
+                logger.error(f"Error at applying retention to performance records: {ex}")
+
+    def write_records(self, conn: Any, records: List[PerformanceRecord]) -> Any:
+        # Override to handle reconnection. Returns the connection to be used for subsequent writes
+        self.insert_records(conn, records)
+        return conn
+
+    def spill_records(self, records: List[PerformanceRecord]):
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for record in records:
+                record_dict = asdict(record)
+                record_dict["created_at"] = record.created_at.isoformat() if record.created_at else None
+                f.write(json.dumps(record_dict, ensure_ascii=False) + "\n")
+
+    def replay_spilled_records(self, conn: Any) -> Any:
+        # Move the file first so that records failed during replay are spilled to a new file.
+        # The file left by a crash during replay is replayed before the new one rather than overwritten
+        replay_path = self.spill_path + ".replay"
+        if not os.path.exists(replay_path):
+            os.replace(self.spill_path, replay_path)
+        with open(replay_path, encoding="utf-8") as f:
+            records = []
+            for line in f:
+                record_dict = json.loads(line)
+                if record_dict.get("created_at"):
+                    record_dict["created_at"] = datetime.fromisoformat(record_dict["created_at"])
+                records.append(PerformanceRecord(**record_dict))
+
+        for i in range(0, len(records), self.batch_size):
+            try:
+                conn = self.write_records(conn, records[i:i + self.batch_size])
+            except Exception:
+                self.spill_records(records[i:])
+                os.remove(replay_path)
+                raise
+
+        os.remove(replay_path)
+        logger.info(f"{len(records)} spilled performance records are replayed.")
+        if os.path.exists(self.spill_path):
+            return self.replay_spilled_records(conn)
+        return conn
+
+    def close_connection(self, conn: Any):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def flush(self, conn: Any, records: List[PerformanceRecord]) -> Any:
+        if self.spill_path and time.monotonic() < self.retry_at:
+            # Database is not available. Spill without waiting for connection
+            self.spill_records(records)
+            return conn
+
+        try:
+            if conn is None:
+                conn = self.connect_db()
+            conn = self.write_records(conn, records)
+        except Exception as ex:
+            logger.error(f"Error at writing {len(records)} performance records: {ex}")
+            self.close_connection(conn)
+            if self.spill_path:
+                self.spill_records(records)
+                self.retry_at = time.monotonic() + self.retry_interval
+            return None
+
+        if self.spill_path and (os.path.exists(self.spill_path) or os.path.exists(self.spill_path + ".replay")):
+            try:
+                conn = self.replay_spilled_records(conn)
+            except Exception as ex:
+                logger.error(f"Error at replaying spilled performance records: {ex}")
+                self.close_connection(conn)
+                self.retry_at = time.monotonic() + self.retry_interval
+                return None
+
+        return conn
+
+    def get_batch(self) -> List[PerformanceRecord]:
+        try:
+            records = [self.record_queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        # Flush when the batch is full or flush_interval has passed since the first record
+        deadline = time.monotonic() + self.flush_interval
+        while len(records) < self.batch_size:
+            try:
+                if self.stop_event.is_set():
+                    records.append(self.record_queue.get_nowait())
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    records.append(self.record_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return records
+
+    def start_worker(self):
+        conn = None
+        try:
+            while not self.stop_event.is_set() or not self.record_queue.empty():
+                records = self.get_batch()
+                if not records:
+                    continue
+
+                try:
+                    conn = self.flush(conn, records)
+                except Exception as ex:
+                    logger.error(f"Error at spilling {len(records)} performance records: {ex}")
+                finally:
+                    for _ in records:
+                        self.record_queue.task_done()
+        finally:
+            self.close_connection(conn)
+
+    def record(self, *, process_id: str, **fields):
+        performance_record = create_performance_record(process_id, fields, self.text_policy, self.text_max_length)
+        self.record_queue.put_record(performance_record)
+
+    def close(self):
+        self.stop_event.set()
+        self.record_queue.join()
+        self.worker_thread.join()
+        if self.retention_thread:
+            self.retention_thread.join()
 
 
 from .sqlite import SQLitePerformanceRecorder
@@ -0,0 +1,61 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+import json
+from speech_gateway.performance_recorder.summary import GROUP_BY_KEYS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show latency percentiles, throughput and cache hit ratio from performance records.")
+    parser.add_argument("--db-path", default="performance.db", help="Path to SQLite database.")
+    parser.add_argument("--postgres-host", help="Use PostgreSQL on this host instead of SQLite.")
+    parser.add_argument("--postgres-port", type=int, default=5432)
+    parser.add_argument("--postgres-dbname", default="speech_gateway")
+    parser.add_argument("--postgres-user", default="postgres")
+    parser.add_argument("--postgres-password")
+    parser.add_argument("--since-seconds", type=int, default=3600, help="Summarize records in the last N seconds.")
+    parser.add_argument("--bucket-seconds", type=int, help="Group records into time buckets of N seconds.")
+    parser.add_argument("--group-by", default=",".join(GROUP_BY_KEYS), help="Comma-separated keys from source, audio_format and cached.")
+    parser.add_argument("--source")
+    parser.add_argument("--audio-format")
+    parser.add_argument("--cached", type=int, choices=[0, 1])
+    parser.add_argument("--json", action="store_true", help="Output as JSON.")
+    args = parser.parse_args()
+
+    # Read-only. Neither the schema nor the database file is created
+    if args.postgres_host:
+        from speech_gateway.performance_recorder.postgres import PostgreSQLPerformanceReader
+        reader = PostgreSQLPerformanceReader(
+            host=args.postgres_host, port=args.postgres_port, dbname=args.postgres_dbname,
+            user=args.postgres_user, password=args.postgres_password
+        )
+    else:
+        from speech_gateway.performance_recorder.sqlite import SQLitePerformanceReader
+        reader = SQLitePerformanceReader(args.db_path)
+
+    summaries = reader.get_summary(
+        since=datetime.now(timezone.utc) - timedelta(seconds=args.since_seconds),
+        bucket_seconds=args.bucket_seconds,
+        group_by=[k for k in args.group_by.split(",") if k],
+        source=args.source,
+        audio_format=args.audio_format,
+        cached=args.cached
+    )
+
+    if args.json:
+        print(json.dumps(summaries, ensure_ascii=False, indent=2))
+        return
+
+    if not summaries:
+        print("No records found.")
+        return
+
+    columns = list(summaries[0].keys())
+    rows = [[f"{v:.3f}" if isinstance(v, float) else str(v) for v in s.values()] for s in summaries]
+    widths = [max(len(c), *(len(r[i]) for r in rows)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    main()
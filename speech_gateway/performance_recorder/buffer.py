@@ -0,0 +1,46 @@
+import logging
+import queue
+import random
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class RecordQueue(queue.Queue):
+    OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "sample")
+
+    def __init__(self, maxsize: int = 10000, overflow_policy: str = "drop_oldest", sample_rate: float = 0.1):
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow_policy: {overflow_policy}. Use one of {self.OVERFLOW_POLICIES}")
+        super().__init__(maxsize=maxsize)
+        self.overflow_policy = overflow_policy
+        self.sample_rate = sample_rate
+        self.dropped_count = 0
+
+    def put_record(self, item: Any) -> bool:
+        # Never blocks the caller. Returns False when the record (or an older one) is dropped
+        with self.mutex:
+            dropped = False
+            if self.maxsize > 0:
+                size = self._qsize()
+                if self.overflow_policy == "sample" and size >= self.maxsize // 2 and random.random() >= self.sample_rate:
+                    # Keep only sample_rate of new records once the queue is half full
+                    dropped = True
+                elif size >= self.maxsize:
+                    if self.overflow_policy == "drop_oldest":
+                        # Works as a ring buffer: discard the oldest one to make room
+                        self._get()
+                        self.unfinished_tasks -= 1
+                    dropped = True
+
+            if dropped:
+                self.dropped_count += 1
+                if self.dropped_count == 1 or self.dropped_count % 1000 == 0:
+                    logger.warning(f"Performance record queue is full. {self.dropped_count} records dropped so far ({self.overflow_policy}).")
+                if self.overflow_policy != "drop_oldest":
+                    return False
+
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            return not dropped
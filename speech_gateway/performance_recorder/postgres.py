@@ -1,16 +1,16 @@
-from dataclasses import fields
-from datetime import datetime, timezone
 import logging
-import queue
-import threading
-import time
+from typing import List
 import psycopg2
-from . import PerformanceRecorder, PerformanceRecord
+from psycopg2.extras import execute_values
+from . import PerformanceReader, QueuedPerformanceRecorder, PerformanceRecord, COLUMN_MIGRATIONS, RECORD_COLUMNS, get_record_values
+from .summary import SKETCH_GAMMA, SKETCH_MIN_VALUE
 
 logger = logging.getLogger(__name__)
 
 
-class PostgreSQLPerformanceRecorder(PerformanceRecorder):
+class PostgreSQLPerformanceReader(PerformanceReader):
+    PLACEHOLDER = "%s"
+
     def __init__(
         self,
         *,
@@ -27,13 +27,70 @@ class PostgreSQLPerformanceRecorder(PerformanceRecorder):
             "user": user,
             "password": password,
         }
-        self.record_queue = queue.Queue()
-        self.stop_event = threading.Event()
 
-        self.init_db()
+    def connect_db(self):
+        conn = psycopg2.connect(**self.connection_params)
+        conn.set_session(readonly=True)
+        return conn
+
+    def bucket_sql(self, bucket_seconds: int) -> str:
+        return f"FLOOR(EXTRACT(EPOCH FROM created_at) / {int(bucket_seconds)}) * {int(bucket_seconds)}"
+
+    def sketch_index_sql(self, value_sql: str) -> str:
+        return f"CEIL(LN(GREATEST({value_sql}, {SKETCH_MIN_VALUE})) / LN({SKETCH_GAMMA}))"
+
 
-        self.worker_thread = threading.Thread(target=self.start_worker, daemon=True)
-        self.worker_thread.start()
+class PostgreSQLPerformanceRecorder(QueuedPerformanceRecorder):
+    PLACEHOLDER = "%s"
+
+    def __init__(
+        self,
+        *,
+        host: str = "localhost",
+        port: int = 5432,
+        dbname: str = "speech_gateway",
+        user: str = "postgres",
+        password: str = None,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+        overflow_policy: str = "drop_oldest",
+        sample_rate: float = 0.1,
+        spill_path: str = None,
+        retry_interval: float = 5.0,
+        retention_seconds: int = None,
+        rollup: bool = True,
+        rollup_retention_seconds: int = None,
+        retention_interval: float = 60.0,
+        retention_chunk_size: int = 1000,
+        text_policy: str = "full",
+        text_max_length: int = 64,
+    ):
+        self.connection_params = {
+            "host": host,
+            "port": port,
+            "dbname": dbname,
+            "user": user,
+            "password": password,
+        }
+        self.reader = PostgreSQLPerformanceReader(host=host, port=port, dbname=dbname, user=user, password=password)
+        self.insert_sql = f"INSERT INTO performance_records ({', '.join(RECORD_COLUMNS)}) VALUES %s"
+        super().__init__(
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+            max_queue_size=max_queue_size,
+            overflow_policy=overflow_policy,
+            sample_rate=sample_rate,
+            spill_path=spill_path,
+            retry_interval=retry_interval,
+            retention_seconds=retention_seconds,
+            rollup=rollup,
+            rollup_retention_seconds=rollup_retention_seconds,
+            retention_interval=retention_interval,
+            retention_chunk_size=retention_chunk_size,
+            text_policy=text_policy,
+            text_max_length=text_max_length,
+        )
 
     def connect_db(self):
         return psycopg2.connect(**self.connection_params)
@@ -57,74 +114,52 @@ class PostgreSQLPerformanceRecorder(PerformanceRecorder):
                         )
                         """
                     )
+                    for name, column_type in COLUMN_MIGRATIONS:
+                        cur.execute(f"ALTER TABLE performance_records ADD COLUMN IF NOT EXISTS {name} {column_type}")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_performance_records_created_at ON performance_records (created_at)")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_performance_records_source ON performance_records (source)")
+                    cur.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS performance_rollups (
+                            bucket TIMESTAMPTZ NOT NULL,
+                            source TEXT NOT NULL,
+                            audio_format TEXT NOT NULL,
+                            cached INTEGER NOT NULL,
+                            count INTEGER NOT NULL,
+                            elapsed_sum REAL,
+                            elapsed_min REAL,
+                            elapsed_max REAL,
+                            sketch TEXT,
+                            PRIMARY KEY (bucket, source, audio_format, cached)
+                        )
+                        """
+                    )
         finally:
             conn.close()
 
-    def start_worker(self):
-        conn = self.connect_db()
+    def write_records(self, conn, records: List[PerformanceRecord]):
         try:
-            while not self.stop_event.is_set() or not self.record_queue.empty():
-                try:
-                    record = self.record_queue.get(timeout=0.5)
-                except queue.Empty:
-                    continue
-
-                try:
-                    self.insert_record(conn, record)
-                except (psycopg2.InterfaceError, psycopg2.OperationalError):
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
-
-                    logger.warning("Connection is not available. Retrying insert_record with new connection...")
-                    time.sleep(0.5)
-                    conn = self.connect_db()
-                    self.insert_record(conn, record)
-
-                self.record_queue.task_done()
-        finally:
+            self.insert_records(conn, records)
+        except (psycopg2.InterfaceError, psycopg2.OperationalError):
             try:
                 conn.close()
             except Exception:
                 pass
 
-
-    def insert_record(self, conn, record: PerformanceRecord):
-        columns = [field.name for field in fields(PerformanceRecord)] + ["created_at"]
-        placeholders = ["%s"] * len(columns)
-        values = [getattr(record, field.name) for field in fields(PerformanceRecord)] + [
-            datetime.now(timezone.utc)
-        ]
-
-        with conn.cursor() as cur:
-            cur.execute(
-                f"INSERT INTO performance_records ({', '.join(columns)}) VALUES ({', '.join(placeholders)})",
-                values,
-            )
-        conn.commit()
-
-    def record(
-        self,
-        *,
-        process_id: str,
-        source: str = None,
-        text: str = None,
-        audio_format: str = None,
-        cached: int = 0,
-        elapsed: float = None,
-    ):
-        performance_record = PerformanceRecord(
-            process_id=process_id,
-            source=source,
-            text=text,
-            audio_format=audio_format,
-            cached=cached,
-            elapsed=elapsed,
-        )
-        self.record_queue.put(performance_record)
-
-    def close(self):
-        self.stop_event.set()
-        self.record_queue.join()
-        self.worker_thread.join()
+            # Retry once immediately. If it fails again, records are spilled (or dropped) without blocking
+            logger.warning("Connection is not available. Retrying insert_records with new connection...")
+            conn = self.connect_db()
+            self.insert_records(conn, records)
+
+        return conn
+
+    def insert_records(self, conn, records: List[PerformanceRecord]):
+        # Insert all records with multi-row VALUES in one transaction
+        with conn:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    self.insert_sql,
+                    [get_record_values(record) for record in records],
+                    page_size=self.batch_size
+                )
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+from typing import List, Set
+import asyncpg
+from . import PerformanceRecorder, PerformanceRecord, COLUMN_MIGRATIONS, RECORD_COLUMNS, get_record_values, \
+    validate_text_policy, create_performance_record
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPostgreSQLPerformanceRecorder(PerformanceRecorder):
+    def __init__(
+        self,
+        *,
+        host: str = "localhost",
+        port: int = 5432,
+        dbname: str = "speech_gateway",
+        user: str = "postgres",
+        password: str = None,
+        min_pool_size: int = 1,
+        max_pool_size: int = 4,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+        connect_timeout: float = 5.0,
+        shutdown_timeout: float = 5.0,
+        text_policy: str = "full",
+        text_max_length: int = 64,
+    ):
+        validate_text_policy(text_policy)
+        self.connection_params = {
+            "host": host,
+            "port": port,
+            "database": dbname,
+            "user": user,
+            "password": password,
+        }
+        self.min_pool_size = min_pool_size
+        self.max_pool_size = max_pool_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.connect_timeout = connect_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.text_policy = text_policy
+        self.text_max_length = text_max_length
+        self.dropped_count = 0
+
+        # Created on the running event loop at the first record. Nothing blocks on construction
+        self.record_queue: asyncio.Queue = None
+        self.pool: asyncpg.Pool = None
+        self.pool_lock: asyncio.Lock = None
+        self.worker_task: asyncio.Task = None
+        self.write_tasks: Set[asyncio.Task] = set()
+        self.stopping = False
+
+    async def init_db(self, conn: asyncpg.Connection):
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS performance_records (
+                id SERIAL PRIMARY KEY,
+                process_id TEXT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL,
+                source TEXT,
+                text TEXT,
+                audio_format TEXT,
+                cached INTEGER,
+                elapsed REAL
+            )
+            """
+        )
+        for name, column_type in COLUMN_MIGRATIONS:
+            await conn.execute(f"ALTER TABLE performance_records ADD COLUMN IF NOT EXISTS {name} {column_type}")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_performance_records_created_at ON performance_records (created_at)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_performance_records_source ON performance_records (source)")
+
+    async def get_pool(self) -> asyncpg.Pool:
+        async with self.pool_lock:
+            if self.pool is None:
+                # Schema is initialized with the first connection, not on construction
+                pool = await asyncpg.create_pool(
+                    min_size=self.min_pool_size,
+                    max_size=self.max_pool_size,
+                    timeout=self.connect_timeout,
+                    **self.connection_params
+                )
+                try:
+                    async with pool.acquire() as conn:
+                        await self.init_db(conn)
+                except Exception:
+                    await pool.close()
+                    raise
+                self.pool = pool
+        return self.pool
+
+    def start(self):
+        self.record_queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.pool_lock = asyncio.Lock()
+        self.worker_task = asyncio.get_running_loop().create_task(self.start_worker())
+
+    async def get_batch(self) -> List[PerformanceRecord]:
+        try:
+            records = [await asyncio.wait_for(self.record_queue.get(), timeout=0.5)]
+        except asyncio.TimeoutError:
+            return []
+
+        # Flush when the batch is full or flush_interval has passed since the first record
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(records) < self.batch_size:
+            if not self.record_queue.empty():
+                records.append(self.record_queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if self.stopping or remaining <= 0:
+                break
+            try:
+                records.append(await asyncio.wait_for(self.record_queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return records
+
+    async def write_records(self, records: List[PerformanceRecord]):
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire() as conn:
+                # COPY is the fastest way to insert multiple rows
+                await conn.copy_records_to_table(
+                    "performance_records",
+                    records=[get_record_values(record) for record in records],
+                    columns=RECORD_COLUMNS
+                )
+        except Exception as ex:
+            logger.error(f"Error at writing {len(records)} performance records: {ex}")
+
+    async def start_worker(self):
+        semaphore = asyncio.Semaphore(self.max_pool_size)
+
+        async def write_with_limit(records: List[PerformanceRecord]):
+            try:
+                await self.write_records(records)
+            finally:
+                semaphore.release()
+
+        while not self.stopping or not self.record_queue.empty():
+            records = await self.get_batch()
+            if not records:
+                continue
+            # Write batches concurrently up to the pool size. Waits here while all connections are busy
+            # so that the records are kept in the queue bounded by max_queue_size
+            await semaphore.acquire()
+            task = asyncio.create_task(write_with_limit(records))
+            self.write_tasks.add(task)
+            task.add_done_callback(self.write_tasks.discard)
+
+        if self.write_tasks:
+            await asyncio.gather(*self.write_tasks)
+
+    def record(self, *, process_id: str, **fields):
+        # Must be called on the event loop thread
+        if self.stopping:
+            return
+        if self.worker_task is None:
+            self.start()
+
+        performance_record = create_performance_record(process_id, fields, self.text_policy, self.text_max_length)
+
+        if self.record_queue.full():
+            # Drop the oldest one not to grow memory while the database is slow
+            self.record_queue.get_nowait()
+            self.dropped_count += 1
+            if self.dropped_count == 1 or self.dropped_count % 1000 == 0:
+                logger.warning(f"Performance record queue is full. {self.dropped_count} records dropped so far.")
+        self.record_queue.put_nowait(performance_record)
+
+    async def aclose(self, timeout: float = None):
+        # Flush the queued records until the deadline, then cancel the rest
+        self.stopping = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.shutdown_timeout if timeout is None else timeout)
+
+        if self.worker_task:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.worker_task), timeout=max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                logger.warning(f"Performance recorder did not finish flushing by the deadline. {self.record_queue.qsize()} queued records are discarded.")
+                for task in [self.worker_task, *self.write_tasks]:
+                    task.cancel()
+                await asyncio.gather(self.worker_task, *self.write_tasks, return_exceptions=True)
+
+        if self.pool:
+            try:
+                await asyncio.wait_for(self.pool.close(), timeout=max(deadline - loop.time(), 0.1))
+            except asyncio.TimeoutError:
+                self.pool.terminate()
+
+    def close(self):
+        # Use `await aclose()` to wait for flushing. This schedules it on the running event loop if any
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.stopping = True
+            return
+        loop.create_task(self.aclose())
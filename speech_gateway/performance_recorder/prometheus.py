@@ -0,0 +1,189 @@
+from bisect import bisect_left
+import threading
+from typing import Callable, Dict, List, Tuple
+from . import PerformanceRecorder, PerformanceRecord, validate_record_fields
+
+DEFAULT_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+DEFAULT_RTF_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+LABEL_NAMES = ("gateway", "service", "audio_format")
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(label_names: Tuple[str, ...], label_values: Tuple, extra: str = None) -> str:
+    pairs = [f'{n}="{escape_label_value(v)}"' for n, v in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = LABEL_NAMES):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, label_values: Tuple, amount: float = 1.0):
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, description: str, collect: Callable[[], Dict[Tuple, float]], label_names: Tuple[str, ...] = (), metric_type: str = "gauge"):
+        # Values are collected from the owner (e.g. gateways) at rendering time
+        self.name = name
+        self.description = description
+        self.collect = collect
+        self.label_names = label_names
+        self.metric_type = metric_type
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_values, value in self.collect().items():
+            lines.append(f"{self.name}{format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: List[float], label_names: Tuple[str, ...] = LABEL_NAMES):
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self.label_names = label_names
+        # Non-cumulative bucket counts (the last one is +Inf), sum and count for each label values
+        self.values: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, label_values: Tuple, value: float):
+        if label_values not in self.values:
+            self.values[label_values] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+        counts, sum_count = self.values[label_values]
+        counts[bisect_left(self.buckets, value)] += 1
+        sum_count[0] += value
+        sum_count[1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, sum_count) in self.values.items():
+            cumulative = 0
+            for le, count in zip(self.buckets + ["+Inf"], counts):
+                cumulative += count
+                bucket_labels = format_labels(self.label_names, label_values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, label_values)} {sum_count[0]}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, label_values)} {sum_count[1]}")
+        return lines
+
+
+class PrometheusPerformanceRecorder(PerformanceRecorder):
+    def __init__(self, *, recorder: PerformanceRecorder = None, latency_buckets: List[float] = None, rtf_buckets: List[float] = None):
+        # Records are also passed to `recorder` (e.g. SQLitePerformanceRecorder) if set
+        self.recorder = recorder
+        self.lock = threading.Lock()
+        buckets = latency_buckets or DEFAULT_LATENCY_BUCKETS
+
+        self.requests = Counter("speech_gateway_requests_total", "Total number of requests.")
+        self.cache_hits = Counter("speech_gateway_cache_hits_total", "Total number of cache hits.")
+        self.cache_misses = Counter("speech_gateway_cache_misses_total", "Total number of cache misses.")
+        self.upstream_errors = Counter("speech_gateway_upstream_errors_total", "Total number of errors from upstream speech services.")
+        self.served_bytes = Counter("speech_gateway_served_bytes_total", "Total bytes of audio served.")
+        self.request_duration = Histogram("speech_gateway_request_duration_seconds", "End-to-end latency of requests.", buckets)
+        self.upstream_duration = Histogram("speech_gateway_upstream_duration_seconds", "Latency of upstream speech services including body download.", buckets)
+        self.conversion_duration = Histogram("speech_gateway_conversion_duration_seconds", "Latency of audio conversion.", buckets)
+        self.upstream_responses = Counter("speech_gateway_upstream_responses_total", "Total number of responses from upstream speech services by status code.", LABEL_NAMES + ("status",))
+        self.audio_duration = Counter("speech_gateway_audio_duration_seconds_total", "Total seconds of audio served.")
+        self.real_time_factor = Histogram("speech_gateway_real_time_factor", "Synthesis time divided by audio duration of uncached requests.", rtf_buckets or DEFAULT_RTF_BUCKETS)
+        self.upstream_latency = Histogram("speech_gateway_upstream_latency_seconds", "Latency of each upstream of load-balanced gateways including body download.", buckets, ("gateway", "service", "upstream"))
+        self.queue_wait_duration = Histogram("speech_gateway_queue_wait_seconds", "Time requests waited for a slot of the concurrency limit.", buckets)
+        self.upstream_connect_duration = Histogram("speech_gateway_upstream_connect_seconds", "Time of TCP and TLS handshakes of new connections to upstream speech services.", buckets)
+        self.upstream_connections = Counter("speech_gateway_upstream_connections_total", "Total number of requests to upstream speech services by whether the connection is reused.", LABEL_NAMES + ("reused",))
+        self.metrics = [
+            self.requests, self.cache_hits, self.cache_misses, self.upstream_errors, self.served_bytes,
+            self.request_duration, self.upstream_duration, self.conversion_duration,
+            self.upstream_responses, self.audio_duration, self.real_time_factor, self.upstream_latency,
+            self.queue_wait_duration, self.upstream_connect_duration, self.upstream_connections
+        ]
+
+    def record(self, *, process_id: str, **fields):
+        validate_record_fields(fields)
+        r = PerformanceRecord(process_id=process_id, **fields)
+        label_values = (r.source, r.service_name, r.audio_format)
+        with self.lock:
+            self.requests.inc(label_values)
+            if r.audio_format != "N/A":
+                # Proxy requests other than TTS are not counted as cache miss
+                (self.cache_hits if r.cached else self.cache_misses).inc(label_values)
+            if r.audio_bytes:
+                self.served_bytes.inc(label_values, r.audio_bytes)
+            if r.elapsed is not None:
+                self.request_duration.observe(label_values, r.elapsed)
+            if r.upstream_ttfb is not None:
+                self.upstream_duration.observe(label_values, r.upstream_ttfb + (r.download_elapsed or 0.0))
+                if r.upstream:
+                    self.upstream_latency.observe((r.source, r.service_name, r.upstream), r.upstream_ttfb + (r.download_elapsed or 0.0))
+            if r.queue_wait_elapsed is not None:
+                self.queue_wait_duration.observe(label_values, r.queue_wait_elapsed)
+            if r.connect_elapsed is not None:
+                self.upstream_connect_duration.observe(label_values, r.connect_elapsed)
+            if r.connection_reused is not None:
+                self.upstream_connections.inc(label_values + ("true" if r.connection_reused else "false",))
+            if r.conversion_elapsed is not None:
+                self.conversion_duration.observe(label_values, r.conversion_elapsed)
+            if r.upstream_status is not None:
+                self.upstream_responses.inc(label_values + (r.upstream_status,))
+            if r.audio_duration:
+                self.audio_duration.inc(label_values, r.audio_duration)
+                if not r.cached and r.elapsed is not None:
+                    self.real_time_factor.observe(label_values, r.elapsed / r.audio_duration)
+
+        if self.recorder:
+            self.recorder.record(process_id=process_id, **fields)
+
+    def record_error(
+        self,
+        *,
+        process_id: str,
+        source: str = None,
+        audio_format: str = None,
+        service_name: str = None,
+        error: Exception = None,
+    ):
+        with self.lock:
+            self.upstream_errors.inc((source, service_name, audio_format))
+
+        if self.recorder:
+            self.recorder.record_error(
+                process_id=process_id, source=source, audio_format=audio_format,
+                service_name=service_name, error=error
+            )
+
+    def register_gauge(
+        self,
+        name: str,
+        description: str,
+        collect: Callable[[], Dict[Tuple, float]],
+        label_names: Tuple[str, ...] = (),
+        metric_type: str = "gauge"
+    ):
+        # `collect` returns {label_values: value}. Use metric_type="counter" for monotonic values kept by the owner
+        with self.lock:
+            self.metrics = [m for m in self.metrics if m.name != name]
+            self.metrics.append(Gauge(name, description, collect, label_names, metric_type))
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self.recorder:
+            self.recorder.close()
@@ -1,25 +1,86 @@
-from dataclasses import fields
 from datetime import datetime, timezone
-import queue
+from pathlib import Path
 import sqlite3
-import threading
-from . import PerformanceRecorder, PerformanceRecord
+from typing import List
+from . import PerformanceReader, QueuedPerformanceRecorder, PerformanceRecord, COLUMN_MIGRATIONS, RECORD_COLUMNS, get_record_values
+from .summary import sketch_index
 
 
-class SQLitePerformanceRecorder(PerformanceRecorder):
+class SQLitePerformanceReader(PerformanceReader):
     def __init__(self, db_path="performance.db"):
         self.db_path = db_path
-        self.record_queue = queue.Queue()
-        self.stop_event = threading.Event()
 
-        self.init_db()
+    def connect_db(self) -> sqlite3.Connection:
+        # Read-only. The database file is not created when it doesn't exist
+        conn = sqlite3.connect(f"{Path(self.db_path).absolute().as_uri()}?mode=ro", uri=True)
+        conn.create_function("sketch_index", 1, sketch_index, deterministic=True)
+        return conn
 
-        self.worker_thread = threading.Thread(target=self.start_worker, daemon=True)
-        self.worker_thread.start()
+    def to_db_datetime(self, value: datetime) -> str:
+        # Stored as text in UTC in the same format as the default sqlite3 adapter
+        return value.astimezone(timezone.utc).isoformat(" ")
+
+    def from_db_datetime(self, value: str) -> datetime:
+        return datetime.fromisoformat(value)
+
+    def bucket_sql(self, bucket_seconds: int) -> str:
+        return f"CAST(strftime('%s', created_at) AS INTEGER) / {int(bucket_seconds)} * {int(bucket_seconds)}"
+
+    def sketch_index_sql(self, value_sql: str) -> str:
+        # Math functions of SQLite are optional at compile time
+        return f"sketch_index({value_sql})"
+
+
+class SQLitePerformanceRecorder(QueuedPerformanceRecorder):
+
+    def __init__(
+        self,
+        db_path="performance.db",
+        *,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+        overflow_policy: str = "drop_oldest",
+        sample_rate: float = 0.1,
+        spill_path: str = None,
+        retry_interval: float = 5.0,
+        retention_seconds: int = None,
+        rollup: bool = True,
+        rollup_retention_seconds: int = None,
+        retention_interval: float = 60.0,
+        retention_chunk_size: int = 1000,
+        text_policy: str = "full",
+        text_max_length: int = 64,
+    ):
+        self.db_path = db_path
+        self.reader = SQLitePerformanceReader(db_path)
+        self.insert_sql = f"INSERT INTO performance_records ({', '.join(RECORD_COLUMNS)}) VALUES ({', '.join(['?'] * len(RECORD_COLUMNS))})"
+        self.created_at_index = RECORD_COLUMNS.index("created_at")
+        super().__init__(
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+            max_queue_size=max_queue_size,
+            overflow_policy=overflow_policy,
+            sample_rate=sample_rate,
+            spill_path=spill_path,
+            retry_interval=retry_interval,
+            retention_seconds=retention_seconds,
+            rollup=rollup,
+            rollup_retention_seconds=rollup_retention_seconds,
+            retention_interval=retention_interval,
+            retention_chunk_size=retention_chunk_size,
+            text_policy=text_policy,
+            text_max_length=text_max_length,
+        )
+
+    def connect_db(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
 
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect_db()
         try:
+            # WAL mode is persistent in the database file. Readers don't block the writer
+            conn.execute("PRAGMA journal_mode=WAL")
             with conn:
                 conn.execute(
                     """
@@ -35,53 +96,37 @@ class SQLitePerformanceRecorder(PerformanceRecorder):
                     )
                     """
                 )
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(performance_records)")}
+                for name, column_type in COLUMN_MIGRATIONS:
+                    if name not in columns:
+                        conn.execute(f"ALTER TABLE performance_records ADD COLUMN {name} {column_type}")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_performance_records_created_at ON performance_records (created_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_performance_records_source ON performance_records (source)")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS performance_rollups (
+                        bucket TEXT NOT NULL,
+                        source TEXT NOT NULL,
+                        audio_format TEXT NOT NULL,
+                        cached INTEGER NOT NULL,
+                        count INTEGER NOT NULL,
+                        elapsed_sum REAL,
+                        elapsed_min REAL,
+                        elapsed_max REAL,
+                        sketch TEXT,
+                        PRIMARY KEY (bucket, source, audio_format, cached)
+                    )
+                    """
+                )
         finally:
             conn.close()
 
-    def start_worker(self):
-        conn = sqlite3.connect(self.db_path)
-        try:
-            while not self.stop_event.is_set() or not self.record_queue.empty():
-                try:
-                    record = self.record_queue.get(timeout=0.5)
-                except queue.Empty:
-                    continue
-
-                self.insert_record(conn, record)
-                self.record_queue.task_done()
-        finally:
-            conn.close()
-
-    def insert_record(self, conn: sqlite3.Connection, record: PerformanceRecord):
-        columns = [field.name for field in fields(PerformanceRecord)] + ["created_at"]
-        placeholders = ["?"] * len(columns)
-        values = [getattr(record, field.name) for field in fields(PerformanceRecord)] + [datetime.now(timezone.utc)]
-        sql = f"INSERT INTO performance_records ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
-        conn.execute(sql, values)
-        conn.commit()
-
-    def record(
-        self,
-        *,
-        process_id: str,
-        source: str = None,
-        text: str = None,
-        audio_format: str = None,
-        cached: int = 0,
-        elapsed: float = None,
-    ):
-        performance_record = PerformanceRecord(
-            process_id=process_id,
-            source=source,
-            text=text,
-            audio_format=audio_format,
-            cached = cached,
-            elapsed = elapsed
-        )
-
-        self.record_queue.put(performance_record)
+    def insert_records(self, conn: sqlite3.Connection, records: List[PerformanceRecord]):
+        rows = []
+        for record in records:
+            values = list(get_record_values(record))
+            values[self.created_at_index] = self.to_db_datetime(values[self.created_at_index])
+            rows.append(values)
 
-    def close(self):
-        self.stop_event.set()
-        self.record_queue.join()
-        self.worker_thread.join()
+        with conn:
+            conn.executemany(self.insert_sql, rows)
@@ -0,0 +1,165 @@
+from datetime import datetime, timezone
+import json
+import math
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+GROUP_BY_KEYS = ("source", "audio_format", "cached")
+# Relative accuracy of latency sketch is about (SKETCH_GAMMA - 1) / 2
+SKETCH_GAMMA = 1.05
+SKETCH_MIN_VALUE = 1e-6
+
+
+def summarize_sketches(
+    rows: Iterable[Tuple],
+    *,
+    rollups: Iterable[Tuple] = (),
+    group_by: Sequence[str] = GROUP_BY_KEYS,
+    bucket_seconds: int = None,
+    since: datetime = None,
+    until: datetime = None,
+) -> List[Dict[str, Any]]:
+    # rows aggregated in the database by the keys, bucket and sketch indices of elapsed and real-time factor:
+    #   (source, audio_format, cached, bucket (epoch seconds), elapsed_index, rtf_index, count, elapsed_sum, rtf_sum, first_at, last_at)
+    # rollups of the records already deleted by retention: (bucket, source, audio_format, cached, count, elapsed_sum, sketch).
+    #   They are put into the time buckets by their minutes and have no real-time factor
+    # Percentiles are estimated from the sketches
+    validate_group_by(group_by)
+
+    groups: Dict[Tuple, Dict[str, Any]] = {}
+    first_at = last_at = None
+
+    def get_group(source: str, audio_format: str, cached: int, timestamp: float, count: int) -> Dict[str, Any]:
+        values = {"source": source, "audio_format": audio_format, "cached": cached}
+        bucket = datetime.fromtimestamp(timestamp - timestamp % bucket_seconds, tz=timezone.utc) if bucket_seconds else None
+        key = tuple(values[k] for k in group_by) + (bucket,)
+        if key not in groups:
+            groups[key] = {"elapsed": {}, "elapsed_sum": 0.0, "rtf": {}, "rtf_sum": 0.0, "hits": 0, "count": 0}
+        group = groups[key]
+        if cached:
+            group["hits"] += count
+        group["count"] += count
+        return group
+
+    for source, audio_format, cached, bucket, elapsed_index, rtf_index, count, elapsed_sum, rtf_sum, group_first_at, group_last_at in rows:
+        group = get_group(source, audio_format, cached, int(bucket) if bucket_seconds else 0, count)
+        if elapsed_index is not None:
+            group["elapsed"][int(elapsed_index)] = group["elapsed"].get(int(elapsed_index), 0) + count
+            group["elapsed_sum"] += elapsed_sum
+        if rtf_index is not None:
+            group["rtf"][int(rtf_index)] = group["rtf"].get(int(rtf_index), 0) + count
+            group["rtf_sum"] += rtf_sum
+        first_at = group_first_at if first_at is None or group_first_at < first_at else first_at
+        last_at = group_last_at if last_at is None or group_last_at > last_at else last_at
+
+    for bucket, source, audio_format, cached, count, elapsed_sum, sketch in rollups:
+        # NULL was stored as empty string in the rollup table
+        group = get_group(source or None, audio_format or None, cached, bucket.timestamp(), count)
+        for index, index_count in sketch.items():
+            group["elapsed"][index] = group["elapsed"].get(index, 0) + index_count
+        group["elapsed_sum"] += elapsed_sum or 0.0
+        first_at = bucket if first_at is None or bucket < first_at else first_at
+        last_at = bucket if last_at is None or bucket > last_at else last_at
+
+    window = get_window(bucket_seconds, since, until, first_at, last_at)
+    summaries = []
+    for key, group in sort_groups(groups):
+        elapsed_count = sum(group["elapsed"].values())
+        rtf_count = sum(group["rtf"].values())
+        summary = get_group_values(key, group_by, bucket_seconds)
+        summary.update({
+            "count": group["count"],
+            "throughput": group["count"] / window,
+            "hit_ratio": group["hits"] / group["count"],
+            "avg": group["elapsed_sum"] / elapsed_count if elapsed_count else None,
+            "p50": sketch_percentile(group["elapsed"], 50),
+            "p90": sketch_percentile(group["elapsed"], 90),
+            "p99": sketch_percentile(group["elapsed"], 99),
+            "rtf_avg": group["rtf_sum"] / rtf_count if rtf_count else None,
+            "rtf_p90": sketch_percentile(group["rtf"], 90),
+        })
+        summaries.append(summary)
+
+    return summaries
+
+
+def validate_group_by(group_by: Sequence[str]):
+    for key in group_by:
+        if key not in GROUP_BY_KEYS:
+            raise ValueError(f"Unknown group_by key: {key}. Use any of {GROUP_BY_KEYS}")
+
+
+def get_window(bucket_seconds: int, since: datetime, until: datetime, first_at: datetime, last_at: datetime) -> float:
+    # Window to calculate throughput (requests per second)
+    if bucket_seconds:
+        window = bucket_seconds
+    elif first_at:
+        window = ((until or last_at) - (since or first_at)).total_seconds()
+    else:
+        window = 0
+    return max(window, 1.0)
+
+
+def sort_groups(groups: Dict[Tuple, Dict[str, Any]]) -> List[Tuple[Tuple, Dict[str, Any]]]:
+    return sorted(groups.items(), key=lambda item: tuple("" if v is None else str(v) for v in item[0]))
+
+
+def get_group_values(key: Tuple, group_by: Sequence[str], bucket_seconds: int) -> Dict[str, Any]:
+    values = {k: v for k, v in zip(group_by, key)}
+    if bucket_seconds:
+        values["bucket"] = key[-1].isoformat()
+    return values
+
+
+def sketch_index(value: float) -> int:
+    return math.ceil(math.log(max(value, SKETCH_MIN_VALUE), SKETCH_GAMMA))
+
+
+def sketch_percentile(sketch: Dict[int, int], p: float) -> float:
+    # Estimate percentile from log-scale bucket counts
+    total = sum(sketch.values())
+    if total == 0:
+        return None
+    rank = (total - 1) * p / 100
+    cumulative = 0
+    for index in sorted(sketch):
+        cumulative += sketch[index]
+        if cumulative > rank:
+            return 2 * SKETCH_GAMMA ** index / (SKETCH_GAMMA + 1)
+
+
+def rollup_rows(
+    rows: Iterable[Tuple[datetime, str, str, int, float]],
+    bucket_seconds: int = 60
+) -> Dict[Tuple[datetime, str, str, int], Dict[str, Any]]:
+    # rows: (created_at, source, audio_format, cached, elapsed)
+    # NULL is replaced with empty string (or 0 for cached) to be used as the unique key of rollup table
+    rollups = {}
+    for created_at, source, audio_format, cached, elapsed in rows:
+        timestamp = created_at.timestamp()
+        bucket = datetime.fromtimestamp(timestamp - timestamp % bucket_seconds, tz=timezone.utc)
+        key = (bucket, source or "", audio_format or "", cached or 0)
+        if key not in rollups:
+            rollups[key] = {"count": 0, "elapsed_sum": 0.0, "elapsed_min": None, "elapsed_max": None, "sketch": {}}
+        rollup = rollups[key]
+        rollup["count"] += 1
+        if elapsed is not None:
+            rollup["elapsed_sum"] += elapsed
+            rollup["elapsed_min"] = min(elapsed, rollup["elapsed_min"] if rollup["elapsed_min"] is not None else elapsed)
+            rollup["elapsed_max"] = max(elapsed, rollup["elapsed_max"] if rollup["elapsed_max"] is not None else elapsed)
+            index = sketch_index(elapsed)
+            rollup["sketch"][index] = rollup["sketch"].get(index, 0) + 1
+    return rollups
+
+
+def merge_rollup(rollup: Dict[str, Any], count: int, elapsed_sum: float, elapsed_min: float, elapsed_max: float, sketch: str) -> Dict[str, Any]:
+    # Merge the row already stored in rollup table into the new rollup
+    merged_sketch = dict(rollup["sketch"])
+    for index, index_count in json.loads(sketch or "{}").items():
+        merged_sketch[int(index)] = merged_sketch.get(int(index), 0) + index_count
+    return {
+        "count": rollup["count"] + count,
+        "elapsed_sum": rollup["elapsed_sum"] + (elapsed_sum or 0.0),
+        "elapsed_min": min((v for v in (rollup["elapsed_min"], elapsed_min) if v is not None), default=None),
+        "elapsed_max": max((v for v in (rollup["elapsed_max"], elapsed_max) if v is not None), default=None),
+        "sketch": merged_sketch,
+    }
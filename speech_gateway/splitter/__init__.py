@@ -0,0 +1,11 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+
+class TextSplitter(ABC):
+    @abstractmethod
+    def split(self, text: str) -> List[str]:
+        pass
+
+
+from .sentence import SentenceSplitter, IncrementalSentenceSplitter
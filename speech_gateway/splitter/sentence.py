@@ -0,0 +1,132 @@
+from typing import List
+from . import TextSplitter
+
+
+class SentenceSplitter(TextSplitter):
+    # Always end a sentence (Japanese punctuation, exclamation, question and line break)
+    TERMINATORS = "。．！？!?…\n"
+    # Attached to the preceding sentence
+    CLOSINGS = "」』）)】〉》”’\"'"
+    # Used to split sentences longer than max_length
+    PAUSES = "、，,;；：:"
+    # English words that end with a period but don't end a sentence
+    ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "st", "jr", "sr", "vs", "etc", "e.g", "i.e", "no", "inc", "ltd", "co"}
+
+    def __init__(self, *, min_length: int = 8, max_length: int = 200):
+        # Sentences shorter than min_length are joined to the next one not to make too many requests
+        self.min_length = min_length
+        self.max_length = max_length
+
+    def is_abbreviation(self, text: str, period_index: int) -> bool:
+        start = period_index
+        while start > 0 and not text[start - 1].isspace():
+            start -= 1
+        word = text[start:period_index].lower()
+        # Single letter like initials of names (J. K. Rowling)
+        return word in self.ABBREVIATIONS or (len(word) == 1 and word.isalpha())
+
+    def find_boundary(self, text: str, start: int = 0) -> int:
+        # Returns the end index of the first sentence from start, or -1 if it's not determined yet.
+        # A sentence at the end of text is not determined because closing brackets or spaces may follow
+        i = start
+        while i < len(text):
+            c = text[i]
+            if c not in self.TERMINATORS and c != ".":
+                i += 1
+                continue
+
+            j = i + 1
+            while j < len(text) and (text[j] in self.TERMINATORS or text[j] == "."):
+                j += 1
+            periods_only = all(ch == "." for ch in text[i:j])
+            while j < len(text) and text[j] in self.CLOSINGS:
+                j += 1
+            if j >= len(text):
+                return -1
+
+            if periods_only and (not text[j].isspace() or self.is_abbreviation(text, i)):
+                # Decimal point, URL, abbreviation, etc.
+                i = j
+                continue
+            return j
+
+        return -1
+
+    def split_long(self, sentence: str) -> List[str]:
+        parts = []
+        while len(sentence.strip()) > self.max_length:
+            cut = max(sentence.rfind(p, 0, self.max_length) for p in self.PAUSES) + 1
+            if cut <= 0:
+                cut = self.max_length
+            parts.append(sentence[:cut])
+            sentence = sentence[cut:]
+        parts.append(sentence)
+        return parts
+
+    def arrange(self, sentences: List[str]) -> List[str]:
+        segments = []
+        for sentence in sentences:
+            for part in self.split_long(sentence):
+                if not part.strip():
+                    continue
+                if segments and (len(segments[-1].strip()) < self.min_length or not any(c.isalnum() for c in part)):
+                    # Keep the original spaces between sentences. Punctuation only is attached to the previous one
+                    segments[-1] += part
+                else:
+                    segments.append(part)
+        if len(segments) > 1 and len(segments[-1].strip()) < self.min_length:
+            last = segments.pop()
+            segments[-1] += last
+        return [s.strip() for s in segments]
+
+    def split(self, text: str) -> List[str]:
+        sentences = []
+        start = 0
+        while (end := self.find_boundary(text, start)) >= 0:
+            sentences.append(text[start:end])
+            start = end
+        sentences.append(text[start:])
+        return self.arrange(sentences)
+
+
+class IncrementalSentenceSplitter:
+    def __init__(self, splitter: SentenceSplitter = None):
+        # Detects sentences from text deltas (e.g. LLM tokens) as soon as their boundaries are determined
+        self.splitter = splitter or SentenceSplitter()
+        self.buffer = ""
+        # Sentences shorter than min_length wait for the next one
+        self.pending = ""
+
+    def arrange(self, sentences: List[str]) -> List[str]:
+        completed = []
+        for sentence in sentences:
+            self.pending += sentence
+            if len(self.pending.strip()) >= self.splitter.min_length and any(c.isalnum() for c in self.pending):
+                completed.append(self.pending.strip())
+                self.pending = ""
+        return completed
+
+    def feed(self, delta: str) -> List[str]:
+        # Returns the sentences completed by the delta
+        self.buffer += delta
+        sentences = []
+        while (end := self.splitter.find_boundary(self.buffer)) >= 0:
+            sentences.append(self.buffer[:end])
+            self.buffer = self.buffer[end:]
+
+        if len(self.buffer.strip()) > self.splitter.max_length:
+            parts = self.splitter.split_long(self.buffer)
+            sentences.extend(parts[:-1])
+            self.buffer = parts[-1]
+
+        return self.arrange(sentences)
+
+    def flush(self) -> List[str]:
+        # Returns the rest as a sentence
+        text = (self.pending + self.buffer).strip()
+        self.clear()
+        return [text] if text else []
+
+    def clear(self):
+        self.buffer = ""
+        self.pending = ""
@@ -0,0 +1,6 @@
+from .load_shedding import EventLoopLagMonitor, LoadSheddingPolicy
+from .limiter import ConcurrencyLimiter, QueueTimeoutError
+from .circuit_breaker import CircuitBreaker
+from .upstream import Upstream, UpstreamPool
+from .hedging import HedgingPolicy
+from .connection import ConnectionWarmer, connection_trace
@@ -0,0 +1,118 @@
+from collections import deque
+import logging
+from time import monotonic
+from typing import Deque, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    STATES = ("closed", "open", "half_open")
+
+    def __init__(
+        self,
+        *,
+        failure_rate_threshold: float = 0.5,
+        min_requests: int = 10,
+        window: float = 30.0,
+        open_duration: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        # Opens when failures (errors and timeouts) are failure_rate_threshold or more of at least min_requests
+        # in the last `window` seconds. Requests fail fast while open. After open_duration, up to half_open_max_calls
+        # trial requests are sent and the circuit closes when all of them succeed, or opens again when one fails
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_requests = min_requests
+        self.window = window
+        self.open_duration = open_duration
+        self.half_open_max_calls = half_open_max_calls
+        self.outcomes: Deque[Tuple[float, bool]] = deque()
+        self.opened_at: float = None
+        self.trials = 0
+        self.trial_successes = 0
+        self.open_count = 0
+        self.rejected_count = 0
+        self._state = "closed"
+
+    def clone(self) -> "CircuitBreaker":
+        # A breaker with the same settings for each upstream
+        return CircuitBreaker(
+            failure_rate_threshold=self.failure_rate_threshold,
+            min_requests=self.min_requests,
+            window=self.window,
+            open_duration=self.open_duration,
+            half_open_max_calls=self.half_open_max_calls,
+        )
+
+    @property
+    def state(self) -> str:
+        if self._state == "open" and monotonic() - self.opened_at >= self.open_duration:
+            self._state = "half_open"
+            self.trials = 0
+            self.trial_successes = 0
+        return self._state
+
+    @property
+    def available(self) -> bool:
+        # Whether a request would be allowed now. Doesn't change the state
+        state = self.state
+        return state == "closed" or (state == "half_open" and self.trials < self.half_open_max_calls)
+
+    @property
+    def retry_after(self) -> float:
+        if self._state != "open":
+            return 0.0
+        return max(self.open_duration - (monotonic() - self.opened_at), 0.0)
+
+    def allow(self) -> bool:
+        # Call record() with the result when allowed
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and self.trials < self.half_open_max_calls:
+            self.trials += 1
+            return True
+        self.rejected_count += 1
+        return False
+
+    def open(self):
+        self._state = "open"
+        self.opened_at = monotonic()
+        self.outcomes.clear()
+        self.open_count += 1
+
+    def close(self):
+        self._state = "closed"
+        self.outcomes.clear()
+
+    def record(self, success: Optional[bool], trial: bool = False):
+        # success=None for results that don't tell the health of the upstream (e.g. cancelled or client errors)
+        if trial:
+            if self._state != "half_open":
+                return
+            if success is None:
+                # Let another request try
+                self.trials -= 1
+            elif success:
+                self.trial_successes += 1
+                if self.trial_successes >= self.half_open_max_calls:
+                    logger.info("Circuit closed after successful trials.")
+                    self.close()
+            else:
+                logger.warning(f"Circuit opened again after a failed trial. Retry after {self.open_duration}s.")
+                self.open()
+            return
+
+        if success is None or self._state != "closed":
+            return
+
+        now = monotonic()
+        self.outcomes.append((now, success))
+        while self.outcomes and self.outcomes[0][0] < now - self.window:
+            self.outcomes.popleft()
+
+        if len(self.outcomes) >= self.min_requests:
+            failures = sum(1 for _, ok in self.outcomes if not ok)
+            if failures / len(self.outcomes) >= self.failure_rate_threshold:
+                logger.warning(f"Circuit opened: {failures} failures in {len(self.outcomes)} requests. Retry after {self.open_duration}s.")
+                self.open()
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, List
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HANDSHAKE_STEPS = ("connection.connect_tcp", "connection.start_tls")
+
+
+def connection_trace(phases: Dict[str, float]) -> Callable[[str, dict], Awaitable[None]]:
+    # Trace extension of httpx requests. Time of TCP and TLS handshakes is added to phases as connect_elapsed,
+    # and connection_reused is 1 when the request is sent over an existing connection
+    started_at: Dict[str, float] = {}
+    connected = False
+
+    async def trace(event_name: str, info: dict):
+        nonlocal connected
+        step, _, status = event_name.rpartition(".")
+        if step in HANDSHAKE_STEPS:
+            if status == "started":
+                started_at[step] = perf_counter()
+                connected = True
+            elif step in started_at:
+                phases["connect_elapsed"] = phases.get("connect_elapsed", 0.0) + perf_counter() - started_at.pop(step)
+        elif step.endswith(".send_request_headers") and status == "started":
+            phases["connection_reused"] = 0 if connected else 1
+
+    return trace
+
+
+class ConnectionWarmer:
+    def __init__(
+        self,
+        urls: List[str],
+        *,
+        connections: int = 1,
+        interval: float = None,
+        timeout: float = 5.0,
+    ):
+        # Opens `connections` connections to each URL by concurrent requests, and repeats it every `interval` seconds
+        # as a heartbeat so that idle connections are not closed. Any response status is fine
+        self.urls = urls
+        self.connections = connections
+        self.interval = interval
+        self.timeout = timeout
+        self.task: asyncio.Task = None
+
+    async def warm(self, http_client: httpx.AsyncClient):
+        async def request(url: str):
+            try:
+                await http_client.get(url, timeout=self.timeout)
+            except Exception as ex:
+                logger.warning(f"Failed to warm up the connection to {url}: {ex}")
+
+        await asyncio.gather(*(request(url) for url in self.urls for _ in range(self.connections)))
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self, http_client: httpx.AsyncClient):
+        # Must be called on the event loop thread. Does nothing when already running or the heartbeat is disabled
+        if self.interval and not self.running:
+            self.task = asyncio.get_running_loop().create_task(self.run(http_client))
+
+    async def run(self, http_client: httpx.AsyncClient):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.warm(http_client)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,39 @@
+from collections import deque
+from typing import Deque, Dict
+
+
+class HedgingPolicy:
+    def __init__(
+        self,
+        *,
+        quantile: float = 0.95,
+        initial_delay: float = 1.0,
+        min_delay: float = 0.1,
+        max_delay: float = 5.0,
+        window_size: int = 200,
+        min_samples: int = 20,
+    ):
+        # A hedged request is sent to the next gateway when the current one takes longer than the quantile of its
+        # recent latencies. initial_delay is used until min_samples latencies are observed
+        if not 0 < quantile <= 1:
+            raise ValueError("quantile must be in (0, 1]")
+        self.quantile = quantile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.window_size = window_size
+        self.min_samples = min_samples
+        self.samples: Dict[str, Deque[float]] = {}
+
+    def observe(self, key: str, latency: float):
+        if key not in self.samples:
+            self.samples[key] = deque(maxlen=self.window_size)
+        self.samples[key].append(latency)
+
+    def get_delay(self, key: str) -> float:
+        samples = self.samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return self.initial_delay
+        ordered = sorted(samples)
+        value = ordered[min(int(len(ordered) * self.quantile), len(ordered) - 1)]
+        return min(max(value, self.min_delay), self.max_delay)
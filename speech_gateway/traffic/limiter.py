@@ -0,0 +1,128 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import logging
+from time import monotonic
+from typing import AsyncIterator, Deque, Dict
+
+logger = logging.getLogger(__name__)
+
+# Dispatched in this order
+PRIORITIES = ("interactive", "batch")
+
+
+class QueueTimeoutError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+class ConcurrencyLimiter:
+    def __init__(
+        self,
+        max_concurrency: int,
+        *,
+        max_queue_time: float = None,
+        batch_throttle_latency: float = 0.5,
+        batch_throttled_concurrency: int = 1,
+        latency_half_life: float = 5.0,
+    ):
+        # Requests over max_concurrency wait in FIFO order for each priority. Interactive ones are always dispatched first
+        # and are rejected after waiting max_queue_time seconds. Batch ones are not rejected but throttled to
+        # batch_throttled_concurrency while the recent queue latency of interactive ones exceeds batch_throttle_latency
+        if max_concurrency < 1 or batch_throttled_concurrency < 1:
+            raise ValueError("max_concurrency and batch_throttled_concurrency must be 1 or more")
+        self.max_concurrency = max_concurrency
+        self.max_queue_time = max_queue_time
+        self.batch_throttle_latency = batch_throttle_latency
+        self.batch_throttled_concurrency = batch_throttled_concurrency
+        self.latency_half_life = latency_half_life
+        self.active: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self.waiters: Dict[str, Deque[asyncio.Future]] = {p: deque() for p in PRIORITIES}
+        self.rejected_count = 0
+        self.latency = 0.0
+        self.latency_updated_at = monotonic()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(w) for w in self.waiters.values())
+
+    @property
+    def interactive_latency(self) -> float:
+        # Decays while no interactive request waits so that batch work resumes after the peak
+        return self.latency * 0.5 ** ((monotonic() - self.latency_updated_at) / self.latency_half_life)
+
+    def update_latency(self, queue_wait: float):
+        self.latency = max(queue_wait, self.interactive_latency)
+        self.latency_updated_at = monotonic()
+
+    def validate_priority(self, priority: str):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}. Use one of {PRIORITIES}")
+
+    def batch_limit(self) -> int:
+        if self.waiters["interactive"] or self.interactive_latency > self.batch_throttle_latency:
+            return min(self.batch_throttled_concurrency, self.max_concurrency)
+        return self.max_concurrency
+
+    def can_dispatch(self, priority: str) -> bool:
+        if sum(self.active.values()) >= self.max_concurrency:
+            return False
+        if priority == "batch":
+            return self.active["batch"] < self.batch_limit()
+        return True
+
+    async def acquire(self, priority: str = "interactive") -> float:
+        # Returns seconds waited in the queue
+        self.validate_priority(priority)
+        if not self.waiters[priority] and self.can_dispatch(priority) and \
+                (priority == "interactive" or not self.waiters["interactive"]):
+            self.active[priority] += 1
+            if priority == "interactive":
+                self.update_latency(0.0)
+            return 0.0
+
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        waiter = loop.create_future()
+        self.waiters[priority].append(waiter)
+        try:
+            # Not wait_for not to cancel the waiter that the slot has just been handed over to
+            done, _ = await asyncio.wait({waiter}, timeout=self.max_queue_time if priority == "interactive" else None)
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release(priority)
+            else:
+                self.waiters[priority].remove(waiter)
+            raise
+
+        if not done:
+            self.waiters[priority].remove(waiter)
+            self.rejected_count += 1
+            self.update_latency(self.max_queue_time)
+            if self.rejected_count == 1 or self.rejected_count % 1000 == 0:
+                logger.warning(f"Request waited for {self.max_queue_time}s in the queue and is rejected. {self.rejected_count} requests rejected so far.")
+            raise QueueTimeoutError(f"No slot available in {self.max_queue_time} seconds")
+
+        queue_wait = loop.time() - start_time
+        if priority == "interactive":
+            self.update_latency(queue_wait)
+        return queue_wait
+
+    def release(self, priority: str = "interactive"):
+        self.active[priority] -= 1
+        self.dispatch()
+
+    def dispatch(self):
+        # Hand the free slots over to the waiters in the order of priority
+        for priority in PRIORITIES:
+            while self.waiters[priority] and self.can_dispatch(priority):
+                self.active[priority] += 1
+                self.waiters[priority].popleft().set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "interactive") -> AsyncIterator[float]:
+        wait_time = await self.acquire(priority)
+        try:
+            yield wait_time
+        finally:
+            self.release(priority)
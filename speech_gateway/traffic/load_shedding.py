@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoopLagMonitor:
+    def __init__(self, *, interval: float = 0.1, decay: float = 0.9):
+        # Samples how late a sleep of `interval` wakes up. A stalled loop (e.g. synchronous conversion) shows up as lag
+        self.interval = interval
+        self.decay = decay
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.task: asyncio.Task = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        # Must be called on the event loop thread. Does nothing when already running
+        if not self.running:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start_time = loop.time()
+            await asyncio.sleep(self.interval)
+            sample = max(loop.time() - start_time - self.interval, 0.0)
+            # Hold the peak and decay gradually not to flap right after a stall
+            self.lag = max(sample, self.lag * self.decay)
+            self.max_lag = max(self.max_lag, sample)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+class LoadSheddingPolicy:
+    MODES = ("reject", "cache_only")
+
+    def __init__(
+        self,
+        *,
+        max_loop_lag: float = 0.5,
+        max_in_flight: int = None,
+        mode: str = "reject",
+        retry_after: int = 1,
+        lag_monitor: EventLoopLagMonitor = None,
+    ):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown mode: {mode}. Use one of {self.MODES}")
+        self.max_loop_lag = max_loop_lag
+        self.max_in_flight = max_in_flight
+        self.mode = mode
+        self.retry_after = retry_after
+        self.lag_monitor = lag_monitor or EventLoopLagMonitor()
+        self.shed_count = 0
+
+    def is_overloaded(self, in_flight: int) -> bool:
+        if self.max_loop_lag is not None and self.lag_monitor.lag > self.max_loop_lag:
+            return True
+        if self.max_in_flight is not None and in_flight >= self.max_in_flight:
+            return True
+        return False
+
+    def shed(self, in_flight: int):
+        self.shed_count += 1
+        if self.shed_count == 1 or self.shed_count % 1000 == 0:
+            logger.warning(f"Shedding load ({self.mode}): loop lag={self.lag_monitor.lag:.3f}s, in-flight={in_flight}. {self.shed_count} requests shed so far.")
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from typing import List
+from urllib.parse import urlsplit
+import httpx
+from .circuit_breaker import CircuitBreaker
+from .limiter import ConcurrencyLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class Upstream:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        # Requests sent and not completed yet
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        # Set by the gateway to limit concurrency per upstream
+        self.limiter: ConcurrencyLimiter = None
+        self.circuit_breaker: CircuitBreaker = None
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and (self.circuit_breaker is None or self.circuit_breaker.available)
+
+    @property
+    def origin(self) -> str:
+        url = urlsplit(self.base_url)
+        return f"{url.scheme}://{url.netloc}"
+
+
+class UpstreamPool:
+    def __init__(
+        self,
+        base_urls: List[str],
+        *,
+        health_check_path: str = None,
+        health_check_interval: float = 5.0,
+        health_check_timeout: float = 2.0,
+        unhealthy_threshold: int = 2,
+        healthy_threshold: int = 2,
+    ):
+        if not base_urls:
+            raise ValueError("base_urls must have at least one URL")
+        self.upstreams = [Upstream(base_url) for base_url in base_urls]
+        # Health checks are disabled when health_check_path is None
+        self.health_check_path = health_check_path
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        # Ejected after unhealthy_threshold consecutive failures and readmitted after healthy_threshold successes
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+        self.next_index = 0
+        self.task: asyncio.Task = None
+
+    def select(self) -> Upstream:
+        # Least outstanding requests among healthy upstreams whose circuits are not open (falls back to the healthy ones,
+        # then all of them). Ties are broken by round robin not to send every request to the first one while idle
+        candidates = [u for u in self.upstreams if u.available] or [u for u in self.upstreams if u.healthy] or self.upstreams
+        start = self.next_index % len(candidates)
+        self.next_index += 1
+        return min(candidates[start:] + candidates[:start], key=lambda u: u.outstanding)
+
+    def acquire(self) -> Upstream:
+        upstream = self.select()
+        upstream.outstanding += 1
+        return upstream
+
+    def release(self, upstream: Upstream):
+        upstream.outstanding -= 1
+
+    def update_health(self, upstream: Upstream, ok: bool):
+        if ok:
+            upstream.consecutive_failures = 0
+            upstream.consecutive_successes += 1
+            if not upstream.healthy and upstream.consecutive_successes >= self.healthy_threshold:
+                upstream.healthy = True
+                logger.info(f"Upstream {upstream.base_url} is readmitted.")
+        else:
+            upstream.consecutive_successes = 0
+            upstream.consecutive_failures += 1
+            if upstream.healthy and upstream.consecutive_failures >= self.unhealthy_threshold:
+                upstream.healthy = False
+                logger.warning(f"Upstream {upstream.base_url} is ejected after {upstream.consecutive_failures} failed health checks.")
+
+    async def check(self, http_client: httpx.AsyncClient):
+        async def check_upstream(upstream: Upstream):
+            try:
+                resp = await http_client.get(upstream.base_url + self.health_check_path, timeout=self.health_check_timeout)
+                ok = resp.is_success
+            except Exception:
+                ok = False
+            self.update_health(upstream, ok)
+
+        await asyncio.gather(*(check_upstream(u) for u in self.upstreams))
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self, http_client: httpx.AsyncClient):
+        # Must be called on the event loop thread. Does nothing when already running or health checks are disabled
+        if self.health_check_path and not self.running:
+            self.task = asyncio.get_running_loop().create_task(self.run(http_client))
+
+    async def run(self, http_client: httpx.AsyncClient):
+        while True:
+            await self.check(http_client)
+            await asyncio.sleep(self.health_check_interval)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,52 @@
+import io
+import struct
+import wave
+import pytest
+from speech_gateway.converter.duration import get_audio_duration
+
+
+def make_wave(seconds: float, framerate: int = 24000, channels: int = 1) -> bytes:
+    wav_io = io.BytesIO()
+    with wave.open(wav_io, "wb") as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(framerate)
+        wf.writeframes(b"\x00\x00" * channels * int(framerate * seconds))
+    return wav_io.getvalue()
+
+
+def make_mp3(frame_count: int) -> bytes:
+    # MPEG1 Layer III, 128kbps, 44100Hz: 417 bytes and 1152 samples per frame
+    frame = b"\xff\xfb\x90\x00" + b"\x00" * 413
+    info_frame = b"\xff\xfb\x90\x00" + b"\x00" * 32 + b"Info" + b"\x00" * 377
+    id3 = b"ID3\x04\x00\x00\x00\x00\x00\x0a" + b"\x00" * 10
+    return id3 + info_frame + frame * frame_count + b"TAG" + b"\x00" * 125
+
+
+def test_wave_duration():
+    assert get_audio_duration(make_wave(1.5), "wav") == pytest.approx(1.5)
+    assert get_audio_duration(make_wave(0.5, framerate=16000, channels=2), "wav") == pytest.approx(0.5)
+
+    # Open-ended data size of streaming wave is clamped to the actual length
+    data = bytearray(make_wave(1.0))
+    data[40:44] = struct.pack("<I", 0xFFFFFFFF)
+    assert get_audio_duration(bytes(data), "wav") == pytest.approx(1.0)
+
+
+def test_mp3_duration():
+    assert get_audio_duration(make_mp3(100), "mp3") == pytest.approx(100 * 1152 / 44100)
+
+
+def test_mulaw_duration():
+    assert get_audio_duration(b"\xff" * 8000, "mulaw") == pytest.approx(1.0)
+    assert get_audio_duration(b"\xff" * 16000, "raw-16khz-8bit-mono-mulaw") == pytest.approx(1.0)
+
+    # .au header
+    header = struct.pack(">4sIIIIII", b".snd", 24, 4000, 1, 8000, 1, 0)
+    assert get_audio_duration(header + b"\xff" * 4000, "au") == pytest.approx(0.5)
+
+
+def test_unknown_duration():
+    assert get_audio_duration(b"", "wav") is None
+    assert get_audio_duration(b"OggS" + b"\x00" * 100, "opus") is None
+    assert get_audio_duration(b"RIFF\x00\x00\x00\x00WAVE", "wav") is None
@@ -0,0 +1,89 @@
+import pytest
+import wave
+import io
+import numpy as np
+from speech_gateway.converter.silence import SilenceTrimmer, FormatConverterError
+
+
+def make_wave(leading_ms: int, voiced_ms: int, trailing_ms: int, framerate: int = 16000) -> bytes:
+    t = np.arange(int(framerate * voiced_ms / 1000)) / framerate
+    voiced = (np.sin(2 * np.pi * 440 * t) * 10000).astype(np.int16)
+    samples = np.concatenate([
+        np.zeros(int(framerate * leading_ms / 1000), dtype=np.int16),
+        voiced,
+        np.zeros(int(framerate * trailing_ms / 1000), dtype=np.int16),
+    ])
+
+    wav_io = io.BytesIO()
+    with wave.open(wav_io, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(framerate)
+        wf.writeframes(samples.tobytes())
+    return wav_io.getvalue()
+
+
+def get_duration_ms(data: bytes) -> float:
+    with wave.open(io.BytesIO(data), "rb") as wf:
+        return wf.getnframes() * 1000 / wf.getframerate()
+
+
+def test_trim():
+    trimmer = SilenceTrimmer(padding_ms=50)
+    output, trimmed_ms = trimmer.trim(make_wave(500, 1000, 300))
+
+    # 500ms + 300ms of silence minus 50ms padding on both sides
+    assert trimmed_ms == pytest.approx(700, abs=10)
+    assert get_duration_ms(output) == pytest.approx(1100, abs=10)
+
+
+def test_trim_no_silence():
+    trimmer = SilenceTrimmer(padding_ms=50)
+    input_bytes = make_wave(0, 1000, 0)
+    output, trimmed_ms = trimmer.trim(input_bytes)
+
+    assert trimmed_ms == 0
+    assert output == input_bytes
+
+
+def test_trim_all_silence():
+    trimmer = SilenceTrimmer()
+    input_bytes = make_wave(1000, 0, 0)
+    output, trimmed_ms = trimmer.trim(input_bytes)
+
+    assert trimmed_ms == 0
+    assert output == input_bytes
+
+
+def test_trim_not_wave():
+    trimmer = SilenceTrimmer()
+    output, trimmed_ms = trimmer.trim(b"\xff\xfbnot a wave")
+
+    assert trimmed_ms == 0
+    assert output == b"\xff\xfbnot a wave"
+
+
+def test_trim_float_wave():
+    # IEEE float (format 3) is not supported by wave module
+    data = np.zeros(1600, dtype="<f4").tobytes()
+    fmt = (3).to_bytes(2, "little") + (1).to_bytes(2, "little") + (16000).to_bytes(4, "little") \
+        + (64000).to_bytes(4, "little") + (4).to_bytes(2, "little") + (32).to_bytes(2, "little")
+    input_bytes = b"RIFF" + (4 + 8 + len(fmt) + 8 + len(data)).to_bytes(4, "little") + b"WAVE" \
+        + b"fmt " + len(fmt).to_bytes(4, "little") + fmt + b"data" + len(data).to_bytes(4, "little") + data
+
+    trimmer = SilenceTrimmer()
+    output, trimmed_ms = trimmer.trim(input_bytes)
+
+    assert trimmed_ms == 0
+    assert output == input_bytes
+
+
+@pytest.mark.asyncio
+async def test_convert():
+    trimmer = SilenceTrimmer(padding_ms=0)
+    output = await trimmer.convert(make_wave(200, 500, 200))
+    assert get_duration_ms(output) == pytest.approx(500, abs=10)
+
+    # Truncated wave
+    with pytest.raises(FormatConverterError):
+        await trimmer.convert(b"RIFF\x12\x00\x00\x00WAVEfmt \x10\x00\x00\x00\x01\x00")
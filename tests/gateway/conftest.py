@@ -0,0 +1,62 @@
+import io
+import wave
+import pytest
+import httpx
+from speech_gateway.gateway.voicevox import VoicevoxGateway
+from speech_gateway.gateway.unified import DummyPerformanceRecorder
+
+
+def make_wave(nframes: int = 16000) -> bytes:
+    wav_io = io.BytesIO()
+    with wave.open(wav_io, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(b"\x10\x00" * nframes)
+    return wav_io.getvalue()
+
+
+class ListPerformanceRecorder(DummyPerformanceRecorder):
+    def __init__(self):
+        self.records = []
+        self.errors = []
+
+    def record(self, **kwargs):
+        self.records.append(kwargs)
+
+    def record_error(self, **kwargs):
+        self.errors.append(kwargs)
+
+
+def handle_voicevox_request(request: httpx.Request) -> httpx.Response:
+    if request.url.path == "/audio_query":
+        return httpx.Response(200, json={"speedScale": 1.0})
+    elif request.url.path == "/synthesis":
+        return httpx.Response(200, content=make_wave(), headers={"content-type": "audio/wav"})
+    return httpx.Response(404)
+
+
+@pytest.fixture
+def wave_maker():
+    return make_wave
+
+
+@pytest.fixture
+def voicevox_handler():
+    return handle_voicevox_request
+
+
+@pytest.fixture
+def performance_recorder():
+    return ListPerformanceRecorder()
+
+
+@pytest.fixture
+def voicevox_gateway(tmp_path, performance_recorder):
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        performance_recorder=performance_recorder
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handle_voicevox_request))
+    return gateway
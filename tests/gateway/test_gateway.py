@@ -0,0 +1,334 @@
+import asyncio
+import io
+import json
+import wave
+import pytest
+import httpx
+from speech_gateway.converter.mulaw import MuLawConverter
+from speech_gateway.converter.silence import SilenceTrimmer
+from speech_gateway.gateway import UnifiedTTSRequest
+from speech_gateway.gateway.voicevox import VoicevoxGateway
+from speech_gateway.gateway.openai_speech import OpenAIGateway
+from speech_gateway.gateway.unified import UnifiedGateway, DummyPerformanceRecorder
+from speech_gateway.splitter import SentenceSplitter
+from speech_gateway.traffic import CircuitBreaker
+
+
+@pytest.mark.asyncio
+async def test_tts_phases(voicevox_gateway, performance_recorder, wave_checker):
+    response = await voicevox_gateway.tts(UnifiedTTSRequest(text="hello", speaker="46"))
+    assert wave_checker(response.audio_data)
+
+    record = performance_recorder.records[-1]
+    assert record["cached"] == 0
+    for phase in ["cache_lookup_elapsed", "prepare_elapsed", "upstream_ttfb", "download_elapsed", "conversion_elapsed", "cache_write_elapsed"]:
+        assert record[phase] >= 0
+        assert record[phase] <= record["elapsed"]
+    assert record["upstream_status"] == 200
+    assert record["response_bytes"] == len(response.audio_data)
+    assert record["audio_duration"] == pytest.approx(1.0)
+
+    # Cache hit records only cache lookup
+    response = await voicevox_gateway.tts(UnifiedTTSRequest(text="hello", speaker="46"))
+    assert wave_checker(response.audio_data)
+
+    record = performance_recorder.records[-1]
+    assert record["cached"] == 1
+    assert record["cache_lookup_elapsed"] >= 0
+    assert "upstream_ttfb" not in record
+
+
+@pytest.mark.asyncio
+async def test_tts_mulaw_duration(voicevox_gateway, performance_recorder):
+    # Headerless μ-law is measured at the sample rate of the converter
+    voicevox_gateway.format_converters = {"mulaw": MuLawConverter(rate=16000)}
+    response = await voicevox_gateway.tts(UnifiedTTSRequest(text="hello", speaker="46", audio_format="mulaw"))
+    assert len(response.audio_data) == 16000
+    assert performance_recorder.records[-1]["audio_duration"] == pytest.approx(1.0)
+
+
+@pytest.mark.asyncio
+async def test_tts_stream_openai(tmp_path, performance_recorder, wave_checker):
+    pcm = b"\x10\x00" * 24000
+    requested_formats = []
+
+    async def iter_pcm():
+        for i in range(0, len(pcm), 4800):
+            yield pcm[i:i + 4800]
+
+    def openai_handler(request: httpx.Request) -> httpx.Response:
+        requested_formats.append(json.loads(request.content)["response_format"])
+        return httpx.Response(200, content=iter_pcm(), headers={"content-type": "audio/pcm"})
+
+    gateway = OpenAIGateway(api_key="dummy", cache_dir=str(tmp_path / "openai_cache"), performance_recorder=performance_recorder)
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(openai_handler))
+    tts_request = UnifiedTTSRequest(text="hello", speaker="alloy", stream=True)
+
+    # Wave header with open-ended size first, then raw PCM chunks as they arrive
+    chunks = [chunk async for chunk in gateway.tts_stream(tts_request)]
+    assert requested_formats == ["pcm"]
+    assert len(chunks) > 2
+    assert chunks[0][:4] == b"RIFF" and len(chunks[0]) == 44
+    assert b"".join(chunks[1:]) == pcm
+    assert gateway.in_flight == 0
+
+    record = performance_recorder.records[-1]
+    assert record["cached"] == 0
+    assert record["audio_duration"] == pytest.approx(1.0)
+
+    # Cached with the actual sizes in the header. Stream flag is not a part of the cache key
+    cached = await gateway.tts(UnifiedTTSRequest(text="hello", speaker="alloy"))
+    assert wave_checker(cached.audio_data)
+    assert cached.audio_data[44:] == pcm
+    assert requested_formats == ["pcm"]
+
+
+@pytest.mark.asyncio
+async def test_tts_stream_cache_processed(tmp_path, performance_recorder):
+    class HalfTrimmer:
+        def trim(self, audio_data: bytes):
+            return audio_data[:len(audio_data) // 2], 500.0
+
+    class UpperConverter:
+        async def convert(self, audio_data: bytes) -> bytes:
+            return b"CONVERTED" + audio_data
+
+    def openai_handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b"x" * 100, headers={"content-type": "audio/mpeg"})
+
+    gateway = OpenAIGateway(
+        api_key="dummy",
+        cache_dir=str(tmp_path / "openai_cache"),
+        silence_trimmer=HalfTrimmer(),
+        format_converters={"mp3": UpperConverter()},
+        performance_recorder=performance_recorder
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(openai_handler))
+
+    # Streamed as is, and cached after the same trimming and conversion as `_tts`
+    chunks = [chunk async for chunk in gateway.tts_stream(UnifiedTTSRequest(text="hello", speaker="alloy", audio_format="mp3", stream=True))]
+    assert b"".join(chunks) == b"x" * 100
+    assert performance_recorder.records[-1]["silence_trimmed_ms"] == 500.0
+    cached = await gateway.tts(UnifiedTTSRequest(text="hello", speaker="alloy", audio_format="mp3"))
+    assert cached.audio_data == b"CONVERTED" + b"x" * 50
+
+    response = await gateway.tts(UnifiedTTSRequest(text="bye", speaker="alloy", audio_format="mp3"))
+    assert response.audio_data == b"CONVERTED" + b"x" * 50
+
+
+@pytest.mark.asyncio
+async def test_tts_split(tmp_path, performance_recorder, wave_checker, wave_maker):
+    synthesized_texts = []
+    concurrency = {"current": 0, "max": 0}
+    in_flight = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            return httpx.Response(200, json={"text": request.url.params["text"]})
+        concurrency["current"] += 1
+        concurrency["max"] = max(concurrency["max"], concurrency["current"])
+        in_flight.append(gateway.in_flight)
+        await asyncio.sleep(0.05)
+        concurrency["current"] -= 1
+        synthesized_texts.append(json.loads(request.content)["text"])
+        return httpx.Response(200, content=wave_maker(8000), headers={"content-type": "audio/wav"})
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        text_splitter=SentenceSplitter(min_length=0),
+        segment_concurrency=2,
+        performance_recorder=performance_recorder
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    response = await gateway.tts(UnifiedTTSRequest(text="こんにちは。いい天気ですね。散歩に行きましょう。", speaker="46"))
+    assert sorted(synthesized_texts) == sorted(["こんにちは。", "いい天気ですね。", "散歩に行きましょう。"])
+    assert concurrency["max"] == 2
+
+    # Concatenated into one wave with the total size
+    assert wave_checker(response.audio_data)
+    with wave.open(io.BytesIO(response.audio_data), "rb") as wf:
+        assert wf.getnframes() == 8000 * 3
+    assert performance_recorder.records[-1]["audio_duration"] == pytest.approx(1.5)
+
+    # Segments are counted and recorded as the text
+    assert set(in_flight) == {1}
+    assert len(performance_recorder.records) == 1
+    assert performance_recorder.records[0]["prepare_elapsed"] > 0
+
+    # Cached segments are reused by another text
+    synthesized_texts.clear()
+    await gateway.tts(UnifiedTTSRequest(text="こんにちは。散歩に行きましょう。またね。", speaker="46"))
+    assert synthesized_texts == ["またね。"]
+    assert len(performance_recorder.records) == 2
+
+
+@pytest.mark.asyncio
+async def test_tts_split_priority(tmp_path, wave_maker):
+    synthesized_texts = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            return httpx.Response(200, json={"text": request.url.params["text"]})
+        await asyncio.sleep(0.02)
+        synthesized_texts.append(json.loads(request.content)["text"])
+        return httpx.Response(200, content=wave_maker(800), headers={"content-type": "audio/wav"})
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        text_splitter=SentenceSplitter(min_length=0),
+        segment_concurrency=2,
+        max_concurrency=1,
+        performance_recorder=DummyPerformanceRecorder()
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    batch_task = asyncio.create_task(gateway.tts(UnifiedTTSRequest(text="一。二。三。四。", speaker="46", priority="batch")))
+    await asyncio.sleep(0.01)
+    await gateway.tts(UnifiedTTSRequest(text="はい。いいえ。", speaker="46"))
+
+    # Sentences of the interactive text are not queued behind those of the batch one
+    assert not batch_task.done()
+    await batch_task
+    assert synthesized_texts.index("いいえ。") < synthesized_texts.index("四。")
+
+
+@pytest.mark.asyncio
+async def test_tts_split_silence_trimmed(tmp_path, performance_recorder, voicevox_handler):
+    # 100ms silence, 100ms voice and 100ms silence
+    wav_io = io.BytesIO()
+    with wave.open(wav_io, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(b"\x00\x00" * 1600 + b"\x00\x40" * 1600 + b"\x00\x00" * 1600)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/synthesis":
+            return httpx.Response(200, content=wav_io.getvalue(), headers={"content-type": "audio/wav"})
+        return voicevox_handler(request)
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        silence_trimmer=SilenceTrimmer(padding_ms=50, gap_ms=200),
+        text_splitter=SentenceSplitter(min_length=0),
+        performance_recorder=performance_recorder
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    response = await gateway.tts(UnifiedTTSRequest(text="こんにちは。さようなら。", speaker="46"))
+
+    # 200ms of each sentence and the gap of 200ms between them
+    with wave.open(io.BytesIO(response.audio_data), "rb") as wf:
+        assert wf.getnframes() == 3200 * 2 + 3200
+    # Trimmed silence of the sentences is summed
+    assert performance_recorder.records[-1]["silence_trimmed_ms"] == pytest.approx(200.0)
+
+
+@pytest.mark.asyncio
+async def test_upstream_load_balancing(tmp_path, performance_recorder, wave_checker, wave_maker):
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append((request.url.host, request.url.path))
+        if request.url.path == "/audio_query":
+            return httpx.Response(200, json={"speedScale": 1.0})
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, content=wave_maker(), headers={"content-type": "audio/wav"})
+
+    gateway = VoicevoxGateway(
+        base_urls=["http://voicevox1", "http://voicevox2"],
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        audio_query_cache_size=0,
+        performance_recorder=performance_recorder
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    responses = await asyncio.gather(*(gateway.tts(UnifiedTTSRequest(text=f"hello{i}", speaker="46")) for i in range(4)))
+    assert all(wave_checker(r.audio_data) for r in responses)
+
+    # Spread over the upstreams and audio_query goes to the same upstream as synthesis
+    hosts = [host for host, path in requests if path == "/synthesis"]
+    assert sorted(hosts) == ["voicevox1", "voicevox1", "voicevox2", "voicevox2"]
+    assert sorted(r["upstream"] for r in performance_recorder.records) == \
+        ["http://voicevox1", "http://voicevox1", "http://voicevox2", "http://voicevox2"]
+    assert all(u.outstanding == 0 for u in gateway.upstream_pool.upstreams)
+
+    # Ejected upstream is not used
+    gateway.upstream_pool.upstreams[0].healthy = False
+    requests.clear()
+    await gateway.tts(UnifiedTTSRequest(text="bye", speaker="46"))
+    assert {host for host, _ in requests} == {"voicevox2"}
+    assert gateway.base_url == "http://voicevox1"
+
+    await gateway.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_upstreams(tmp_path, voicevox_handler):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.host)
+        if request.url.host == "voicevox1":
+            raise httpx.ConnectError("Connection refused")
+        return voicevox_handler(request)
+
+    gateway = VoicevoxGateway(
+        base_urls=["http://voicevox1", "http://voicevox2"],
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        circuit_breaker=CircuitBreaker(min_requests=1),
+        performance_recorder=DummyPerformanceRecorder()
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    for i in range(2):
+        try:
+            await gateway.tts(UnifiedTTSRequest(text=f"hello{i}", speaker="46"))
+        except httpx.ConnectError:
+            pass
+    breakers = gateway.get_circuit_breakers()
+    assert breakers["http://voicevox1"].state == "open"
+    assert breakers["http://voicevox2"].state == "closed"
+    assert gateway.is_available()
+
+    # Requests go to the upstream whose circuit is closed
+    requests.clear()
+    for i in range(3):
+        await gateway.tts(UnifiedTTSRequest(text=f"bye{i}", speaker="46"))
+    assert set(requests) == {"voicevox2"}
+
+    await gateway.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_startup_prewarm(tmp_path, voicevox_handler):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(str(request.url))
+        return voicevox_handler(request)
+
+    gateway = VoicevoxGateway(
+        base_urls=["http://voicevox1", "http://voicevox2"],
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        prewarm_connections=2,
+        keepalive_interval=60.0,
+        performance_recorder=DummyPerformanceRecorder()
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    assert gateway.get_warmup_urls() == ["http://voicevox1/version", "http://voicevox2/version"]
+    # Only the requests to warm up
+    gateway.upstream_pool.health_check_path = None
+
+    unified_gateway = UnifiedGateway()
+    unified_gateway.add_gateway("voicevox", gateway, default_speaker="46", default=True)
+    await unified_gateway.startup()
+    assert sorted(requests) == ["http://voicevox1/version"] * 2 + ["http://voicevox2/version"] * 2
+    assert gateway.connection_warmer.running
+
+    await unified_gateway.shutdown()
+    assert not gateway.connection_warmer.running
@@ -1,11 +1,24 @@
+import asyncio
+import base64
+import io
+import json
+import wave
+import zipfile
 import pytest
 import os
 import httpx
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from speech_gateway.converter import FormatConverter
 from speech_gateway.gateway.voicevox import VoicevoxGateway
 from speech_gateway.gateway.sbv2 import StyleBertVits2Gateway
 from speech_gateway.gateway.openai_speech import OpenAIGateway
-from speech_gateway.gateway.unified import UnifiedGateway
+from speech_gateway.gateway.unified import UnifiedGateway, DummyPerformanceRecorder
 from speech_gateway.gateway import UnifiedTTSRequest
+from speech_gateway.performance_recorder.prometheus import PrometheusPerformanceRecorder
+from speech_gateway.splitter import SentenceSplitter
+from speech_gateway.traffic import CircuitBreaker, HedgingPolicy, LoadSheddingPolicy
 
 VOICEVOX_URL = os.getenv("VOICEVOX_URL")
 SBV2_URL = os.getenv("SBV2_URL")
@@ -114,3 +127,596 @@ async def test_voicevox_gateway_tts_sdk_mp3(random_text, mp3_checker, audio_tran
         assert "音声合成" in audio_transcriber(response.audio_data, "mp3")
     finally:
         await voicevox_gateway.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(voicevox_gateway):
+    metrics_recorder = PrometheusPerformanceRecorder()
+    voicevox_gateway.performance_recorder = metrics_recorder
+    unified_gateway = UnifiedGateway(metrics_recorder=metrics_recorder)
+    unified_gateway.add_gateway("voicevox", voicevox_gateway, default_speaker="46", default=True)
+
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        resp = await client.post("/tts", json={"text": "hello"})
+        assert resp.status_code == 200
+
+        resp = await client.get("/metrics")
+        assert resp.status_code == 200
+        assert 'speech_gateway_cache_misses_total{gateway="VoicevoxGateway",service="voicevox",audio_format="wav"} 1.0' in resp.text
+        assert 'speech_gateway_in_flight_requests{gateway="VoicevoxGateway",service="voicevox"} 0' in resp.text
+        assert "speech_gateway_event_loop_lag_seconds " in resp.text
+
+    await unified_gateway.shutdown()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["reject", "cache_only"])
+async def test_load_shedding(voicevox_gateway, mode):
+    load_shedding = LoadSheddingPolicy(max_loop_lag=None, max_in_flight=1, mode=mode, retry_after=3)
+    unified_gateway = UnifiedGateway(load_shedding=load_shedding)
+    unified_gateway.add_gateway("voicevox", voicevox_gateway, default_speaker="46", default=True)
+
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        resp = await client.post("/tts", json={"text": "cached"})
+        assert resp.status_code == 200
+
+        # Simulate another request in flight
+        voicevox_gateway.in_flight = 1
+        resp = await client.post("/tts", json={"text": "hello"})
+        assert resp.status_code == 503
+        assert resp.headers["retry-after"] == "3"
+
+        resp = await client.post("/tts", json={"text": "cached"})
+        assert resp.status_code == (200 if mode == "cache_only" else 503)
+        voicevox_gateway.in_flight = 0
+
+    assert load_shedding.shed_count == (1 if mode == "cache_only" else 2)
+    await unified_gateway.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_tts_stream_endpoint(voicevox_gateway, wave_checker):
+    unified_gateway = UnifiedGateway()
+    unified_gateway.add_gateway("voicevox", voicevox_gateway, default_speaker="46", default=True)
+
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        # VOICEVOX doesn't stream: whole audio is returned as a stream
+        resp = await client.post("/tts", json={"text": "hello", "stream": True})
+        assert resp.status_code == 200
+        assert wave_checker(resp.content)
+
+    # Library API
+    chunks = [chunk async for chunk in unified_gateway.tts_stream(UnifiedTTSRequest(text="hello"))]
+    assert wave_checker(b"".join(chunks))
+
+
+@pytest.mark.asyncio
+async def test_tts_segment_stream(tmp_path, wave_checker, wave_maker):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            return httpx.Response(200, json={"text": request.url.params["text"]})
+        text = json.loads(request.content)["text"]
+        # The first sentence takes the longest but is emitted first
+        await asyncio.sleep(0.1 if text.startswith("こんにちは") else 0.01)
+        return httpx.Response(200, content=wave_maker(1600 * len(text)), headers={"content-type": "audio/wav"})
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        text_splitter=SentenceSplitter(min_length=0),
+        performance_recorder=DummyPerformanceRecorder()
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    unified_gateway = UnifiedGateway()
+    unified_gateway.add_gateway("voicevox", gateway, default_speaker="46", default=True)
+
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    text = "こんにちは。いい天気ですね。散歩に行きましょう。"
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        resp = await client.post("/tts", json={"text": text, "stream": True, "stream_format": "ndjson"})
+        assert resp.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in resp.text.splitlines()]
+        assert [line["text"] for line in lines] == ["こんにちは。", "いい天気ですね。", "散歩に行きましょう。"]
+        assert [line["index"] for line in lines] == [0, 1, 2]
+        assert lines[1]["audio_duration"] == pytest.approx(0.8)
+        assert wave_checker(base64.b64decode(lines[1]["audio"]))
+
+        # Whole audio is cached when complete
+        cache_key = gateway.get_cache_key(UnifiedTTSRequest(text=text, speaker="46"))
+        assert await gateway.cache_storage.has_cache(cache_key)
+        await gateway.cache_storage.clear_all_cache()
+
+        # Wave with open-ended header followed by PCM of each sentence
+        resp = await client.post("/tts", json={"text": text, "stream": True})
+        assert resp.content[40:44] == b"\xff\xff\xff\xff"
+        assert len(resp.content) == 44 + 1600 * 2 * len(text)
+
+        resp = await client.post("/tts", json={"text": "いい天気ですね。散歩に行きましょう。", "stream": True, "stream_format": "multipart"})
+        boundary = resp.headers["content-type"].split("boundary=")[1]
+        parts = resp.content.split(f"--{boundary}".encode())
+        assert len(parts) == 4
+        assert b"X-Segment-Index: 1" in parts[2]
+        assert wave_checker(parts[2].split(b"\r\n\r\n", 1)[1][:-2])
+        assert parts[3] == b"--\r\n"
+
+        resp = await client.post("/tts", json={"text": text, "stream": True, "stream_format": "unknown"})
+        assert resp.status_code == 400
+
+        # No sentences in the text
+        resp = await client.post("/tts", json={"text": " ", "stream": True, "stream_format": "ndjson"})
+        assert resp.status_code == 400
+
+        # Joined encodes of formats other than wave are not cached as the whole audio
+        class FakeMP3Converter(FormatConverter):
+            async def convert(self, input_bytes: bytes) -> bytes:
+                return b"MP3" + input_bytes[:10]
+
+        gateway.format_converters = {"mp3": FakeMP3Converter()}
+        resp = await client.post("/tts", json={"text": text, "stream": True, "audio_format": "mp3"})
+        assert resp.content.count(b"MP3RIFF") == 3
+        assert not await gateway.cache_storage.has_cache(gateway.get_cache_key(UnifiedTTSRequest(text=text, speaker="46", audio_format="mp3")))
+
+
+def test_tts_websocket(voicevox_gateway, wave_checker):
+    voicevox_gateway.text_splitter = SentenceSplitter(min_length=0)
+    unified_gateway = UnifiedGateway(api_key="secret")
+    unified_gateway.add_gateway("voicevox", voicevox_gateway, default_speaker="46", default=True)
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    client = TestClient(app)
+
+    with client.websocket_connect("/tts/ws", headers={"Authorization": "Bearer secret"}) as ws:
+        ws.send_json({"type": "start", "service_name": "voicevox"})
+        # Sentences are synthesized as soon as their boundaries are detected
+        for delta in ["こんにちは", "。今日はいい", "天気ですね！", "散歩に"]:
+            ws.send_json({"type": "text", "text": delta})
+
+        message = ws.receive_json()
+        assert message == {"type": "audio", "index": 0, "text": "こんにちは。", "audio_format": "wav"}
+        assert wave_checker(ws.receive_bytes())
+        message = ws.receive_json()
+        assert message["index"] == 1 and message["text"] == "今日はいい天気ですね！"
+        ws.receive_bytes()
+
+        # Cancel discards the text not synthesized yet
+        ws.send_json({"type": "cancel"})
+        assert ws.receive_json() == {"type": "cancelled"}
+
+        ws.send_json({"type": "text", "text": "またね"})
+        ws.send_json({"type": "end"})
+        message = ws.receive_json()
+        assert message["index"] == 2 and message["text"] == "またね"
+        ws.receive_bytes()
+        assert ws.receive_json() == {"type": "done"}
+
+    # Not authorized
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/tts/ws") as ws:
+            ws.receive_json()
+
+
+@pytest.mark.asyncio
+async def test_tts_websocket_disconnect(tmp_path, performance_recorder, voicevox_handler):
+    async def slow_handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(1)
+        return voicevox_handler(request)
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox", cache_dir=str(tmp_path / "voicevox_cache"), performance_recorder=performance_recorder
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(slow_handler))
+    unified_gateway = UnifiedGateway()
+    unified_gateway.add_gateway("voicevox", gateway, default_speaker="46", default=True)
+
+    class DisconnectingWebSocket:
+        headers = {}
+        query_params = {}
+
+        def __init__(self, messages):
+            self.messages = messages
+
+        async def accept(self):
+            pass
+
+        async def receive_json(self):
+            if self.messages:
+                return self.messages.pop(0)
+            # Disconnected while the sentence is being synthesized
+            await asyncio.sleep(0.1)
+            raise WebSocketDisconnect()
+
+        async def send_json(self, message):
+            pass
+
+        async def send_bytes(self, data):
+            pass
+
+    websocket = DisconnectingWebSocket([{"type": "text", "text": "こんにちは。"}, {"type": "flush"}])
+    await asyncio.wait_for(unified_gateway.tts_websocket_handler(websocket), timeout=5)
+    # The sender task is finished rather than left waiting for the next sentence
+    await asyncio.sleep(0.1)
+    assert [t for t in asyncio.all_tasks() if t is not asyncio.current_task()] == []
+
+
+def test_tts_websocket_fallback(tmp_path, voicevox_handler):
+    def failing_handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(500)
+
+    primary = VoicevoxGateway(base_url="http://primary", cache_dir=str(tmp_path / "primary"), performance_recorder=DummyPerformanceRecorder())
+    primary.http_client = httpx.AsyncClient(transport=httpx.MockTransport(failing_handler))
+    secondary = VoicevoxGateway(base_url="http://secondary", cache_dir=str(tmp_path / "secondary"), performance_recorder=DummyPerformanceRecorder())
+    secondary.http_client = httpx.AsyncClient(transport=httpx.MockTransport(voicevox_handler))
+    # Batch items taking all the slots don't hold the sentences of live connections
+    primary.batch_semaphore = asyncio.Semaphore(0)
+
+    unified_gateway = UnifiedGateway()
+    unified_gateway.add_gateway("primary", primary, default_speaker="46", default=True)
+    unified_gateway.add_gateway("secondary", secondary, default_speaker="1")
+    unified_gateway.set_fallbacks("primary", ["secondary"])
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    client = TestClient(app)
+
+    with client.websocket_connect("/tts/ws") as ws:
+        ws.send_json({"type": "text", "text": "こんにちは。"})
+        ws.send_json({"type": "end"})
+        assert ws.receive_json() == {"type": "audio", "index": 0, "text": "こんにちは。", "audio_format": "wav"}
+        ws.receive_bytes()
+        assert ws.receive_json() == {"type": "done"}
+    assert unified_gateway.fallback_count == 1
+
+
+def test_tts_websocket_requests(tmp_path, wave_checker, wave_maker):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            if request.url.params["text"] == "error":
+                return httpx.Response(500)
+            return httpx.Response(200, json={"text": request.url.params["text"]})
+        if json.loads(request.content)["text"] == "slow":
+            await asyncio.sleep(0.5)
+        return httpx.Response(200, content=wave_maker(), headers={"content-type": "audio/wav"})
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        performance_recorder=DummyPerformanceRecorder()
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    unified_gateway = UnifiedGateway(api_key="secret")
+    unified_gateway.add_gateway("voicevox", gateway, default_speaker="46", default=True)
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    client = TestClient(app)
+
+    with client.websocket_connect("/tts/ws/requests?api_key=secret") as ws:
+        # Responses are sent as soon as each request completes
+        ws.send_json({"type": "request", "id": "r1", "text": "slow"})
+        ws.send_json({"type": "request", "id": "r2", "text": "fast"})
+        ws.send_json({"type": "request", "id": "r3", "text": "error"})
+        ws.send_json({"type": "request", "id": "r4", "text": "unknown", "service_name": "unknown"})
+        ws.send_json({"type": "request", "id": "r5", "speaker": "46"})
+        responses = {}
+        for _ in range(5):
+            message = ws.receive_json()
+            if message["type"] == "audio":
+                assert wave_checker(ws.receive_bytes())
+            responses[message["id"]] = message
+        assert list(responses)[-1] == "r1"
+        assert responses["r1"] == {"type": "audio", "id": "r1", "audio_format": "wav"}
+        assert responses["r2"]["type"] == "audio"
+        assert responses["r3"]["type"] == "error" and responses["r3"]["status"] == 500
+        assert responses["r4"]["type"] == "error" and responses["r4"]["status"] == 404
+        assert responses["r5"]["type"] == "error" and responses["r5"]["status"] == 422
+
+        # Cancelled before completion
+        ws.send_json({"type": "request", "id": "r6", "text": "slow", "speed": 1.5})
+        ws.send_json({"type": "cancel", "id": "r6"})
+        assert ws.receive_json() == {"type": "cancelled", "id": "r6"}
+
+        # Cache hit, and close after all responses are sent
+        ws.send_json({"type": "request", "id": "r7", "text": "fast"})
+        ws.send_json({"type": "end"})
+        assert ws.receive_json() == {"type": "audio", "id": "r7", "audio_format": "wav"}
+        ws.receive_bytes()
+        assert ws.receive_json() == {"type": "done"}
+
+    # Not authorized
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/tts/ws/requests") as ws:
+            ws.receive_json()
+
+
+@pytest.mark.asyncio
+async def test_tts_batch_stream(tmp_path, wave_checker, wave_maker):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            if request.url.params["text"] == "error":
+                return httpx.Response(500)
+            return httpx.Response(200, json={"text": request.url.params["text"]})
+        elif request.url.path == "/multi_synthesis":
+            await asyncio.sleep(0.1)
+            zip_io = io.BytesIO()
+            with zipfile.ZipFile(zip_io, "w") as zf:
+                for i, _ in enumerate(json.loads(request.content)):
+                    zf.writestr(f"{i + 1:03}.wav", wave_maker(8000))
+            return httpx.Response(200, content=zip_io.getvalue(), headers={"content-type": "application/zip"})
+        elif request.url.path == "/synthesis":
+            return httpx.Response(200, content=wave_maker(8000), headers={"content-type": "audio/wav"})
+        return httpx.Response(404)
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        performance_recorder=DummyPerformanceRecorder()
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    await gateway.tts(UnifiedTTSRequest(text="cached", speaker="46"))
+
+    unified_gateway = UnifiedGateway()
+    unified_gateway.add_gateway("voicevox", gateway, default_speaker="46", default=True)
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+
+    def batch(texts):
+        return {"requests": [{"text": t} for t in texts + ["cached", "error"]]}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        # Cache hits and failures come before the items being synthesized
+        resp = await client.post("/tts/batch", json=batch(["a", "b"]), headers={"Accept": "multipart/mixed"})
+        assert resp.status_code == 200
+        boundary = resp.headers["content-type"].split("boundary=")[1]
+        parts = resp.content.split(f"--{boundary}".encode())
+        assert parts[0] == b"" and parts[-1] == b"--\r\n"
+        indices = []
+        for part in parts[1:-1]:
+            part_headers, body = part.strip(b"\r\n").split(b"\r\n\r\n", 1)
+            part_headers = dict(line.split(": ", 1) for line in part_headers.decode().split("\r\n"))
+            index = int(part_headers["X-Index"])
+            indices.append(index)
+            if index == 3:
+                assert part_headers["Content-Type"] == "application/json"
+                assert json.loads(body)["index"] == 3
+            else:
+                assert part_headers["Content-Type"] == "audio/wav"
+                assert wave_checker(body)
+        assert set(indices[:2]) == {2, 3}
+        assert sorted(indices[2:]) == [0, 1]
+
+        resp = await client.post("/tts/batch", json=batch(["c", "d"]), headers={"Accept": "application/zip"})
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/zip"
+        with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
+            names = zf.namelist()
+            assert set(names[:2]) == {"2.wav", "3.error.json"}
+            assert sorted(names[2:]) == ["0.wav", "1.wav"]
+            assert all(wave_checker(zf.read(name)) for name in names if name.endswith(".wav"))
+
+        # JSON by default
+        resp = await client.post("/tts/batch", json=batch(["e", "f"]))
+        assert [r["index"] for r in resp.json()["results"]] == [0, 1, 2, 3]
+
+    await unified_gateway.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit(tmp_path, performance_recorder, wave_maker):
+    concurrency = {"current": 0, "max": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            return httpx.Response(200, json={"speedScale": 1.0})
+        concurrency["current"] += 1
+        concurrency["max"] = max(concurrency["max"], concurrency["current"])
+        await asyncio.sleep(0.1)
+        concurrency["current"] -= 1
+        return httpx.Response(200, content=wave_maker(), headers={"content-type": "audio/wav"})
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        max_concurrency=2,
+        max_queue_time=0.15,
+        performance_recorder=performance_recorder
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    unified_gateway = UnifiedGateway()
+    unified_gateway.add_gateway("voicevox", gateway, default_speaker="46", default=True)
+
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        responses = await asyncio.gather(*(client.post("/tts", json={"text": f"hello{i}"}) for i in range(6)))
+
+    # 2 at once, 2 in the queue within the budget and 2 rejected fast
+    assert concurrency["max"] == 2
+    assert sorted(r.status_code for r in responses) == [200, 200, 200, 200, 503, 503]
+    assert all(r.headers["retry-after"] == "1" for r in responses if r.status_code == 503)
+    assert gateway.limiter.rejected_count == 2
+
+    # Queue wait is recorded separately from upstream time
+    queue_waits = sorted(r["queue_wait_elapsed"] for r in performance_recorder.records)
+    assert queue_waits[:2] == [0.0, 0.0]
+    assert all(w >= 0.09 for w in queue_waits[2:])
+    assert all(r["upstream_ttfb"] < 0.15 for r in performance_recorder.records)
+
+    await unified_gateway.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_priority(tmp_path, performance_recorder, wave_maker):
+    synthesized_texts = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            return httpx.Response(200, json={"text": request.url.params["text"]})
+        synthesized_texts.append(json.loads(request.content)["text"])
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, content=wave_maker(), headers={"content-type": "audio/wav"})
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        audio_query_cache_size=0,
+        max_concurrency=1,
+        performance_recorder=performance_recorder
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    unified_gateway = UnifiedGateway()
+    unified_gateway.add_gateway("voicevox", gateway, default_speaker="46", default=True)
+
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        batch_tasks = [
+            asyncio.create_task(client.post("/tts", json={"text": f"batch{i}"}, headers={"X-Priority": "batch"}))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0.02)
+        interactive_tasks = [asyncio.create_task(client.post("/tts", json={"text": f"interactive{i}"})) for i in range(2)]
+        responses = await asyncio.gather(*batch_tasks, *interactive_tasks)
+        assert all(r.status_code == 200 for r in responses)
+
+        resp = await client.post("/tts", json={"text": "hello", "priority": "urgent"})
+        assert resp.status_code == 422
+        resp = await client.post("/tts", json={"text": "hello"}, headers={"X-Priority": "urgent"})
+        assert resp.status_code == 400
+
+    # Interactive requests overtake batch ones waiting in the queue
+    assert synthesized_texts == ["batch0", "interactive0", "interactive1", "batch1", "batch2"]
+
+    # Priority is not a part of the cache key
+    assert gateway.get_cache_key(UnifiedTTSRequest(text="a", priority="batch")) == gateway.get_cache_key(UnifiedTTSRequest(text="a"))
+
+    await unified_gateway.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hedging_and_fallback(tmp_path, wave_maker):
+    state = {"primary_delay": 0.0, "primary_status": 200, "primary_completed": 0, "secondary_speakers": []}
+
+    async def primary_handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            return httpx.Response(200, json={"speedScale": 1.0})
+        await asyncio.sleep(state["primary_delay"])
+        state["primary_completed"] += 1
+        return httpx.Response(state["primary_status"], content=wave_maker(8000), headers={"content-type": "audio/wav"})
+
+    def secondary_handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            state["secondary_speakers"].append(request.url.params["speaker"])
+            return httpx.Response(200, json={"speedScale": 1.0})
+        return httpx.Response(200, content=wave_maker(16000), headers={"content-type": "audio/wav"})
+
+    primary = VoicevoxGateway(base_url="http://primary", cache_dir=str(tmp_path / "primary"), performance_recorder=DummyPerformanceRecorder())
+    primary.http_client = httpx.AsyncClient(transport=httpx.MockTransport(primary_handler))
+    secondary = VoicevoxGateway(base_url="http://secondary", cache_dir=str(tmp_path / "secondary"), performance_recorder=DummyPerformanceRecorder())
+    secondary.http_client = httpx.AsyncClient(transport=httpx.MockTransport(secondary_handler))
+
+    unified_gateway = UnifiedGateway(hedging=HedgingPolicy(initial_delay=0.05))
+    unified_gateway.add_gateway("primary", primary, default_speaker="46", default=True)
+    unified_gateway.add_gateway("secondary", secondary, default_speaker="1")
+    unified_gateway.set_fallbacks("primary", ["secondary"], voice_map={"secondary": {"46": "888753760"}})
+
+    def frames(audio_data: bytes) -> int:
+        with wave.open(io.BytesIO(audio_data), "rb") as wf:
+            return wf.getnframes()
+
+    # Primary in time
+    response = await unified_gateway.tts(UnifiedTTSRequest(text="a"))
+    assert frames(response.audio_data) == 8000
+    assert unified_gateway.hedged_count == 0
+
+    # Hedged to the secondary with the mapped speaker and the primary is cancelled
+    state["primary_delay"] = 0.5
+    response = await unified_gateway.tts(UnifiedTTSRequest(text="b"))
+    assert frames(response.audio_data) == 16000
+    assert state["secondary_speakers"] == ["888753760"]
+    assert unified_gateway.hedged_count == 1
+    assert unified_gateway.fallback_count == 1
+    await asyncio.sleep(0.6)
+    assert state["primary_completed"] == 1
+    assert primary.in_flight == 0
+
+    # Fail over at once. Unmapped speaker uses the default speaker of the fallback
+    state["primary_delay"] = 0.0
+    state["primary_status"] = 500
+    response = await unified_gateway.tts(UnifiedTTSRequest(text="c", speaker="47"))
+    assert frames(response.audio_data) == 16000
+    assert state["secondary_speakers"][-1] == "1"
+    assert unified_gateway.hedged_count == 1
+
+    # No fallback for unmapped speakers
+    unified_gateway.set_fallbacks("primary", ["secondary"], voice_map={"secondary": {"46": "888753760"}}, voice_mismatch="skip")
+    with pytest.raises(httpx.HTTPStatusError):
+        await unified_gateway.tts(UnifiedTTSRequest(text="d", speaker="47"))
+
+    await unified_gateway.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker(tmp_path, wave_maker, voicevox_handler):
+    state = {"primary_status": 500, "primary_requests": 0}
+
+    def primary_handler(request: httpx.Request) -> httpx.Response:
+        state["primary_requests"] += 1
+        if request.url.path == "/audio_query":
+            return httpx.Response(200, json={"speedScale": 1.0})
+        return httpx.Response(state["primary_status"], content=wave_maker(8000), headers={"content-type": "audio/wav"})
+
+    metrics_recorder = PrometheusPerformanceRecorder()
+    primary = VoicevoxGateway(
+        base_url="http://primary",
+        cache_dir=str(tmp_path / "primary"),
+        circuit_breaker=CircuitBreaker(min_requests=2, open_duration=0.2),
+        performance_recorder=metrics_recorder
+    )
+    primary.http_client = httpx.AsyncClient(transport=httpx.MockTransport(primary_handler))
+    secondary = VoicevoxGateway(base_url="http://secondary", cache_dir=str(tmp_path / "secondary"), performance_recorder=metrics_recorder)
+    secondary.http_client = httpx.AsyncClient(transport=httpx.MockTransport(voicevox_handler))
+
+    # Opened after the failures and fails fast without sending requests
+    for text in ["a", "b"]:
+        with pytest.raises(httpx.HTTPStatusError):
+            await primary.tts(UnifiedTTSRequest(text=text, speaker="46"))
+    assert not primary.is_available()
+    sent = state["primary_requests"]
+    with pytest.raises(HTTPException) as exinfo:
+        await primary.tts(UnifiedTTSRequest(text="c", speaker="46"))
+    assert exinfo.value.status_code == 503
+    assert exinfo.value.headers["Retry-After"] == "1"
+    assert state["primary_requests"] == sent
+
+    # Routed to the fallback while open
+    unified_gateway = UnifiedGateway(metrics_recorder=metrics_recorder)
+    unified_gateway.add_gateway("primary", primary, default_speaker="46", default=True)
+    unified_gateway.add_gateway("secondary", secondary, default_speaker="1")
+    unified_gateway.set_fallbacks("primary", ["secondary"])
+
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        resp = await client.post("/tts", json={"text": "d"})
+        assert resp.status_code == 200
+        resp = await client.post("/tts", json={"text": "e", "stream": True})
+        assert resp.status_code == 200
+        assert state["primary_requests"] == sent
+        assert unified_gateway.fallback_count == 1
+
+        resp = await client.get("/metrics")
+        assert 'speech_gateway_circuit_breaker_state{service="primary",upstream="http://primary"} 2' in resp.text
+        assert 'speech_gateway_circuit_breaker_rejected_requests_total{service="primary",upstream="http://primary"} 1' in resp.text
+
+    # Closed after a successful trial
+    await asyncio.sleep(0.25)
+    state["primary_status"] = 200
+    await primary.tts(UnifiedTTSRequest(text="f", speaker="46"))
+    assert list(primary.get_circuit_breakers().values())[0].state == "closed"
+
+    await unified_gateway.shutdown()
@@ -1,6 +1,17 @@
+import asyncio
+import base64
+import io
+import json
 import os
+from time import sleep
+import zipfile
 import pytest
 import httpx
+from fastapi import FastAPI
+from speech_gateway.gateway import SpeechGateway, UnifiedTTSRequest
+from speech_gateway.gateway.voicevox import AudioQueryCache, VoicevoxGateway
+from speech_gateway.gateway.unified import UnifiedGateway, DummyPerformanceRecorder
+from speech_gateway.splitter import SentenceSplitter
 
 SPEAKER = 46
 
@@ -64,3 +75,174 @@ async def test_voicevox_unified_mp3(random_text, mp3_checker, audio_transcriber)
     audio_data = resp.content
     assert mp3_checker(audio_data)
     assert "音声合成" in audio_transcriber(audio_data, "mp3")
+
+
+@pytest.mark.asyncio
+async def test_audio_query_cache(tmp_path, wave_maker):
+    audio_query_texts = []
+    synthesis_queries = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            audio_query_texts.append(request.url.params["text"])
+            return httpx.Response(200, json={"speedScale": 1.0, "pitchScale": 0.0, "accent_phrases": []})
+        synthesis_queries.append(json.loads(request.content))
+        return httpx.Response(200, content=wave_maker(), headers={"content-type": "audio/wav"})
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        performance_recorder=DummyPerformanceRecorder()
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    await gateway.tts(UnifiedTTSRequest(text="こんにちは", speaker="46"))
+    await gateway.tts(UnifiedTTSRequest(text="こんにちは", speaker="46", speed=1.5, extra_data={"pitchScale": 0.1}))
+    # Normalized text shares the query
+    await gateway.tts(UnifiedTTSRequest(text=" こんにちは ", speaker="46", audio_format="wav", speed=1.2))
+    assert audio_query_texts == ["こんにちは"]
+    assert [q["speedScale"] for q in synthesis_queries] == [1.0, 1.5, 1.2]
+    assert synthesis_queries[1]["pitchScale"] == 0.1
+
+    # Overrides are not applied to the cached query
+    assert gateway.audio_query_cache.get("46", "こんにちは") == {"speedScale": 1.0, "pitchScale": 0.0, "accent_phrases": []}
+
+    # Different speaker
+    await gateway.tts(UnifiedTTSRequest(text="こんにちは", speaker="47"))
+    assert len(audio_query_texts) == 2
+
+
+def test_audio_query_cache_bound_and_ttl():
+    cache = AudioQueryCache(max_size=2, ttl=0.2)
+    cache.set("1", "a", {"q": "a"})
+    cache.set("1", "b", {"q": "b"})
+    assert cache.get("1", "a") == {"q": "a"}
+    cache.set("1", "c", {"q": "c"})
+    # Least recently used one is evicted
+    assert cache.get("1", "b") is None
+    assert cache.get("1", "a") == {"q": "a"}
+
+    sleep(0.3)
+    assert cache.get("1", "c") is None
+
+
+@pytest.mark.asyncio
+async def test_tts_batch(tmp_path, performance_recorder, wave_checker, wave_maker):
+    multi_synthesis_calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            if request.url.params["text"] == "error":
+                return httpx.Response(500)
+            return httpx.Response(200, json={"text": request.url.params["text"]})
+        elif request.url.path == "/multi_synthesis":
+            queries = json.loads(request.content)
+            multi_synthesis_calls.append((request.url.params["speaker"], [q["text"] for q in queries]))
+            zip_io = io.BytesIO()
+            with zipfile.ZipFile(zip_io, "w") as zf:
+                for i, _ in enumerate(queries):
+                    zf.writestr(f"{i + 1:03}.wav", wave_maker(8000 * (i + 1)))
+            return httpx.Response(200, content=zip_io.getvalue(), headers={"content-type": "application/zip"})
+        return httpx.Response(404)
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        multi_synthesis_size=2,
+        performance_recorder=performance_recorder
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    await gateway.tts_batch([UnifiedTTSRequest(text="cached", speaker="46")])
+    multi_synthesis_calls.clear()
+
+    unified_gateway = UnifiedGateway()
+    unified_gateway.add_gateway("voicevox", gateway, default_speaker="46", default=True)
+    app = FastAPI()
+    app.include_router(unified_gateway.get_router())
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        resp = await client.post("/tts/batch", json={"requests": [
+            {"text": "a"}, {"text": "b"}, {"text": "c"}, {"text": "d", "speaker": "47"},
+            {"text": "cached"}, {"text": "error"}, {"text": "a"}, {"text": "e", "service_name": "unknown"}
+        ]})
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+
+    # Grouped by speaker and limited by multi_synthesis_size. Duplicates and cache hits are not synthesized
+    assert sorted(multi_synthesis_calls) == [("46", ["a", "b"]), ("46", ["c"]), ("47", ["d"])]
+    assert [r["index"] for r in results] == list(range(8))
+    for i in [0, 1, 2, 3, 4, 6]:
+        assert wave_checker(base64.b64decode(results[i]["audio"]))
+    assert results[0]["audio_duration"] == pytest.approx(0.5)
+    assert results[1]["audio_duration"] == pytest.approx(1.0)
+    assert results[6]["audio"] == results[0]["audio"]
+    assert "error" in results[5] and "error" in results[7]
+
+    # Each audio is cached by itself
+    multi_synthesis_calls.clear()
+    response = await gateway.tts(UnifiedTTSRequest(text="b", speaker="46"))
+    assert response.audio_data == base64.b64decode(results[1]["audio"])
+    assert multi_synthesis_calls == []
+    assert performance_recorder.records[-1]["cached"] == 1
+
+    await unified_gateway.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_tts_batch_long_text(tmp_path, wave_checker, voicevox_handler):
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        text_splitter=SentenceSplitter(min_length=0),
+        performance_recorder=DummyPerformanceRecorder()
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(voicevox_handler))
+
+    # Long texts as many as segment_concurrency don't deadlock with their segments
+    for n, tts_batch in enumerate([gateway.tts_batch, lambda r: SpeechGateway.tts_batch(gateway, r)]):
+        tts_requests = [UnifiedTTSRequest(text=f"こんにちは{n}-{i}。さようなら。", speaker="46") for i in range(4)]
+        results = await asyncio.wait_for(tts_batch(tts_requests), timeout=5)
+        assert all(wave_checker(r.audio_data) for r in results)
+
+    await gateway.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_tts_batch_bounded(tmp_path, performance_recorder, wave_checker, wave_maker, voicevox_handler):
+    state = {"active": 0, "max_active": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/audio_query":
+            if request.url.params["text"] == "失敗です。":
+                return httpx.Response(500)
+            state["active"] += 1
+            state["max_active"] = max(state["active"], state["max_active"])
+            await asyncio.sleep(0.01)
+            state["active"] -= 1
+        elif request.url.path == "/multi_synthesis":
+            zip_io = io.BytesIO()
+            with zipfile.ZipFile(zip_io, "w") as zf:
+                for i, _ in enumerate(json.loads(request.content)):
+                    zf.writestr(f"{i + 1:03}.wav", wave_maker())
+            return httpx.Response(200, content=zip_io.getvalue(), headers={"content-type": "application/zip"})
+        return voicevox_handler(request)
+
+    gateway = VoicevoxGateway(
+        base_url="http://voicevox",
+        cache_dir=str(tmp_path / "voicevox_cache"),
+        text_splitter=SentenceSplitter(min_length=0),
+        segment_concurrency=2,
+        performance_recorder=performance_recorder
+    )
+    gateway.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    # audio_query of cache misses is bounded by segment_concurrency without max_concurrency
+    results = await gateway.tts_batch([UnifiedTTSRequest(text=f"text{i}", speaker="46") for i in range(10)])
+    assert all(wave_checker(r.audio_data) for r in results)
+    assert state["max_active"] == 2
+
+    # Failure of a sentence is recorded once
+    results = await gateway.tts_batch([UnifiedTTSRequest(text="失敗です。さようなら。", speaker="46")])
+    assert isinstance(results[0], Exception)
+    assert len(performance_recorder.errors) == 1
+
+    await gateway.shutdown()
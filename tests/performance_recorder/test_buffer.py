@@ -0,0 +1,45 @@
+import pytest
+from speech_gateway.performance_recorder.buffer import RecordQueue
+
+
+def test_drop_oldest():
+    record_queue = RecordQueue(maxsize=3, overflow_policy="drop_oldest")
+    for i in range(5):
+        record_queue.put_record(i)
+
+    assert record_queue.dropped_count == 2
+    assert [record_queue.get_nowait() for _ in range(3)] == [2, 3, 4]
+    for _ in range(3):
+        record_queue.task_done()
+    # Unfinished tasks are consistent with the records in the queue
+    record_queue.join()
+
+
+def test_drop_newest():
+    record_queue = RecordQueue(maxsize=3, overflow_policy="drop_newest")
+    results = [record_queue.put_record(i) for i in range(5)]
+
+    assert results == [True, True, True, False, False]
+    assert record_queue.dropped_count == 2
+    assert [record_queue.get_nowait() for _ in range(3)] == [0, 1, 2]
+
+
+def test_sample():
+    # Records after half full are kept at sample_rate (0 = drop all)
+    record_queue = RecordQueue(maxsize=4, overflow_policy="sample", sample_rate=0.0)
+    for i in range(5):
+        record_queue.put_record(i)
+    assert record_queue.qsize() == 2
+    assert record_queue.dropped_count == 3
+
+    # Never exceeds maxsize even if sample_rate is 1
+    record_queue = RecordQueue(maxsize=4, overflow_policy="sample", sample_rate=1.0)
+    for i in range(10):
+        record_queue.put_record(i)
+    assert record_queue.qsize() == 4
+    assert record_queue.dropped_count == 6
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        RecordQueue(overflow_policy="unknown")
@@ -0,0 +1,87 @@
+import os
+import pytest
+import asyncpg
+from speech_gateway.performance_recorder.postgres_async import AsyncPostgreSQLPerformanceRecorder
+
+POSTGRES_USER = os.getenv("POSTGRES_USER")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
+POSTGRES_DBNAME = os.getenv("POSTGRES_DBNAME")
+
+
+async def connect():
+    return await asyncpg.connect(database=POSTGRES_DBNAME, user=POSTGRES_USER, password=POSTGRES_PASSWORD)
+
+
+@pytest.mark.asyncio
+async def test_record_and_aclose():
+    recorder = AsyncPostgreSQLPerformanceRecorder(
+        dbname=POSTGRES_DBNAME,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        batch_size=10
+    )
+
+    for i in range(25):
+        recorder.record(
+            process_id=f"process_{i}",
+            source="test_source",
+            text=f"test_text_{i}",
+            audio_format="wav",
+            cached=i % 2,
+            elapsed=0.01 * i,
+            service_name="test_service",
+        )
+
+    # Remaining records are flushed before closing the pool
+    await recorder.aclose()
+
+    conn = await connect()
+    try:
+        rows = await conn.fetch("SELECT process_id, cached, service_name FROM performance_records WHERE source = 'test_source' ORDER BY id")
+        assert [row["process_id"] for row in rows] == [f"process_{i}" for i in range(25)]
+        assert rows[1]["cached"] == 1
+        assert rows[0]["service_name"] == "test_service"
+    finally:
+        await conn.execute("TRUNCATE TABLE performance_records;")
+        await conn.close()
+
+
+@pytest.mark.asyncio
+async def test_aclose_deadline_without_database():
+    # Connection never succeeds: closing must not wait longer than the deadline
+    recorder = AsyncPostgreSQLPerformanceRecorder(port=1, connect_timeout=0.5, flush_interval=0.1)
+    recorder.record(process_id="process_0", elapsed=0.1)
+    await recorder.aclose(timeout=1.0)
+    assert recorder.worker_task.done()
+
+    # Records after closing are ignored
+    recorder.record(process_id="process_1", elapsed=0.1)
+    assert recorder.record_queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_write_tasks_bounded_without_database():
+    import asyncio
+
+    recorder = AsyncPostgreSQLPerformanceRecorder(port=1, max_pool_size=2, batch_size=1, max_queue_size=5, flush_interval=0.01)
+    released = asyncio.Event()
+    max_write_tasks = 0
+
+    async def slow_write_records(records):
+        nonlocal max_write_tasks
+        max_write_tasks = max(max_write_tasks, len(recorder.write_tasks))
+        await released.wait()
+
+    recorder.write_records = slow_write_records
+    for i in range(20):
+        recorder.record(process_id=f"process_{i}", elapsed=0.1)
+        await asyncio.sleep(0.01)
+
+    # Writes are up to the pool size and the rest wait in the bounded queue
+    assert len(recorder.write_tasks) == 2
+    assert recorder.record_queue.qsize() <= 5
+    assert recorder.dropped_count > 0
+
+    released.set()
+    await recorder.aclose(timeout=1.0)
+    assert max_write_tasks <= 2
@@ -0,0 +1,86 @@
+import pytest
+from speech_gateway.performance_recorder.prometheus import PrometheusPerformanceRecorder
+from speech_gateway.gateway.unified import DummyPerformanceRecorder
+
+
+class ListPerformanceRecorder(DummyPerformanceRecorder):
+    def __init__(self):
+        self.records = []
+        self.errors = []
+        self.closed = False
+
+    def record(self, **kwargs):
+        self.records.append(kwargs)
+
+    def record_error(self, **kwargs):
+        self.errors.append(kwargs)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def inner_recorder():
+    return ListPerformanceRecorder()
+
+
+@pytest.fixture
+def prometheus_recorder(inner_recorder):
+    return PrometheusPerformanceRecorder(recorder=inner_recorder, latency_buckets=[0.1, 1.0])
+
+
+def test_record_and_render(prometheus_recorder, inner_recorder):
+    labels = 'gateway="VoicevoxGateway",service="voicevox",audio_format="wav"'
+    prometheus_recorder.record(
+        process_id="p1", source="VoicevoxGateway", service_name="voicevox", audio_format="wav",
+        cached=0, elapsed=0.5, upstream_ttfb=0.2, download_elapsed=0.1, conversion_elapsed=0.05, audio_bytes=1000,
+        audio_duration=2.0, upstream_status=200, response_bytes=1000
+    )
+    prometheus_recorder.record(
+        process_id="p1", source="VoicevoxGateway", service_name="voicevox", audio_format="wav",
+        cached=1, elapsed=0.01, audio_bytes=1000, audio_duration=2.0
+    )
+    prometheus_recorder.record_error(process_id="p2", source="VoicevoxGateway", service_name="voicevox", audio_format="wav")
+
+    text = prometheus_recorder.render()
+    assert "# TYPE speech_gateway_requests_total counter" in text
+    assert f"speech_gateway_requests_total{{{labels}}} 2.0" in text
+    assert f"speech_gateway_cache_hits_total{{{labels}}} 1.0" in text
+    assert f"speech_gateway_cache_misses_total{{{labels}}} 1.0" in text
+    assert f"speech_gateway_upstream_errors_total{{{labels}}} 1.0" in text
+    assert f"speech_gateway_served_bytes_total{{{labels}}} 2000.0" in text
+
+    # Histogram buckets are cumulative
+    assert "# TYPE speech_gateway_request_duration_seconds histogram" in text
+    assert f'speech_gateway_request_duration_seconds_bucket{{{labels},le="0.1"}} 1' in text
+    assert f'speech_gateway_request_duration_seconds_bucket{{{labels},le="1.0"}} 2' in text
+    assert f'speech_gateway_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"speech_gateway_request_duration_seconds_count{{{labels}}} 2" in text
+    assert f'speech_gateway_upstream_duration_seconds_bucket{{{labels},le="0.1"}} 0' in text
+    assert f"speech_gateway_upstream_duration_seconds_count{{{labels}}} 1" in text
+    assert f"speech_gateway_conversion_duration_seconds_count{{{labels}}} 1" in text
+
+    # Real-time factor is observed only for uncached requests
+    assert f'speech_gateway_upstream_responses_total{{{labels},status="200"}} 1.0' in text
+    assert f"speech_gateway_audio_duration_seconds_total{{{labels}}} 4.0" in text
+    assert f"speech_gateway_real_time_factor_sum{{{labels}}} 0.25" in text
+    assert f"speech_gateway_real_time_factor_count{{{labels}}} 1" in text
+
+    # Records and errors are passed to the inner recorder
+    assert len(inner_recorder.records) == 2
+    assert inner_recorder.records[0]["audio_bytes"] == 1000
+    assert len(inner_recorder.errors) == 1
+
+    prometheus_recorder.close()
+    assert inner_recorder.closed
+
+
+def test_escape_label_value(prometheus_recorder):
+    prometheus_recorder.record(process_id="p1", source='My"Gateway', audio_format="wav", elapsed=0.1)
+    assert 'gateway="My\\"Gateway"' in prometheus_recorder.render()
+
+
+def test_record_unknown_field(prometheus_recorder, inner_recorder):
+    with pytest.raises(TypeError):
+        prometheus_recorder.record(process_id="p1", source="VoicevoxGateway", unknown_elapsed=0.1)
+    assert inner_recorder.records == []
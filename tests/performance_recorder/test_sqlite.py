@@ -1,3 +1,5 @@
+from datetime import datetime, timezone
+import hashlib
 import pytest
 import sqlite3
 import threading
@@ -105,3 +107,205 @@ def test_multi_thread_record_no_deadlock(sqlite_recorder):
         assert count == total_expected, f"Expected {total_expected} records, got {count}"
     finally:
         conn.close()
+
+
+def test_record_unknown_field(sqlite_recorder):
+    """
+    Verify that fields other than the columns of the performance record are rejected.
+    """
+    with pytest.raises(TypeError):
+        sqlite_recorder.record(process_id="process", source="test_source", unknown_elapsed=0.1)
+    with pytest.raises(TypeError):
+        sqlite_recorder.record(process_id="process", source="test_source", created_at=None)
+
+
+def test_batch_flush_by_size_and_interval(tmp_path):
+    """
+    Verify that records are flushed when the batch is full and when
+    flush_interval has passed, without waiting for close().
+    """
+    db_path = tmp_path / "test_batch.db"
+    recorder = SQLitePerformanceRecorder(str(db_path), batch_size=10, flush_interval=0.2)
+    try:
+        for i in range(25):
+            recorder.record(process_id=f"process_{i}", source="test_source", cached=0, elapsed=0.01)
+
+        # The last 5 records are flushed after flush_interval
+        sleep(1.0)
+
+        conn = sqlite3.connect(recorder.db_path)
+        try:
+            count = conn.execute("SELECT COUNT(*) FROM performance_records;").fetchone()[0]
+            assert count == 25, f"Expected 25 records, got {count}"
+            created_at = conn.execute("SELECT created_at FROM performance_records LIMIT 1;").fetchone()[0]
+            assert created_at.endswith("+00:00")
+        finally:
+            conn.close()
+    finally:
+        recorder.close()
+
+
+class FailableSQLitePerformanceRecorder(SQLitePerformanceRecorder):
+    available = True
+
+    def insert_records(self, conn, records):
+        if not self.available:
+            raise sqlite3.OperationalError("database is not available")
+        super().insert_records(conn, records)
+
+
+def test_spill_and_replay(tmp_path):
+    """
+    Verify that records are spilled to the local file while the database is not available
+    and replayed once it is back.
+    """
+    spill_path = tmp_path / "spill.jsonl"
+    recorder = FailableSQLitePerformanceRecorder(
+        str(tmp_path / "test_spill.db"), flush_interval=0.1, spill_path=str(spill_path), retry_interval=0.2
+    )
+    try:
+        recorder.available = False
+        for i in range(10):
+            recorder.record(process_id=f"process_{i}", source="test_source", cached=0, elapsed=0.01)
+        sleep(0.5)
+        assert spill_path.exists()
+        assert len(spill_path.read_text().splitlines()) == 10
+
+        recorder.available = True
+        sleep(0.3)
+        recorder.record(process_id="process_10", source="test_source", cached=0, elapsed=0.01)
+    finally:
+        recorder.close()
+
+    assert not spill_path.exists()
+    conn = sqlite3.connect(recorder.db_path)
+    try:
+        count = conn.execute("SELECT COUNT(*) FROM performance_records;").fetchone()[0]
+        assert count == 11, f"Expected 11 records, got {count}"
+    finally:
+        conn.close()
+
+
+def test_replay_after_crash(tmp_path):
+    """
+    Verify that the replay file left by a crash during replay is replayed
+    rather than overwritten by the next spill file.
+    """
+    spill_path = tmp_path / "spill.jsonl"
+    recorder = FailableSQLitePerformanceRecorder(
+        str(tmp_path / "test_replay.db"), flush_interval=0.1, spill_path=str(spill_path), retry_interval=0.2
+    )
+    try:
+        recorder.available = False
+        for i in range(5):
+            recorder.record(process_id=f"crashed_{i}", source="test_source", cached=0, elapsed=0.01)
+        sleep(0.5)
+        # Crashed after moving the spill file to replay
+        spill_path.rename(tmp_path / "spill.jsonl.replay")
+        for i in range(3):
+            recorder.record(process_id=f"spilled_{i}", source="test_source", cached=0, elapsed=0.01)
+        sleep(0.5)
+        assert spill_path.exists()
+
+        recorder.available = True
+        sleep(0.3)
+        recorder.record(process_id="process", source="test_source", cached=0, elapsed=0.01)
+    finally:
+        recorder.close()
+
+    assert not spill_path.exists()
+    assert not (tmp_path / "spill.jsonl.replay").exists()
+    conn = sqlite3.connect(recorder.db_path)
+    try:
+        count = conn.execute("SELECT COUNT(*) FROM performance_records;").fetchone()[0]
+        assert count == 9, f"Expected 9 records, got {count}"
+    finally:
+        conn.close()
+
+
+def test_retention_and_rollup(tmp_path):
+    """
+    Verify that records older than retention are rolled up into per-minute aggregates
+    and deleted in chunks, and the database runs in WAL mode.
+    """
+    recorder = SQLitePerformanceRecorder(
+        str(tmp_path / "test_retention.db"), flush_interval=0.1,
+        retention_seconds=3600, retention_interval=3600, retention_chunk_size=3
+    )
+    try:
+        for i in range(8):
+            recorder.record(process_id=f"process_{i}", source="test_source", audio_format="wav", cached=i % 2, elapsed=0.1 * (i + 1))
+        sleep(0.5)
+
+        conn = sqlite3.connect(recorder.db_path)
+        try:
+            assert conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+            # Make 7 records old enough to be rolled up
+            with conn:
+                conn.execute("UPDATE performance_records SET created_at = '2025-01-01 00:00:30.000000+00:00' WHERE id <= 6")
+                conn.execute("UPDATE performance_records SET created_at = '2025-01-01 00:01:10.000000+00:00' WHERE id = 7")
+        finally:
+            conn.close()
+
+        recorder.apply_retention()
+    finally:
+        recorder.close()
+
+    conn = sqlite3.connect(recorder.db_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM performance_records;").fetchone()[0] == 1
+        rollups = conn.execute(
+            "SELECT bucket, cached, count, elapsed_sum, elapsed_min, elapsed_max FROM performance_rollups ORDER BY bucket, cached"
+        ).fetchall()
+        assert [(r[0], r[1], r[2]) for r in rollups] == [
+            ("2025-01-01 00:00:00+00:00", 0, 3),
+            ("2025-01-01 00:00:00+00:00", 1, 3),
+            ("2025-01-01 00:01:00+00:00", 0, 1),
+        ]
+        # process_1, 3, 5 (cached) are merged across chunks
+        assert rollups[1][3] == pytest.approx(0.2 + 0.4 + 0.6)
+        assert rollups[1][4] == pytest.approx(0.2)
+        assert rollups[1][5] == pytest.approx(0.6)
+    finally:
+        conn.close()
+
+    # Summary includes both the rollups and the raw records
+    summaries = recorder.get_summary(group_by=["cached"])
+    assert [(s["cached"], s["count"]) for s in summaries] == [(0, 4), (1, 4)]
+    assert summaries[1]["avg"] == pytest.approx((0.2 + 0.4 + 0.6 + 0.8) / 4)
+    # Percentiles of the rolled up records are from their sketches
+    assert summaries[0]["p50"] == pytest.approx(0.3, rel=0.05)
+
+    summaries = recorder.get_summary(
+        since=datetime(2025, 1, 1, tzinfo=timezone.utc), until=datetime(2025, 1, 2, tzinfo=timezone.utc),
+        group_by=["source"], bucket_seconds=3600
+    )
+    assert [(s["source"], s["bucket"], s["count"]) for s in summaries] == [("test_source", "2025-01-01T00:00:00+00:00", 7)]
+
+
+@pytest.mark.parametrize("text_policy,expected_text", [
+    ("full", "こんにちは。今日はいい天気ですね。"),
+    ("truncate", "こんにちは"),
+    ("hash", hashlib.sha256("こんにちは。今日はいい天気ですね。".encode("utf-8")).hexdigest()),
+    ("length", None),
+])
+def test_text_policy(tmp_path, text_policy, expected_text):
+    """
+    Verify that the text is stored according to text_policy and
+    its length is always stored as text_length.
+    """
+    text = "こんにちは。今日はいい天気ですね。"
+
+    recorder = SQLitePerformanceRecorder(str(tmp_path / "test_text.db"), text_policy=text_policy, text_max_length=5)
+    recorder.record(process_id="process_0", text=text, audio_bytes=1234)
+    recorder.close()
+
+    conn = sqlite3.connect(recorder.db_path)
+    try:
+        row = conn.execute("SELECT text, text_length, audio_bytes FROM performance_records;").fetchone()
+        assert row == (expected_text, len(text), 1234)
+    finally:
+        conn.close()
+
+    with pytest.raises(ValueError):
+        SQLitePerformanceRecorder(str(tmp_path / "test_text_error.db"), text_policy="unknown")
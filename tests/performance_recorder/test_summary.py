@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+import json
+import pytest
+from speech_gateway.performance_recorder.summary import rollup_rows, merge_rollup, sketch_index, sketch_percentile
+from speech_gateway.performance_recorder.sqlite import SQLitePerformanceReader, SQLitePerformanceRecorder
+
+
+def test_sqlite_get_summary(tmp_path):
+    recorder = SQLitePerformanceRecorder(str(tmp_path / "test_summary.db"), flush_interval=0.1)
+    for i in range(10):
+        recorder.record(process_id=f"p{i}", source="AzureGateway", audio_format="mp3", cached=0, elapsed=0.1 * (i + 1), audio_duration=2.0)
+    for i in range(5):
+        recorder.record(process_id=f"c{i}", source="VoicevoxGateway", audio_format="wav", cached=1, elapsed=0.01)
+    recorder.close()
+
+    summaries = recorder.get_summary(
+        since=datetime.now(timezone.utc) - timedelta(hours=1),
+        source="AzureGateway", audio_format="mp3", cached=0
+    )
+    assert len(summaries) == 1
+    assert summaries[0]["source"] == "AzureGateway"
+    assert summaries[0]["count"] == 10
+    # Aggregated in the database with the sketch of percentiles
+    assert summaries[0]["p90"] == pytest.approx(0.91, rel=0.05)
+    assert summaries[0]["avg"] == pytest.approx(0.55)
+    assert summaries[0]["rtf_avg"] == pytest.approx(0.275)
+    assert summaries[0]["rtf_p90"] == pytest.approx(0.455, rel=0.05)
+
+    summaries = recorder.get_summary(group_by=["source"])
+    assert [(s["source"], s["count"], s["hit_ratio"]) for s in summaries] == [("AzureGateway", 10, 0.0), ("VoicevoxGateway", 5, 1.0)]
+
+    summaries = recorder.get_summary(group_by=["cached"], bucket_seconds=3600)
+    bucket = datetime.fromisoformat(summaries[0]["bucket"])
+    assert bucket.timestamp() % 3600 == 0 and bucket <= datetime.now(timezone.utc)
+    assert [(s["cached"], s["count"], s["throughput"]) for s in summaries] == [(0, 10, 10 / 3600), (1, 5, 5 / 3600)]
+
+    # No records in the future
+    assert recorder.get_summary(since=datetime.now(timezone.utc) + timedelta(hours=1)) == []
+
+    with pytest.raises(ValueError):
+        recorder.get_summary(group_by=["text"])
+
+    # Queried without the writer
+    reader = SQLitePerformanceReader(str(tmp_path / "test_summary.db"))
+    assert [(s["source"], s["count"]) for s in reader.get_summary(group_by=["source"])] == [("AzureGateway", 10), ("VoicevoxGateway", 5)]
+
+
+def test_sqlite_reader_readonly(tmp_path):
+    import sqlite3
+
+    # The database file is not created by the reader
+    reader = SQLitePerformanceReader(str(tmp_path / "not_exist.db"))
+    with pytest.raises(sqlite3.OperationalError):
+        reader.get_summary()
+    assert not (tmp_path / "not_exist.db").exists()
+
+
+def test_rollup_sketch():
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    rows = [(base + timedelta(seconds=i % 60), None, "wav", None, 0.01 * (i + 1)) for i in range(100)]
+    rollups = rollup_rows(rows)
+    assert list(rollups.keys()) == [(base, "", "wav", 0)]
+
+    rollup = rollups[(base, "", "wav", 0)]
+    assert rollup["count"] == 100
+    assert rollup["elapsed_min"] == pytest.approx(0.01)
+    assert rollup["elapsed_max"] == pytest.approx(1.0)
+    # Relative error of the sketch is bounded
+    assert sketch_percentile(rollup["sketch"], 50) == pytest.approx(0.5, rel=0.05)
+    assert sketch_percentile(rollup["sketch"], 99) == pytest.approx(0.99, rel=0.05)
+
+    merged = merge_rollup(rollup, 1, 2.0, 2.0, 2.0, json.dumps({sketch_index(2.0): 1}))
+    assert merged["count"] == 101
+    assert merged["elapsed_max"] == 2.0
+    assert sum(merged["sketch"].values()) == 101
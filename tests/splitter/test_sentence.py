@@ -0,0 +1,56 @@
+from speech_gateway.splitter import SentenceSplitter, IncrementalSentenceSplitter
+
+
+def test_split_japanese():
+    splitter = SentenceSplitter(min_length=0)
+    assert splitter.split("こんにちは。今日はいい天気ですね！「本当に？」と彼は言った。散歩に行きましょう") == [
+        "こんにちは。", "今日はいい天気ですね！", "「本当に？」", "と彼は言った。", "散歩に行きましょう"
+    ]
+    assert splitter.split("一行目\n二行目") == ["一行目", "二行目"]
+
+
+def test_split_english():
+    splitter = SentenceSplitter(min_length=0)
+    assert splitter.split("Hello, Mr. Smith. The price is 3.14 dollars... Really? Yes! See e.g. the docs.") == [
+        "Hello, Mr. Smith.", "The price is 3.14 dollars...", "Really?", "Yes!", "See e.g. the docs."
+    ]
+
+
+def test_split_length():
+    # Short sentences are joined to the next one
+    assert SentenceSplitter(min_length=8).split("はい。そうです。それではまた明日お会いしましょう。") == [
+        "はい。そうです。", "それではまた明日お会いしましょう。"
+    ]
+    assert SentenceSplitter(min_length=5).split("Yes. I think so. See you.") == ["Yes. I think so.", "See you."]
+
+    # Long sentences are split at pauses, or at max_length
+    assert SentenceSplitter(min_length=0, max_length=10).split("あいうえお、かきくけこ、さしすせそたちつてと。") == [
+        "あいうえお、", "かきくけこ、", "さしすせそたちつてと。"
+    ]
+    assert SentenceSplitter(min_length=0, max_length=5).split("あいうえおかきくけこ") == ["あいうえお", "かきくけこ"]
+
+
+def test_find_boundary_pending():
+    splitter = SentenceSplitter()
+    # Not determined until the next character arrives
+    assert splitter.find_boundary("こんにちは。") == -1
+    assert splitter.find_boundary("Hello.") == -1
+    assert splitter.find_boundary("こんにちは。今") == 6
+    assert splitter.find_boundary("Hello. W") == 6
+
+
+def test_incremental_split():
+    splitter = IncrementalSentenceSplitter(SentenceSplitter(min_length=0))
+    deltas = ["こんに", "ちは。今日", "はいい天気", "ですね！「本当", "に？」と", "彼は言った。ま", "たね"]
+    assert [splitter.feed(delta) for delta in deltas] == [
+        [], ["こんにちは。"], [], ["今日はいい天気ですね！"], ["「本当に？」"], ["と彼は言った。"], []
+    ]
+    assert splitter.flush() == ["またね"]
+    assert splitter.flush() == []
+
+    # Short sentences wait for the next one
+    splitter = IncrementalSentenceSplitter(SentenceSplitter(min_length=8))
+    assert splitter.feed("はい。そう") == []
+    assert splitter.feed("です。それでは") == ["はい。そうです。"]
+    splitter.clear()
+    assert splitter.flush() == []
@@ -0,0 +1,60 @@
+import time
+from speech_gateway.traffic import CircuitBreaker
+
+
+def test_open_and_close():
+    breaker = CircuitBreaker(failure_rate_threshold=0.5, min_requests=4, window=10.0, open_duration=0.1, half_open_max_calls=2)
+
+    # Not opened until min_requests
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == "closed"
+
+    # Results that don't tell the health are ignored
+    breaker.record(None)
+    assert breaker.state == "closed"
+
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "open"
+    assert breaker.open_count == 1
+
+    # Fail fast while open
+    assert not breaker.available
+    assert not breaker.allow()
+    assert breaker.rejected_count == 1
+    assert 0 < breaker.retry_after <= 0.1
+
+    # Trials up to half_open_max_calls
+    time.sleep(0.12)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # A cancelled trial lets another request try
+    breaker.record(None, trial=True)
+    assert breaker.allow()
+    breaker.record(True, trial=True)
+    assert breaker.state == "half_open"
+    breaker.record(True, trial=True)
+    assert breaker.state == "closed"
+
+
+def test_reopen_after_failed_trial():
+    breaker = CircuitBreaker(min_requests=1, open_duration=0.05)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False, trial=True)
+    assert breaker.state == "open"
+    assert breaker.open_count == 2
+
+    # Settings are copied for each upstream but the state is not
+    cloned = breaker.clone()
+    assert cloned.state == "closed"
+    assert cloned.open_duration == 0.05
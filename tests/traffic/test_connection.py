@@ -0,0 +1,64 @@
+import asyncio
+import httpx
+import pytest
+from speech_gateway.traffic import ConnectionWarmer, connection_trace
+
+
+async def start_http_server():
+    # Minimal HTTP/1.1 server that keeps connections alive
+    connections = []
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connections.append(writer)
+        try:
+            while await reader.readuntil(b"\r\n\r\n"):
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}", connections
+
+
+@pytest.mark.asyncio
+async def test_connection_trace():
+    server, url, connections = await start_http_server()
+    async with httpx.AsyncClient() as http_client:
+        first, second = {}, {}
+        await http_client.get(url, extensions={"trace": connection_trace(first)})
+        await http_client.get(url, extensions={"trace": connection_trace(second)})
+
+    assert first["connection_reused"] == 0
+    assert first["connect_elapsed"] > 0
+    assert second == {"connection_reused": 1}
+    assert len(connections) == 1
+
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_connection_warmer():
+    server, url, connections = await start_http_server()
+    async with httpx.AsyncClient() as http_client:
+        warmer = ConnectionWarmer([url + "/version"], connections=3, interval=0.05)
+        await warmer.warm(http_client)
+        assert len(connections) == 3
+
+        # Requests after warming up don't connect
+        phases = {}
+        await http_client.get(url, extensions={"trace": connection_trace(phases)})
+        assert phases == {"connection_reused": 1}
+
+        warmer.start(http_client)
+        assert warmer.running
+        await asyncio.sleep(0.12)
+        await warmer.stop()
+        assert not warmer.running
+        assert len(connections) == 3
+
+    server.close()
+    await server.wait_closed()
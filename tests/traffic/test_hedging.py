@@ -0,0 +1,27 @@
+import pytest
+from speech_gateway.traffic import HedgingPolicy
+
+
+def test_hedging_delay():
+    policy = HedgingPolicy(quantile=0.9, initial_delay=1.0, min_delay=0.1, max_delay=2.0, window_size=10, min_samples=5)
+    assert policy.get_delay("azure") == 1.0
+
+    for latency in [0.2, 0.3, 0.4, 0.5]:
+        policy.observe("azure", latency)
+    assert policy.get_delay("azure") == 1.0
+
+    for latency in [0.6, 0.7, 0.8, 0.9, 1.0, 1.1]:
+        policy.observe("azure", latency)
+    assert policy.get_delay("azure") == pytest.approx(1.1)
+
+    # Old samples are dropped from the window
+    for _ in range(10):
+        policy.observe("azure", 0.01)
+    assert policy.get_delay("azure") == 0.1
+
+    for _ in range(10):
+        policy.observe("azure", 10.0)
+    assert policy.get_delay("azure") == 2.0
+
+    with pytest.raises(ValueError):
+        HedgingPolicy(quantile=0)
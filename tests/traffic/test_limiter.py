@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from speech_gateway.traffic import ConcurrencyLimiter, QueueTimeoutError
+
+
+@pytest.mark.asyncio
+async def test_fifo():
+    limiter = ConcurrencyLimiter(2)
+    order = []
+
+    async def run(name: str):
+        async with limiter.slot():
+            order.append(name)
+            await asyncio.sleep(0.05)
+
+    tasks = [asyncio.create_task(run(str(i))) for i in range(5)]
+    await asyncio.sleep(0.01)
+    assert limiter.active["interactive"] == 2
+    assert limiter.queued == 3
+
+    await asyncio.gather(*tasks)
+    assert order == ["0", "1", "2", "3", "4"]
+    assert limiter.active["interactive"] == 0
+    assert limiter.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_time():
+    limiter = ConcurrencyLimiter(1, max_queue_time=0.05)
+    assert await limiter.acquire() == 0.0
+
+    with pytest.raises(QueueTimeoutError):
+        await limiter.acquire()
+    assert limiter.rejected_count == 1
+    assert limiter.queued == 0
+
+    # Slot is handed over to the waiter
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.02)
+    limiter.release()
+    assert await waiter >= 0.02
+    assert limiter.active["interactive"] == 1
+
+    # Cancelled waiter leaves the queue
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert limiter.queued == 0
+    limiter.release()
+    assert limiter.active["interactive"] == 0
+
+
+@pytest.mark.asyncio
+async def test_priority():
+    limiter = ConcurrencyLimiter(2, batch_throttle_latency=0.02, latency_half_life=0.2)
+    order = []
+
+    async def run(name: str, priority: str, duration: float = 0.05):
+        async with limiter.slot(priority):
+            order.append(name)
+            await asyncio.sleep(duration)
+
+    # Interactive ones are dispatched ahead of batch ones queued before
+    tasks = [asyncio.create_task(run(f"b{i}", "batch")) for i in range(4)]
+    await asyncio.sleep(0.01)
+    tasks += [asyncio.create_task(run(f"i{i}", "interactive")) for i in range(2)]
+    await asyncio.gather(*tasks)
+    assert order[:4] == ["b0", "b1", "i0", "i1"]
+
+    # Batch ones are throttled while interactive ones waited long
+    assert limiter.interactive_latency > 0.02
+    assert limiter.batch_limit() == 1
+    assert limiter.can_dispatch("batch")
+    limiter.active["batch"] = 1
+    assert not limiter.can_dispatch("batch")
+    assert limiter.can_dispatch("interactive")
+    limiter.active["batch"] = 0
+
+    # and resume after the latency decays
+    await asyncio.sleep(0.4)
+    assert limiter.batch_limit() == 2
+
+    with pytest.raises(ValueError):
+        await limiter.acquire("unknown")
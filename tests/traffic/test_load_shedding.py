@@ -0,0 +1,38 @@
+import asyncio
+import time
+import pytest
+from speech_gateway.traffic import EventLoopLagMonitor, LoadSheddingPolicy
+
+
+@pytest.mark.asyncio
+async def test_lag_monitor():
+    monitor = EventLoopLagMonitor(interval=0.01)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    assert monitor.lag < 0.1
+
+    # Block the event loop synchronously
+    time.sleep(0.3)
+    await asyncio.sleep(0.02)
+    assert monitor.lag >= 0.2
+    assert monitor.max_lag >= 0.2
+
+    # Lag decays after the stall
+    await asyncio.sleep(0.5)
+    assert monitor.lag < 0.1
+
+    await monitor.stop()
+    assert not monitor.running
+
+
+def test_load_shedding_policy():
+    monitor = EventLoopLagMonitor()
+    policy = LoadSheddingPolicy(max_loop_lag=0.5, max_in_flight=10, lag_monitor=monitor)
+    assert not policy.is_overloaded(9)
+    assert policy.is_overloaded(10)
+
+    monitor.lag = 0.6
+    assert policy.is_overloaded(0)
+
+    with pytest.raises(ValueError):
+        LoadSheddingPolicy(mode="unknown")
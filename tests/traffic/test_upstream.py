@@ -0,0 +1,54 @@
+import httpx
+import pytest
+from speech_gateway.traffic import UpstreamPool
+
+
+def test_least_outstanding():
+    pool = UpstreamPool(["http://a", "http://b", "http://c"])
+
+    # Round robin while idle
+    upstreams = [pool.acquire() for _ in range(3)]
+    assert sorted(u.base_url for u in upstreams) == ["http://a", "http://b", "http://c"]
+
+    pool.release(upstreams[0])
+    assert pool.acquire() is upstreams[0]
+    pool.release(upstreams[1])
+    assert upstreams[1].outstanding == 0
+    assert pool.select() is upstreams[1]
+
+
+@pytest.mark.asyncio
+async def test_health_check():
+    status = {"http://a": 200, "http://b": 200}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/version"
+        return httpx.Response(status[f"http://{request.url.host}"])
+
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    pool = UpstreamPool(["http://a", "http://b"], health_check_path="/version", unhealthy_threshold=2, healthy_threshold=2)
+    a, b = pool.upstreams
+
+    # Ejected after consecutive failures
+    status["http://b"] = 500
+    await pool.check(http_client)
+    assert b.healthy
+    await pool.check(http_client)
+    assert not b.healthy
+    assert all(pool.acquire() is a for _ in range(3))
+
+    # Readmitted after consecutive successes
+    status["http://b"] = 200
+    await pool.check(http_client)
+    assert not b.healthy
+    await pool.check(http_client)
+    assert b.healthy
+    assert pool.acquire() is b
+
+    # All upstreams are used when none is healthy
+    status["http://a"] = status["http://b"] = 500
+    await pool.check(http_client)
+    await pool.check(http_client)
+    assert pool.acquire() in pool.upstreams
+
+    await http_client.aclose()